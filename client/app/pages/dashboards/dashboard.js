@@ -31,6 +31,7 @@ function DashboardCtrl(
   Title,
   AlertDialog,
   Dashboard,
+  Query,
   currentUser,
   clientConfig,
   Events,
@@ -118,6 +119,11 @@ function DashboardCtrl(
   };
 
   const collectFilters = (dashboard, forceRefresh) => {
+    if (!forceRefresh) {
+      // The stored results of all the widgets are loaded with a single request, instead of one per widget.
+      Query.loadLatestResults(_.compact(this.dashboard.widgets.map(widget => widget.getQuery())));
+    }
+
     const queryResultPromises = _.compact(this.dashboard.widgets.map(widget => widget.loadPromise(forceRefresh)));
 
     $q.all(queryResultPromises).then((queryResults) => {
@@ -54,6 +54,7 @@ function addPointToSeries(point, seriesCollection, seriesName) {
 
 function QueryResultService($resource, $timeout, $q) {
   const QueryResultResource = $resource('api/query_results/:id', { id: '@id' }, { post: { method: 'POST' } });
+  const QueryResultBatch = $resource('api/query_results/batch');
   const Job = $resource('api/jobs/:id', { id: '@id' });
   const statuses = {
     1: 'waiting',
@@ -421,6 +422,37 @@ function QueryResultService($resource, $timeout, $q) {
       return queryResult;
     }
 
+    // Loads several query results with a single request. Returns the query results by id.
+    static getByIds(ids) {
+      ids = uniq(ids);
+      const queryResults = {};
+      each(ids, (id) => {
+        queryResults[id] = new QueryResult();
+      });
+
+      QueryResultBatch.get({ query_results: ids.join(',') }, (response) => {
+        each(response.query_results, (item, i) => {
+          if ('error' in item) {
+            queryResults[ids[i]].update({ job: { error: item.error, status: 4 } });
+          } else {
+            queryResults[ids[i]].update({ query_result: item.query_result });
+          }
+        });
+      }, (error) => {
+        logger('Connection error while trying to load results', error);
+        each(queryResults, (queryResult) => {
+          queryResult.update({
+            job: {
+              error: 'failed communicating with server. Please check your Internet connection and try again.',
+              status: 4,
+            },
+          });
+        });
+      });
+
+      return queryResults;
+    }
+
     loadResult(tryCount) {
       QueryResultResource.get(
         { id: this.job.query_result_id },
@@ -479,13 +511,16 @@ function QueryResultService($resource, $timeout, $q) {
       return `${queryName.replace(' ', '_') + moment(this.getUpdatedAt()).format('_YYYY_MM_DD')}.${fileType}`;
     }
 
-    static get(dataSourceId, query, maxAge, queryId) {
+    static get(dataSourceId, query, maxAge, queryId, priority) {
       const queryResult = new QueryResult();
 
       const params = { data_source_id: dataSourceId, query, max_age: maxAge };
       if (queryId !== undefined) {
         params.query_id = queryId;
       }
+      if (priority !== undefined) {
+        params.priority = priority;
+      }
 
       QueryResultResource.post(params, (response) => {
         queryResult.update(response);
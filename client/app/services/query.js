@@ -261,7 +261,23 @@ function QueryResource($resource, $http, $q, $location, currentUser, QueryResult
     return this.getParameters().isRequired();
   };
 
-  Query.prototype.getQueryResult = function getQueryResult(maxAge) {
+  // Loads the latest results of the queries (the ones getQueryResult would load by id) with a single request.
+  Query.loadLatestResults = function loadLatestResults(queries) {
+    queries = filter(queries, (query) => {
+      const loaded = query.queryResult || query.latest_query_data;
+      return !loaded && query.latest_query_data_id && !query.getParameters().isRequired();
+    });
+    if (queries.length === 0) {
+      return;
+    }
+
+    const queryResults = QueryResult.getByIds(pluck(queries, 'latest_query_data_id'));
+    each(queries, (query) => {
+      query.queryResult = queryResults[query.latest_query_data_id];
+    });
+  };
+
+  Query.prototype.getQueryResult = function getQueryResult(maxAge, priority) {
     if (!this.query) {
       return new QueryResultError("Can't execute empty query.");
     }
@@ -305,7 +321,7 @@ function QueryResource($resource, $http, $q, $location, currentUser, QueryResult
         this.queryResult = QueryResult.getById(this.latest_query_data_id);
       }
     } else if (this.data_source_id) {
-      this.queryResult = QueryResult.get(this.data_source_id, queryText, maxAge, this.id);
+      this.queryResult = QueryResult.get(this.data_source_id, queryText, maxAge, this.id, priority);
     } else {
       return new QueryResultError('Please select data source to run this query.');
     }
@@ -42,7 +42,8 @@ function Widget($resource, $http, Query, Visualization, dashboardGridOptions) {
       if (maxAge === undefined || force) {
         maxAge = force ? 0 : undefined;
       }
-      this.queryResult = this.getQuery().getQueryResult(maxAge);
+      // Queries of dashboard widgets go behind the ones users run interactively.
+      this.queryResult = this.getQuery().getQueryResult(maxAge, 'dashboard');
     }
 
     return this.queryResult;
@@ -0,0 +1,42 @@
+"""Add QueryResult.data_location and data_checksum for results kept in external storage.
+
+Revision ID: 3f5b2a8c91d4
+Revises: 78c7dd419fed
+Create Date: 2026-10-18 05:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f5b2a8c91d4'
+down_revision = '78c7dd419fed'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('query_results', sa.Column('data_location', sa.String(length=255), nullable=True))
+    op.add_column('query_results', sa.Column('data_checksum', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    # Results kept in the external storage are moved back to the table first (failing if the storage can't be read).
+    from redash.results import storage
+
+    conn = op.get_bind()
+    query_results = sa.table('query_results',
+                             sa.column('id', sa.Integer),
+                             sa.column('encoded_data', sa.LargeBinary),
+                             sa.column('data_location', sa.String))
+
+    stored = conn.execute(sa.select([query_results.c.id, query_results.c.data_location])
+                          .where(query_results.c.data_location != None))
+    for result_id, location in stored.fetchall():
+        conn.execute(query_results.update()
+                     .where(query_results.c.id == result_id)
+                     .values(encoded_data=storage.load(location)[:], data_location=None))
+
+    op.drop_column('query_results', 'data_checksum')
+    op.drop_column('query_results', 'data_location')
@@ -0,0 +1,45 @@
+"""Add QueryResult.encoded_data for compressed, column oriented results.
+
+Existing results keep working from the data column; convert them with `manage.py database encode_query_results`.
+
+Revision ID: 78c7dd419fed
+Revises: 969126bd800f
+Create Date: 2026-10-18 03:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '78c7dd419fed'
+down_revision = '969126bd800f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('query_results', sa.Column('encoded_data', sa.LargeBinary(), nullable=True))
+    op.alter_column('query_results', 'data', existing_type=sa.Text(), nullable=True)
+
+
+def downgrade():
+    from redash.results import decode
+    from redash.utils import json_dumps
+
+    conn = op.get_bind()
+    query_results = sa.table('query_results',
+                             sa.column('id', sa.Integer),
+                             sa.column('data', sa.Text),
+                             sa.column('encoded_data', sa.LargeBinary))
+
+    encoded = conn.execute(sa.select([query_results.c.id]).where(query_results.c.encoded_data != None))
+    for result_id, in encoded.fetchall():
+        payload = conn.execute(sa.select([query_results.c.encoded_data])
+                               .where(query_results.c.id == result_id)).scalar()
+        conn.execute(query_results.update()
+                     .where(query_results.c.id == result_id)
+                     .values(data=json_dumps(decode(payload))))
+
+    op.drop_column('query_results', 'encoded_data')
+    op.alter_column('query_results', 'data', existing_type=sa.Text(), nullable=False)
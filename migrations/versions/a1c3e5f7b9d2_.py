@@ -0,0 +1,24 @@
+"""Add DataSource.row_limit.
+
+Revision ID: a1c3e5f7b9d2
+Revises: f7a9b1c3d5e8
+Create Date: 2026-10-18 15:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c3e5f7b9d2'
+down_revision = 'f7a9b1c3d5e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('data_sources', sa.Column('row_limit', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('data_sources', 'row_limit')
@@ -0,0 +1,74 @@
+"""Add Query.next_run_at, so the scheduler only loads the queries that are due.
+
+Revision ID: a8b2d4e6f013
+Revises: 3f5b2a8c91d4
+Create Date: 2026-10-18 09:40:00.000000
+
+"""
+import datetime
+import logging
+
+from alembic import op
+import pytz
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8b2d4e6f013'
+down_revision = '3f5b2a8c91d4'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def next_run_time(previous_iteration, schedule, failures):
+    # Copy of redash.models.next_run_time at the time of this migration.
+    if schedule.isdigit():
+        next_iteration = previous_iteration + datetime.timedelta(seconds=int(schedule))
+    else:
+        hour, minute = schedule.split(':')
+        hour, minute = int(hour), int(minute)
+
+        normalized_previous_iteration = previous_iteration.replace(hour=hour, minute=minute)
+        if normalized_previous_iteration > previous_iteration:
+            previous_iteration = normalized_previous_iteration - datetime.timedelta(days=1)
+
+        next_iteration = (previous_iteration + datetime.timedelta(days=1)).replace(hour=hour, minute=minute)
+    if failures:
+        next_iteration += datetime.timedelta(minutes=2**failures)
+    return next_iteration
+
+
+def upgrade():
+    op.add_column('queries', sa.Column('next_run_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index(op.f('ix_queries_next_run_at'), 'queries', ['next_run_at'], unique=False)
+
+    conn = op.get_bind()
+    scheduled_queries = conn.execute(sa.text("""
+        SELECT queries.id, queries.schedule, queries.schedule_failures, query_results.retrieved_at
+        FROM queries JOIN query_results ON query_results.id = queries.latest_query_data_id
+        WHERE queries.schedule IS NOT NULL""")).fetchall()
+
+    # The last attempt of failing queries isn't recorded in the database (only their last result is), so they're
+    # considered attempted now and backed off from this time, instead of all being due at once.
+    now = datetime.datetime.now(pytz.utc)
+
+    logger.info("Computing next run time of %s scheduled queries.", len(scheduled_queries))
+    for query_id, schedule, failures, retrieved_at in scheduled_queries:
+        try:
+            next_run_at = next_run_time(retrieved_at, schedule, failures)
+        except ValueError:
+            logger.warning("Skipping query %s with invalid schedule: %s", query_id, schedule)
+            continue
+
+        if failures:
+            next_run_at = max(next_run_at, now + datetime.timedelta(minutes=2**failures))
+
+        conn.execute(sa.text("UPDATE queries SET next_run_at = :next_run_at WHERE id = :id"),
+                     next_run_at=next_run_at, id=query_id)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_queries_next_run_at'), table_name='queries')
+    op.drop_column('queries', 'next_run_at')
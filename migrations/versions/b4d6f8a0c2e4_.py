@@ -0,0 +1,23 @@
+"""Index QueryResult.data_location, to find the external storage payloads no result refers to.
+
+Revision ID: b4d6f8a0c2e4
+Revises: a1c3e5f7b9d2
+Create Date: 2026-10-18 19:40:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4d6f8a0c2e4'
+down_revision = 'a1c3e5f7b9d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_query_results_data_location'), 'query_results', ['data_location'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_query_results_data_location'), table_name='query_results')
@@ -0,0 +1,24 @@
+"""Add DataSource.concurrency_limit.
+
+Revision ID: c4d6e8f0a1b2
+Revises: a8b2d4e6f013
+Create Date: 2026-10-18 11:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d6e8f0a1b2'
+down_revision = 'a8b2d4e6f013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('data_sources', sa.Column('concurrency_limit', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('data_sources', 'concurrency_limit')
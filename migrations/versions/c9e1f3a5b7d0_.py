@@ -0,0 +1,24 @@
+"""Add QueryResult.data_size, the size of results stored in the external storage.
+
+Revision ID: c9e1f3a5b7d0
+Revises: b4d6f8a0c2e4
+Create Date: 2026-10-18 21:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e1f3a5b7d0'
+down_revision = 'b4d6f8a0c2e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('query_results', sa.Column('data_size', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('query_results', 'data_size')
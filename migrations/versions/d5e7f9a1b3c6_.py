@@ -0,0 +1,23 @@
+"""Add an index on queries (query_hash, data_source_id), used when attaching new results to queries.
+
+Revision ID: d5e7f9a1b3c6
+Revises: c4d6e8f0a1b2
+Create Date: 2026-10-18 12:20:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e7f9a1b3c6'
+down_revision = 'c4d6e8f0a1b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('queries_query_hash_data_source_id', 'queries', ['query_hash', 'data_source_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('queries_query_hash_data_source_id', table_name='queries')
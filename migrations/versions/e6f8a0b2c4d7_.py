@@ -0,0 +1,25 @@
+"""Add indexes on query_results.retrieved_at and queries.latest_query_data_id, used to find unused query results.
+
+Revision ID: e6f8a0b2c4d7
+Revises: d5e7f9a1b3c6
+Create Date: 2026-10-18 13:05:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f8a0b2c4d7'
+down_revision = 'd5e7f9a1b3c6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_query_results_retrieved_at'), 'query_results', ['retrieved_at'], unique=False)
+    op.create_index(op.f('ix_queries_latest_query_data_id'), 'queries', ['latest_query_data_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_queries_latest_query_data_id'), table_name='queries')
+    op.drop_index(op.f('ix_query_results_retrieved_at'), table_name='query_results')
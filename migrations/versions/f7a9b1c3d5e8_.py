@@ -0,0 +1,24 @@
+"""Add query_results.alert_values, the first row values alerts are evaluated against.
+
+Revision ID: f7a9b1c3d5e8
+Revises: e6f8a0b2c4d7
+Create Date: 2026-10-18 13:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a9b1c3d5e8'
+down_revision = 'e6f8a0b2c4d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('query_results', sa.Column('alert_values', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('query_results', 'alert_values')
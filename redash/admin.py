@@ -50,7 +50,7 @@ class BaseModelView(ModelView):
 
 
 class QueryResultModelView(BaseModelView):
-    column_exclude_list = ('data',)
+    column_exclude_list = ('_data', 'encoded_data')
 
 
 class QueryModelView(BaseModelView):
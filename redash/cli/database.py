@@ -1,3 +1,5 @@
+from __future__ import print_function
+from click import option
 from flask.cli import AppGroup
 from flask_migrate import stamp
 manager = AppGroup(help="Manage the database (create/drop tables).")
@@ -19,3 +21,54 @@ def drop_tables():
     from redash.models import db
 
     db.drop_all()
+
+
+@manager.command()
+@option('--batch-size', 'batch_size', default=100,
+        help="Number of query results to convert per transaction.")
+def encode_query_results(batch_size=100):
+    """Convert query results stored as JSON text to the compressed encoding."""
+    from redash.models import QueryResult, db
+
+    converted = 0
+    skipped = 0
+    last_id = 0
+
+    while True:
+        query_results = (QueryResult.query
+                         .filter(QueryResult._data != None, QueryResult.id > last_id)
+                         .order_by(QueryResult.id)
+                         .limit(batch_size)
+                         .all())
+
+        if not query_results:
+            break
+
+        for query_result in query_results:
+            # Assigning the data again encodes it, unless it's not a valid query result:
+            query_result.data = query_result._data
+            if query_result.encoded_data is None:
+                skipped += 1
+            else:
+                converted += 1
+
+        last_id = query_results[-1].id
+        db.session.commit()
+        db.session.expunge_all()
+        print("Converted {} query results ({} skipped).".format(converted, skipped))
+
+
+@manager.command()
+@option('--max-age', 'max_age', default=None, type=int,
+        help="Delete unused query results that are this many days old or more "
+             "(defaults to REDASH_QUERY_RESULTS_CLEANUP_MAX_AGE).")
+@option('--time-limit', 'time_limit', default=0,
+        help="Stop after this many seconds (0 to run until there is nothing left to delete).")
+def cleanup_query_results(max_age=None, time_limit=0):
+    """Delete unused query results."""
+    from redash.results.gc import QueryResultsCollector
+
+    collector = QueryResultsCollector(max_age=max_age, time_limit=time_limit)
+    deleted = collector.run()
+    print("Deleted {} query results ({} bytes), {} left to delete.".format(
+        deleted, collector.reclaimed_bytes, collector.backlog()))
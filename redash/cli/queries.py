@@ -0,0 +1,125 @@
+from __future__ import print_function
+import heapq
+import json
+import uuid
+from collections import defaultdict
+
+import click
+from flask.cli import AppGroup
+
+manager = AppGroup(help="Queries management commands.")
+
+
+@manager.command()
+@click.argument('output', type=click.File('w'))
+@click.option('--limit', default=1000,
+              help="Maximum number of finished jobs to export.")
+def export_job_mix(output, limit=1000):
+    """Export recently finished query jobs, to replay them with benchmark_scheduling."""
+    from redash.tasks.queries import QueryTaskTracker
+
+    trackers = QueryTaskTracker.all(QueryTaskTracker.DONE_LIST, limit=limit)
+    exported = 0
+    for tracker in sorted(trackers, key=lambda t: t.created_at):
+        if tracker.data.get('run_time') is None:
+            continue
+
+        output.write(json.dumps({
+            'arrival': tracker.created_at,
+            'run_time': tracker.run_time,
+            'priority': tracker.data.get('priority', 'interactive'),
+            'fair_share': tracker.data.get('fair_share', {})
+        }) + '\n')
+        exported += 1
+
+    print("Exported {} jobs.".format(exported))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(round(p / 100.0 * (len(values) - 1)))]
+
+
+def replay_job_mix(jobs, concurrency_limit, tick=1.0):
+    """
+    Replays jobs (dicts with their arrival time, run time, priority and fair share costs) against a data source
+    semaphore, on a simulated clock. Returns the time every job waited for a slot, by priority.
+    """
+    from redash import redis_connection
+    from redash.tasks.queries import DataSourceSemaphore
+
+    data_source_id = 'benchmark-{}'.format(uuid.uuid4().hex)
+    pending = sorted(jobs, key=lambda job: job['arrival'])
+    pending.reverse()
+    waiting = []
+    running = []
+    started = 0
+    wait_times = defaultdict(list)
+    now = pending[-1]['arrival'] if pending else 0
+
+    try:
+        while pending or waiting or running:
+            while running and running[0][0] <= now:
+                heapq.heappop(running)[2].release()
+
+            while pending and pending[-1]['arrival'] <= now:
+                job = pending.pop()
+                semaphore = DataSourceSemaphore(data_source_id, concurrency_limit, uuid.uuid4().hex,
+                                                priority=job.get('priority', 'interactive'),
+                                                fair_share=job.get('fair_share'))
+                waiting.append((job, semaphore))
+
+            # Jobs are let in by priority, not in the order they check, so check again as long as some get a slot:
+            admitted = True
+            while waiting and admitted:
+                still_waiting = []
+                for job, semaphore in waiting:
+                    acquired, _ = semaphore.try_acquire(now=now)
+                    if acquired:
+                        wait_times[semaphore.priority].append(now - job['arrival'])
+                        heapq.heappush(running, (now + job['run_time'], started, semaphore))
+                        started += 1
+                    else:
+                        still_waiting.append((job, semaphore))
+
+                admitted = len(still_waiting) < len(waiting)
+                waiting = still_waiting
+
+            next_events = []
+            if pending:
+                next_events.append(pending[-1]['arrival'])
+            if running:
+                next_events.append(running[0][0])
+
+            if waiting or not next_events:
+                now += tick
+            else:
+                # Nothing is waiting, skip to the next arrival or the next job to finish:
+                now = max(now + tick, min(next_events))
+    finally:
+        redis_connection.delete(*DataSourceSemaphore(data_source_id, concurrency_limit, None)._keys())
+
+    return wait_times
+
+
+@manager.command()
+@click.argument('job_mix', type=click.File('r'))
+@click.option('--concurrency-limit', 'concurrency_limit', default=5,
+              help="Maximum number of queries running at the same time.")
+@click.option('--tick', default=1.0,
+              help="Seconds between the times waiting jobs check for a slot.")
+def benchmark_scheduling(job_mix, concurrency_limit=5, tick=1.0):
+    """
+    Replay a job mix (as exported by export_job_mix: one JSON object per line, with the arrival time, run time,
+    priority and fair share costs of a job) and report the time jobs waited for a slot, by priority.
+    """
+    from redash.tasks.queries import QUERY_PRIORITIES
+
+    jobs = [json.loads(line) for line in job_mix if line.strip()]
+    wait_times = replay_job_mix(jobs, concurrency_limit, tick)
+
+    print("{:<12} {:>8} {:>10} {:>10} {:>10}".format("priority", "jobs", "p50", "p99", "max"))
+    for priority in sorted(wait_times, key=lambda p: (QUERY_PRIORITIES + (p,)).index(p)):
+        values = wait_times[priority]
+        print("{:<12} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            priority, len(values), percentile(values, 50), percentile(values, 99), max(values)))
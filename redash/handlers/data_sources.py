@@ -15,6 +15,17 @@ from redash.utils import filter_none
 from redash.utils.configuration import ConfigurationContainer, ValidationError
 
 
+def get_limit(req, name, default=None):
+    limit = req.get(name, default)
+    if limit is None:
+        return None
+
+    if isinstance(limit, bool) or not isinstance(limit, (int, long)) or limit < 0:
+        abort(400, message="{} should be a non-negative integer or null.".format(name))
+
+    return limit
+
+
 class DataSourceTypeListResource(BaseResource):
     @require_admin
     def get(self):
@@ -43,6 +54,8 @@ class DataSourceResource(BaseResource):
 
         data_source.type = req['type']
         data_source.name = req['name']
+        data_source.concurrency_limit = get_limit(req, 'concurrency_limit', data_source.concurrency_limit)
+        data_source.row_limit = get_limit(req, 'row_limit', data_source.row_limit)
         models.db.session.add(data_source)
 
         try:
@@ -98,6 +111,8 @@ class DataSourceListResource(BaseResource):
             abort(400)
 
         config = ConfigurationContainer(filter_none(req['options']), schema)
+        concurrency_limit = get_limit(req, 'concurrency_limit')
+        row_limit = get_limit(req, 'row_limit')
         # from IPython import embed
         # embed()
         if not config.is_valid():
@@ -107,7 +122,9 @@ class DataSourceListResource(BaseResource):
             datasource = models.DataSource.create_with_group(org=self.current_org,
                                                              name=req['name'],
                                                              type=req['type'],
-                                                             options=config)
+                                                             options=config,
+                                                             concurrency_limit=concurrency_limit,
+                                                             row_limit=row_limit)
 
             models.db.session.commit()
         except IntegrityError as e:
@@ -127,28 +144,72 @@ class DataSourceListResource(BaseResource):
 
 class DataSourceSchemaResource(BaseResource):
     def get(self, data_source_id):
+        """
+        Retrieve the schema of a data source.
+
+        :qparam refresh: Reload the schema from the data source
+        :qparam string q: Only return the tables whose name contains this
+        :qparam number page: Page number to retrieve
+        :qparam number page_size: Number of tables to return
+        :qparam string table: Name of a table to return (can be repeated)
+
+        Without any of q, page, page_size and table, responds with all the tables and their columns. With q, page or
+        page_size, responds with a page of table names (without columns) and the number of matching tables. With
+        table, responds with the given tables and their columns.
+        """
         data_source = get_object_or_404(models.DataSource.get_by_id_and_org, data_source_id, self.current_org)
         require_access(data_source.groups, self.current_user, view_only)
         refresh = request.args.get('refresh') is not None
+        tables = request.args.getlist('table')
+        paged = any(arg in request.args for arg in ('q', 'page', 'page_size'))
 
         response = {}
 
         try:
-            response['schema'] = data_source.get_schema(refresh)
+            cache = data_source.get_schema_cache(refresh)
         except NotSupported:
             response['error'] = {
                 'code': 1,
                 'message': 'Data source type does not support retrieving schema'
             }
+            return response
         except Exception:
             response['error'] = {
                 'code': 2,
                 'message': 'Error retrieving schema.'
             }
+            return response
+
+        if paged:
+            response.update(paginate_schema(cache, request.args.get('q'), request.args.get('page', 1, type=int),
+                                            request.args.get('page_size', 100, type=int)))
+        else:
+            response['schema'] = cache.get_tables(tables or None)
+        response['version'] = cache.version
 
         return response
 
 
+def paginate_schema(cache, term, page, page_size):
+    if page < 1:
+        abort(400, message='Page must be positive integer.')
+
+    if page_size > 1000 or page_size < 1:
+        abort(400, message='Page size is out of range (1-1000).')
+
+    count, names = cache.search(term, (page - 1) * page_size, page_size)
+
+    if (page - 1) * page_size + 1 > count > 0:
+        abort(400, message='Page is out of range.')
+
+    return {
+        'count': count,
+        'page': page,
+        'page_size': page_size,
+        'schema': [{'name': name} for name in names]
+    }
+
+
 class DataSourcePauseResource(BaseResource):
     @require_admin
     def post(self, data_source_id):
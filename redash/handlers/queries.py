@@ -10,7 +10,7 @@ from sqlalchemy.orm.exc import StaleDataError
 from redash import models, settings
 from redash.handlers.base import (BaseResource, get_object_or_404,
                                   org_scoped_rule, paginate, routes)
-from redash.handlers.query_results import run_query
+from redash.handlers.query_results import get_priority, run_query
 from redash.permissions import (can_modify, not_view_only, require_access,
                                 require_admin_or_owner,
                                 require_object_modify_permission,
@@ -270,6 +270,8 @@ class QueryRefreshResource(BaseResource):
         Execute a query, updating the query object with the results.
 
         :param query_id: ID of query to execute
+        :qparam string priority: Priority class of the query: one of 'interactive' (default), 'dashboard',
+                                 'scheduled' or 'backfill'
 
         Responds with query task details.
         """
@@ -283,5 +285,6 @@ class QueryRefreshResource(BaseResource):
         require_access(query.groups, self.current_user, not_view_only)
 
         parameter_values = collect_parameters_from_request(request.args)
+        priority = get_priority(request.args.get('priority'))
 
-        return run_query(query.data_source, parameter_values, query.query_text, query.id)
+        return run_query(query.data_source, parameter_values, query.query_text, query.id, priority=priority)
@@ -1,17 +1,20 @@
+import hashlib
+import itertools
 import logging
-import json
+import tempfile
 import time
 
 import pystache
-from flask import make_response, request
+from flask import Response, make_response, request, stream_with_context
 from flask_login import current_user
 from flask_restful import abort
+from werkzeug.wsgi import wrap_file
 from redash import models, settings, utils
 from redash.tasks import QueryTask, record_event
 from redash.permissions import require_permission, not_view_only, has_access, require_access, view_only
 from redash.handlers.base import BaseResource, get_object_or_404
-from redash.utils import collect_query_parameters, collect_parameters_from_request, gen_query_hash
-from redash.tasks.queries import enqueue_query
+from redash.utils import collect_query_parameters, collect_parameters_from_request, gen_query_hash, json_dumps
+from redash.tasks.queries import QUERY_PRIORITIES, enqueue_query
 
 
 def error_response(message):
@@ -24,6 +27,27 @@ def error_response(message):
 #             removed once we refactor the query results API endpoints and handling
 #             on the client side. Please don't reuse in other API handlers.
 #
+def record_api_event(user, org, object_type, object_id, filetype):
+    """
+    Records an API key's access to a query (or query result) for the events log. Users' accesses aren't recorded.
+    """
+    if not isinstance(user, models.ApiUser):
+        return
+
+    record_event.delay({
+        'user_id': None,
+        'org_id': org.id,
+        'action': 'api_get',
+        'timestamp': int(time.time()),
+        'api_key': user.name,
+        'file_type': filetype,
+        'user_agent': request.user_agent.string,
+        'ip': request.remote_addr,
+        'object_type': object_type,
+        'object_id': object_id
+    })
+
+
 def run_query_sync(data_source, parameter_values, query_text, max_age=0):
     query_parameters = set(collect_query_parameters(query_text))
     missing_params = set(query_parameters) - set(parameter_values.keys())
@@ -67,7 +91,14 @@ def run_query_sync(data_source, parameter_values, query_text, max_age=0):
             abort(503, message="Unable to get result from the database.")
         return None
 
-def run_query(data_source, parameter_values, query_text, query_id, max_age=0):
+def get_priority(priority):
+    if priority is not None and priority not in QUERY_PRIORITIES:
+        abort(400, message="Unknown priority: {}.".format(priority))
+
+    return priority
+
+
+def run_query(data_source, parameter_values, query_text, query_id, max_age=0, priority=None):
     query_parameters = set(collect_query_parameters(query_text))
     missing_params = set(query_parameters) - set(parameter_values.keys())
     if missing_params:
@@ -92,7 +123,8 @@ def run_query(data_source, parameter_values, query_text, query_id, max_age=0):
     if query_result:
         return {'query_result': query_result.to_dict()}
     else:
-        job = enqueue_query(query_text, data_source, current_user.id, metadata={"Username": current_user.email, "Query ID": query_id})
+        job = enqueue_query(query_text, data_source, current_user.id,
+                            metadata={"Username": current_user.email, "Query ID": query_id}, priority=priority)
         return {'job': job.to_dict()}
 
 
@@ -106,6 +138,8 @@ class QueryResultListResource(BaseResource):
         :qparam number query_id: The query object to update with the result (optional)
         :qparam number max_age: If query results less than `max_age` seconds old are available, return them, otherwise execute the query; if omitted, always execute
         :qparam number data_source_id: ID of data source to query
+        :qparam string priority: Priority class of the query: one of 'interactive' (default), 'dashboard',
+                                 'scheduled' or 'backfill'
         """
         params = request.get_json(force=True)
         parameter_values = collect_parameters_from_request(request.args)
@@ -113,6 +147,7 @@ class QueryResultListResource(BaseResource):
         query = params['query']
         max_age = int(params.get('max_age', -1))
         query_id = params.get('query_id', 'adhoc')
+        priority = get_priority(params.get('priority'))
 
         data_source = models.DataSource.get_by_id_and_org(params.get('data_source_id'), self.current_org)
 
@@ -126,7 +161,7 @@ class QueryResultListResource(BaseResource):
             'object_type': 'data_source',
             'query': query
         })
-        return run_query(data_source, parameter_values, query, query_id, max_age)
+        return run_query(data_source, parameter_values, query, query_id, max_age, priority)
 
 
 ONE_YEAR = 60 * 60 * 24 * 365.25
@@ -163,6 +198,9 @@ class QueryResultResource(BaseResource):
         :param number query_id: The ID of the query whose results should be fetched
         :param number query_result_id: the ID of the query result to fetch
         :param string filetype: Format to return. One of 'json', 'xlsx', or 'csv'. Defaults to 'json'.
+        :qparam number offset: (JSON only) Index of the first row to return
+        :qparam number limit: (JSON only) Maximum number of rows to return
+        :qparam string columns: (JSON only) Comma separated names of the columns to return
 
         :<json number id: Query result ID
         :<json string query: Query that produced this result
@@ -171,12 +209,14 @@ class QueryResultResource(BaseResource):
         :<json number data_source_id: ID of data source that produced this result
         :<json number runtime: Length of execution time in seconds
         :<json string retrieved_at: Query retrieval date/time, in ISO format
+        :<json number row_count: Total number of rows, when offset, limit or columns are given
         """
         # TODO:
         # This method handles two cases: retrieving result by id & retrieving result by query id.
         # They need to be split, as they have different logic (for example, retrieving by query id
         # should check for query parameters and shouldn't cache the result).
         should_cache = query_result_id is not None
+        offset, limit, columns = self.get_pagination_args()
 
         parameter_values = collect_parameters_from_request(request.args)
         max_age = int(request.args.get('maxAge', 0))
@@ -202,34 +242,28 @@ class QueryResultResource(BaseResource):
         if query_result:
             require_access(query_result.data_source.groups, self.current_user, view_only)
 
-            if isinstance(self.current_user, models.ApiUser):
-                event = {
-                    'user_id': None,
-                    'org_id': self.current_org.id,
-                    'action': 'api_get',
-                    'timestamp': int(time.time()),
-                    'api_key': self.current_user.name,
-                    'file_type': filetype,
-                    'user_agent': request.user_agent.string,
-                    'ip': request.remote_addr
-                }
-
-                if query_id:
-                    event['object_type'] = 'query'
-                    event['object_id'] = query_id
-                else:
-                    event['object_type'] = 'query_result'
-                    event['object_id'] = query_result_id
-
-                record_event.delay(event)
-
-            if filetype == 'json':
-                response = self.make_json_response(query_result)
+            if query_id:
+                record_api_event(self.current_user, self.current_org, 'query', query_id, filetype)
+            else:
+                record_api_event(self.current_user, self.current_org, 'query_result', query_result_id, filetype)
+
+            # A query result never changes once stored, so its id identifies the response content.
+            etag = 'query-result-{}-{}'.format(query_result.id, filetype)
+            if filetype == 'json' and (offset or limit is not None or columns is not None):
+                columns_hash = hashlib.md5(','.join(columns or []).encode('utf-8')).hexdigest()
+                etag += '-{}-{}-{}'.format(offset, limit, columns_hash)
+
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            elif filetype == 'json':
+                response = self.make_json_response(query_result, offset, limit, columns)
             elif filetype == 'xlsx':
                 response = self.make_excel_response(query_result)
             else:
                 response = self.make_csv_response(query_result)
 
+            response.set_etag(etag)
+
             if len(settings.ACCESS_CONTROL_ALLOW_ORIGIN) > 0:
                 self.add_cors_headers(response.headers)
 
@@ -241,20 +275,120 @@ class QueryResultResource(BaseResource):
         else:
             abort(404, message='No cached result found for this query.')
 
-    def make_json_response(self, query_result):
-        data = json.dumps({'query_result': query_result.to_dict()}, cls=utils.JSONEncoder)
+    @staticmethod
+    def get_pagination_args():
+        try:
+            offset = int(request.args.get('offset', 0))
+            limit = request.args.get('limit')
+            limit = int(limit) if limit is not None else None
+        except ValueError:
+            abort(400, message='Offset and limit must be integers.')
+
+        if offset < 0 or (limit is not None and limit < 0):
+            abort(400, message='Offset and limit must not be negative.')
+
+        columns = request.args.get('columns')
+        if columns is not None:
+            columns = [name for name in columns.split(',') if name]
+
+        return offset, limit, columns
+
+    def make_json_response(self, query_result, offset=0, limit=None, columns=None):
+        data = itertools.chain(['{"query_result": '], query_result.iter_json(offset, limit, columns), ['}'])
         headers = {'Content-Type': "application/json"}
-        return make_response(data, 200, headers)
+        return Response(data, 200, headers)
 
     @staticmethod
     def make_csv_response(query_result):
+        # Streamed as it's generated, so large results are never rendered in memory in one piece.
         headers = {'Content-Type': "text/csv; charset=UTF-8"}
-        return make_response(query_result.make_csv_content(), 200, headers)
+        return Response(query_result.iter_csv_content(), 200, headers)
 
     @staticmethod
     def make_excel_response(query_result):
+        # XLSX files can't be streamed as they're written (it's a zip archive), so the workbook is built in a
+        # temporary file which is then sent in chunks and removed once the response is closed.
+        f = tempfile.TemporaryFile()
+        query_result.write_excel_content(f)
+        f.seek(0)
         headers = {'Content-Type': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
-        return make_response(query_result.make_excel_content(), 200, headers)
+        return Response(wrap_file(request.environ, f), 200, headers, direct_passthrough=True)
+
+
+def parse_ids(value, name):
+    try:
+        return [int(i) for i in value.split(',') if i]
+    except ValueError:
+        abort(400, message='{} must be a comma separated list of IDs.'.format(name))
+
+
+class QueryResultBatchResource(BaseResource):
+    @require_permission('view_query')
+    def get(self):
+        """
+        Retrieve several query results in one request: the latest results of the queries of a dashboard or of a list
+        of queries, or a list of query results. Results are loaded with a single database query and access is checked
+        once per data source.
+
+        :qparam string dashboard: Slug of the dashboard whose queries' results should be fetched
+        :qparam string queries: Comma separated IDs of the queries whose latest results should be fetched
+        :qparam string query_results: Comma separated IDs of the query results to fetch
+
+        Query API keys can't be used with this endpoint, as they only give access to the results of their query.
+
+        :<json array query_results: One object per result, with the query_id (when fetched by query) and either the
+                                    query_result (as returned by the query result API) or an error message
+        """
+        if 'dashboard' in request.args:
+            dashboard = get_object_or_404(models.Dashboard.get_by_slug_and_org, request.args['dashboard'],
+                                          self.current_org)
+            items = models.QueryResult.get_latest_by_queries(self.current_org, dashboard=dashboard).all()
+        elif 'queries' in request.args:
+            query_ids = parse_ids(request.args['queries'], 'queries')
+            results = dict(models.QueryResult.get_latest_by_queries(self.current_org, query_ids=query_ids))
+            items = [(query_id, results.get(query_id)) for query_id in query_ids]
+        elif 'query_results' in request.args:
+            query_result_ids = parse_ids(request.args['query_results'], 'query_results')
+            results = {query_result.id: query_result for query_result in
+                       models.QueryResult.get_by_ids_and_org(query_result_ids, self.current_org)}
+            items = [(None, results.get(query_result_id)) for query_result_id in query_result_ids]
+        else:
+            abort(400, message='One of dashboard, queries or query_results is required.')
+
+        access = {}
+        chunks = []
+        for query_id, query_result in items:
+            if query_result is not None and query_result.data_source_id not in access:
+                access[query_result.data_source_id] = has_access(query_result.data_source.groups,
+                                                                 self.current_user, view_only)
+
+            if query_result is None:
+                error = 'No cached result found for this query.'
+            elif not access[query_result.data_source_id]:
+                error = 'You do not have access to this query result.'
+            else:
+                error = None
+
+            item = {'query_id': query_id} if query_id is not None else {}
+            if error is not None:
+                item['error'] = error
+                chunks.append([json_dumps(item)])
+            else:
+                chunks.append(self.iter_item_json(item, query_result))
+
+        separated = (itertools.chain([', '] if i > 0 else [], item) for i, item in enumerate(chunks))
+        data = itertools.chain(['{"query_results": ['], itertools.chain.from_iterable(separated), [']}'])
+        # The results are loaded while the response is streamed, which needs the request context.
+        return Response(stream_with_context(data), 200, {'Content-Type': "application/json"})
+
+    @staticmethod
+    def iter_item_json(item, query_result):
+        # The query result is spliced into the item's JSON, as in QueryResultResource.make_json_response. It's only
+        # loaded once the previous items are sent, so a single payload is held in memory at a time.
+        yield json_dumps(item)[:-1] + (', ' if item else '') + '"query_result": '
+        for chunk in query_result.iter_json():
+            yield chunk
+        yield '}'
 
 
 class JobResource(BaseResource):
@@ -1,5 +1,4 @@
 import cStringIO
-import csv
 import datetime
 import functools
 import hashlib
@@ -21,16 +20,19 @@ from redash.metrics import database  # noqa: F401
 from redash.permissions import has_access, view_only
 from redash.query_runner import (get_configuration_schema_for_query_runner_type,
                                  get_query_runner)
+from redash.results import ColumnarResult, QueryResultWriter, decode, encode_json, is_encoded
+from redash.results import storage as result_storage
+from redash.schema_cache import SchemaCache
 from redash.utils import generate_token, json_dumps
 from redash.utils.comparators import CaseInsensitiveComparator
 from redash.utils.configuration import ConfigurationContainer
 from redash.settings.organization import settings as org_settings
-from sqlalchemy import distinct, or_
+from sqlalchemy import and_, bindparam, distinct, exists, or_
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.event import listens_for
 from sqlalchemy.ext.mutable import Mutable
 from sqlalchemy.inspection import inspect
-from sqlalchemy.orm import backref, joinedload, object_session
+from sqlalchemy.orm import Session, backref, joinedload, object_session
 from sqlalchemy.orm.exc import NoResultFound  # noqa: F401
 from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm.attributes import flag_modified
@@ -76,8 +78,15 @@ class ScheduledQueriesExecutions(object):
     def __init__(self):
         self.executions = {}
 
-    def refresh(self):
-        self.executions = redis_connection.hgetall(self.KEY_NAME)
+    def refresh(self, query_ids=None):
+        if query_ids is None:
+            self.executions = redis_connection.hgetall(self.KEY_NAME)
+            return
+
+        query_ids = list(query_ids)
+        timestamps = redis_connection.hmget(self.KEY_NAME, query_ids) if query_ids else []
+        self.executions = {str(query_id): timestamp for query_id, timestamp in zip(query_ids, timestamps)
+                           if timestamp is not None}
 
     def update(self, query_id):
         redis_connection.hmset(self.KEY_NAME, {
@@ -547,6 +556,10 @@ class DataSource(BelongsToOrgMixin, db.Model):
     options = Column(ConfigurationContainer.as_mutable(Configuration))
     queue_name = Column(db.String(255), default="queries")
     scheduled_queue_name = Column(db.String(255), default="scheduled_queries")
+    # Maximum number of queries running at the same time (0 means unlimited, None uses the global default).
+    concurrency_limit = Column(db.Integer, nullable=True)
+    # Maximum number of rows fetched from the results of queries (0 means unlimited, None uses the global default).
+    row_limit = Column(db.Integer, nullable=True)
     created_at = Column(db.DateTime(True), default=db.func.now())
 
     data_source_groups = db.relationship("DataSourceGroup", back_populates="data_source",
@@ -573,6 +586,8 @@ class DataSource(BelongsToOrgMixin, db.Model):
             d['options'] = self.options.to_dict(mask_secrets=True)
             d['queue_name'] = self.queue_name
             d['scheduled_queue_name'] = self.scheduled_queue_name
+            d['concurrency_limit'] = self.concurrency_limit
+            d['row_limit'] = self.row_limit
             d['groups'] = self.groups
 
         if with_permissions_for is not None:
@@ -610,27 +625,63 @@ class DataSource(BelongsToOrgMixin, db.Model):
 
     def delete(self):
         Query.query.filter(Query.data_source == self).update(dict(data_source_id=None, latest_query_data_id=None))
+        data_locations = [location for location, in db.session.query(QueryResult.data_location).filter(
+            QueryResult.data_source == self, QueryResult.data_location != None)]
         QueryResult.query.filter(QueryResult.data_source == self).delete()
         res = db.session.delete(self)
         db.session.commit()
+        result_storage.delete(data_locations)
+        SchemaCache(self.id).delete()
         return res
 
+    def get_schema_cache(self, refresh=False):
+        """
+        Returns the SchemaCache of the data source, loading the schema into it first if it isn't cached yet (or
+        refresh is True).
+        """
+        cache = SchemaCache(self.id)
+
+        if refresh or cache.version is None:
+            cache.update(self.query_runner.get_schema(get_stats=refresh))
+
+        return cache
+
     def get_schema(self, refresh=False):
-        key = "data_source:schema:{}".format(self.id)
+        return self.get_schema_cache(refresh).get_tables()
 
-        cache = None
-        if not refresh:
-            cache = redis_connection.get(key)
+    def refresh_schema(self):
+        """
+        Reloads the schema into the cache (with the tables' sizes), unless the schema change marker of the data source
+        is the same as when it was last loaded. Returns the SchemaCache, or None if the schema wasn't reloaded.
+        """
+        cache = SchemaCache(self.id)
+        query_runner = self.query_runner
 
-        if cache is None:
-            query_runner = self.query_runner
-            schema = sorted(query_runner.get_schema(get_stats=refresh), key=lambda t: t['name'])
+        try:
+            marker = query_runner.get_schema_change_marker()
+        except Exception:
+            logging.warning("Failed getting the schema change marker of data source %s.", self.id, exc_info=1)
+            marker = None
 
-            redis_connection.set(key, json.dumps(schema))
-        else:
-            schema = json.loads(cache)
+        if marker is not None and cache.version is not None and unicode(marker) == cache.marker:
+            return None
+
+        cache.update(query_runner.get_schema(get_stats=True), marker, settings.SCHEMA_CHANGE_MARKER_MAX_AGE)
+        return cache
 
-        return schema
+    @property
+    def max_concurrent_queries(self):
+        if self.concurrency_limit is None:
+            return settings.QUERY_CONCURRENCY_LIMIT
+
+        return self.concurrency_limit
+
+    @property
+    def max_result_rows(self):
+        if self.row_limit is None:
+            return settings.QUERY_RESULTS_ROW_LIMIT
+
+        return self.row_limit
 
     def _pause_key(self):
         return 'ds:{}:pause'.format(self.id)
@@ -670,7 +721,7 @@ class DataSource(BelongsToOrgMixin, db.Model):
 
     @property
     def query_runner(self):
-        return get_query_runner(self.type, self.options)
+        return get_query_runner(self.type, self.options, self.id)
 
     @classmethod
     def get_by_name(cls, name):
@@ -697,6 +748,11 @@ class DataSourceGroup(db.Model):
 
 
 class QueryResult(db.Model, BelongsToOrgMixin):
+    # Sorted set of the ids of results that might be unused, scored by the time they were recorded.
+    UNUSED_CANDIDATES_KEY = 'query_results:unused_candidates'
+    # Session info key of the locations written to the external storage in the current transaction.
+    STORED_LOCATIONS_KEY = 'query_results:stored_locations'
+
     id = Column(db.Integer, primary_key=True)
     org_id = Column(db.Integer, db.ForeignKey('organizations.id'))
     org = db.relationship(Organization)
@@ -704,23 +760,164 @@ class QueryResult(db.Model, BelongsToOrgMixin):
     data_source = db.relationship(DataSource, backref=backref('query_results'))
     query_hash = Column(db.String(32), index=True)
     query_text = Column('query', db.Text)
-    data = Column(db.Text)
+    # Results are stored in encoded_data (see redash.results.encoding), or in the external result storage when they
+    # are large (data_location). The data column holds results stored as JSON text before the encoding was
+    # introduced, and anything that doesn't look like a query result.
+    _data = Column('data', db.Text, nullable=True)
+    encoded_data = Column(db.LargeBinary, nullable=True)
+    data_location = Column(db.String(255), nullable=True, index=True)
+    data_checksum = Column(db.String(64), nullable=True)
+    # Size in bytes of the results stored in the external storage.
+    data_size = Column(db.BigInteger, nullable=True)
     runtime = Column(postgresql.DOUBLE_PRECISION)
-    retrieved_at = Column(db.DateTime(True))
+    retrieved_at = Column(db.DateTime(True), index=True)
+    # The first row values of the columns the alerts of the result's queries watch, extracted when the result is
+    # stored so alerts can be evaluated without loading it: {'has_rows': ..., 'values': {column: value}}.
+    alert_values = Column(PseudoJSON, nullable=True)
 
     __tablename__ = 'query_results'
 
-    def to_dict(self):
-        return {
+    @property
+    def data(self):
+        if self.encoded_data is not None or self.data_location is not None:
+            return json_dumps(self.load_data())
+
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = self.encoded_data = self.data_location = self.data_checksum = self.data_size = None
+
+        if isinstance(value, QueryResultWriter):
+            if result_storage.should_store_externally(value.size):
+                self._store_externally(value.open(), value.size)
+                return
+
+            value = value.getvalue()
+        elif not is_encoded(value):
+            value = encode_json(value) or value
+
+        if not is_encoded(value):
+            self._data = value
+        elif result_storage.should_store_externally(len(value)):
+            self._store_externally(cStringIO.StringIO(value), len(value))
+        else:
+            self.encoded_data = value
+
+    def _store_externally(self, fileobj, size):
+        self.data_location, self.data_checksum = result_storage.store(fileobj)
+        self.data_size = size
+        # The payload is written before the result is committed: it's deleted if the transaction is rolled back (see
+        # delete_rolled_back_results below).
+        db.session.info.setdefault(self.STORED_LOCATIONS_KEY, []).append(self.data_location)
+
+    def load_payload(self):
+        """
+        Returns the encoded result, or None if the result is stored as JSON text.
+        """
+        if self.data_location is not None:
+            return result_storage.load(self.data_location, self.data_checksum)
+
+        return self.encoded_data
+
+    def load_data(self):
+        """
+        Returns the result as a dict of columns and rows.
+        """
+        payload = self.load_payload()
+        if payload is not None:
+            return decode(payload)
+
+        return json.loads(self._data)
+
+    def first_row(self, columns):
+        """
+        Returns the values of the given columns in the first row, as a dict, or None if the result has no rows. Only
+        the first row group of these columns is decoded.
+        """
+        payload = self.load_payload()
+        if payload is not None:
+            result = ColumnarResult(payload)
+            _, selected_columns = result.select(columns)
+            for row in result.iter_rows(limit=1, columns=columns):
+                return dict(zip([c['name'] for c in selected_columns], row))
+
+            return None
+
+        rows = json.loads(self._data)['rows']
+        if not rows:
+            return None
+
+        return {name: rows[0][name] for name in columns if name in rows[0]}
+
+    def to_dict(self, with_data=True):
+        d = {
             'id': self.id,
             'query_hash': self.query_hash,
             'query': self.query_text,
-            'data': json.loads(self.data),
             'data_source_id': self.data_source_id,
             'runtime': self.runtime,
             'retrieved_at': self.retrieved_at
         }
 
+        if with_data:
+            d['data'] = self.load_data()
+
+        return d
+
+    def iter_json(self, offset=0, limit=None, columns=None):
+        """
+        Returns a generator of the chunks of json_dumps(self.to_dict()). Results stored as JSON text are spliced in as
+        they are, and encoded results are serialized one row group at a time, instead of parsing and re-encoding the
+        whole result.
+
+        When a range of rows (offset/limit) or a list of columns is given, only that part of the data is returned,
+        along with the total number of rows (row_count).
+        """
+        metadata = self.to_dict(with_data=False)
+        paginated = offset or limit is not None or columns is not None
+        payload = self.load_payload()
+
+        if payload is not None:
+            result = ColumnarResult(payload)
+            data = result.iter_json(offset, limit, columns)
+            if paginated:
+                metadata['row_count'] = result.row_count
+        elif paginated:
+            query_data = json.loads(self._data)
+            metadata['row_count'] = len(query_data['rows'])
+            data = [json_dumps(_paginate(query_data, offset, limit, columns))]
+        else:
+            data = [self._data]
+
+        return itertools.chain([json_dumps(metadata)[:-1], ', "data": '], data, ['}'])
+
+    @classmethod
+    def get_latest_by_queries(cls, org, query_ids=None, dashboard=None):
+        """
+        Returns (query id, latest result) tuples for the given queries, or the queries of the given dashboard's
+        widgets, with a single query that also loads the results' data sources.
+        """
+        query = (db.session.query(Query.id, QueryResult)
+                 .join(QueryResult, Query.latest_query_data_id == QueryResult.id)
+                 .options(joinedload(QueryResult.data_source))
+                 .filter(Query.org == org))
+
+        if query_ids is not None:
+            query = query.filter(Query.id.in_(query_ids))
+
+        if dashboard is not None:
+            dashboard_query_ids = (db.session.query(Visualization.query_id)
+                                   .join(Widget)
+                                   .filter(Widget.dashboard_id == dashboard.id))
+            query = query.filter(Query.id.in_(dashboard_query_ids))
+
+        return query
+
+    @classmethod
+    def get_by_ids_and_org(cls, ids, org):
+        return cls.query.options(joinedload(QueryResult.data_source)).filter(cls.id.in_(ids), cls.org == org)
+
     @classmethod
     def unused(cls, days=7):
         age_threshold = datetime.datetime.now() - datetime.timedelta(days=days)
@@ -731,6 +928,66 @@ class QueryResult(db.Model, BelongsToOrgMixin):
 
         return unused_results
 
+    @classmethod
+    def add_unused_candidates(cls, result_ids):
+        """
+        Records results that became unused (or might have), for redash.results.gc to delete once they're old enough.
+        """
+        if not result_ids:
+            return
+
+        now = time.time()
+        redis_connection.zadd(cls.UNUSED_CANDIDATES_KEY, **{str(result_id): now for result_id in result_ids})
+
+    @classmethod
+    def delete_unused(cls, result_ids, older_than):
+        """
+        Deletes the given results, unless they're still used by a query or are newer than older_than. Returns the id,
+        the external storage location and the stored size (in the database or the external storage) of every deleted
+        result.
+        """
+        if not result_ids:
+            return []
+
+        table = cls.__table__
+        size = (db.func.coalesce(db.func.octet_length(table.c.data), 0) +
+                db.func.coalesce(db.func.octet_length(table.c.encoded_data), 0) +
+                db.func.coalesce(table.c.data_size, 0))
+        return db.session.execute(
+            table.delete()
+            .where(table.c.id.in_(result_ids))
+            .where(table.c.retrieved_at < older_than)
+            .where(~exists().where(Query.latest_query_data_id == table.c.id))
+            .returning(table.c.id, table.c.data_location, size)).fetchall()
+
+    @classmethod
+    def referenced_locations(cls, locations):
+        """
+        Returns the subset of the given external storage locations that results refer to.
+        """
+        if not locations:
+            return set()
+
+        return set(location for location, in db.session.query(cls.data_location)
+                   .filter(cls.data_location.in_(locations)))
+
+    @classmethod
+    def old_results(cls, older_than, after=None, limit=100):
+        """
+        Returns the id and retrieval time of results retrieved before older_than, ordered by retrieval time (and id),
+        starting after the given (retrieved_at, id) position.
+        """
+        query = (db.session.query(cls.id, cls.retrieved_at)
+                 .filter(cls.retrieved_at < older_than)
+                 .order_by(cls.retrieved_at, cls.id))
+
+        if after is not None:
+            retrieved_at, result_id = after
+            query = query.filter(or_(cls.retrieved_at > retrieved_at,
+                                     and_(cls.retrieved_at == retrieved_at, cls.id > result_id)))
+
+        return query.limit(limit).all()
+
     @classmethod
     def get_latest(cls, data_source, query, max_age=0):
         query_hash = utils.gen_query_hash(query)
@@ -751,6 +1008,22 @@ class QueryResult(db.Model, BelongsToOrgMixin):
 
         return q.first()
 
+    @classmethod
+    def get_alert_values(cls, result_id):
+        return db.session.query(cls.alert_values).filter(cls.id == result_id).scalar()
+
+    def _extract_alert_values(self, columns, data):
+        try:
+            if isinstance(data, QueryResultWriter):
+                first_row = data.first_row(columns)
+            else:
+                first_row = self.first_row(columns)
+        except (ValueError, KeyError, TypeError):
+            logging.warning("Failed extracting alert values of query (%s) result.", self.query_hash, exc_info=1)
+            return None
+
+        return {'has_rows': first_row is not None, 'values': first_row or {}}
+
     @classmethod
     def store_result(cls, org, data_source, query_hash, query, data, run_time, retrieved_at):
         query_result = cls(org_id=org,
@@ -760,18 +1033,35 @@ class QueryResult(db.Model, BelongsToOrgMixin):
                            data_source=data_source,
                            retrieved_at=retrieved_at,
                            data=data)
+
+        alert_columns = Alert.watched_columns(query_hash, data_source.id)
+        if alert_columns:
+            query_result.alert_values = query_result._extract_alert_values(alert_columns, data)
+
         db.session.add(query_result)
+        # Flushing also writes the pending changes of the queries (like a reset of their failures count), so the update
+        # below sees them.
+        db.session.flush()
         logging.info("Inserted query (%s) data; id=%s", query_hash, query_result.id)
-        # TODO: Investigate how big an impact this select-before-update makes.
-        queries = db.session.query(Query).filter(
-            Query.query_hash == query_hash,
-            Query.data_source == data_source)
-        for q in queries:
-            q.latest_query_data = query_result
-            db.session.add(q)
-        query_ids = [q.id for q in queries]
+
+        # Joining the queries with themselves returns the results they had before the update, which are now unused.
+        previous = Query.__table__.alias('previous')
+        updated_queries = db.session.execute(
+            Query.__table__.update()
+            .where(Query.id == previous.c.id)
+            .where(Query.query_hash == query_hash)
+            .where(Query.data_source_id == data_source.id)
+            .values(latest_query_data_id=query_result.id)
+            .returning(Query.id, Query.schedule, Query.schedule_failures, previous.c.latest_query_data_id)).fetchall()
+        query_ids = [query_id for query_id, _, _, _ in updated_queries]
+        Query.update_next_runs([row[:3] for row in updated_queries], retrieved_at)
         logging.info("Updated %s queries with result (%s).", len(query_ids), query_hash)
 
+        if query_ids:
+            cls.add_unused_candidates(set(row[3] for row in updated_queries if row[3] is not None))
+        else:
+            cls.add_unused_candidates([query_result.id])
+
         return query_result, query_ids
 
     def __unicode__(self):
@@ -781,43 +1071,85 @@ class QueryResult(db.Model, BelongsToOrgMixin):
     def groups(self):
         return self.data_source.groups
 
-    def make_csv_content(self):
-        s = cStringIO.StringIO()
+    def iter_rows(self):
+        """
+        Returns the columns and an iterator over the rows, as tuples of values in column order. Encoded results are
+        decoded one row group at a time.
+        """
+        payload = self.load_payload()
+        if payload is not None:
+            result = ColumnarResult(payload)
+            return result.columns, result.iter_rows()
+
+        query_data = json.loads(self._data)
+        column_names = [col['name'] for col in query_data['columns']]
+        return query_data['columns'], (tuple(row.get(name) for name in column_names) for row in query_data['rows'])
+
+    def iter_csv_content(self):
+        """
+        Returns a generator of CSV chunks, so the result can be streamed without rendering it in memory first.
+        """
+        columns, rows = self.iter_rows()
+        return _iter_csv([col['name'] for col in columns], rows)
 
-        query_data = json.loads(self.data)
-        writer = csv.DictWriter(s, extrasaction="ignore", fieldnames=[col['name'] for col in query_data['columns']])
-        writer.writer = utils.UnicodeWriter(s)
-        writer.writeheader()
-        for row in query_data['rows']:
-            writer.writerow(row)
-
-        return s.getvalue()
-
-    def make_excel_content(self):
-        s = cStringIO.StringIO()
+    def make_csv_content(self):
+        return ''.join(self.iter_csv_content())
 
-        query_data = json.loads(self.data)
-        book = xlsxwriter.Workbook(s, {'constant_memory': True})
+    def write_excel_content(self, fileobj):
+        columns, rows = self.iter_rows()
+        column_names = [col['name'] for col in columns]
+        book = xlsxwriter.Workbook(fileobj, {'constant_memory': True})
         sheet = book.add_worksheet("result")
 
-        column_names = []
-        for (c, col) in enumerate(query_data['columns']):
-            sheet.write(0, c, col['name'])
-            column_names.append(col['name'])
+        for (c, name) in enumerate(column_names):
+            sheet.write(0, c, name)
 
-        for (r, row) in enumerate(query_data['rows']):
-            for (c, name) in enumerate(column_names):
-                v = row.get(name)
+        for (r, row) in enumerate(rows):
+            for (c, v) in enumerate(row):
                 if isinstance(v, list):
                     v = str(v).encode('utf-8')
                 sheet.write(r + 1, c, v)
 
         book.close()
 
+    def make_excel_content(self):
+        s = cStringIO.StringIO()
+        self.write_excel_content(s)
         return s.getvalue()
 
 
-def should_schedule_next(previous_iteration, now, schedule, failures):
+def _paginate(query_data, offset, limit, columns):
+    end = None if limit is None else offset + limit
+    query_data['rows'] = query_data['rows'][offset:end]
+
+    if columns is not None:
+        columns_by_name = {c['name']: c for c in query_data['columns']}
+        query_data['columns'] = [columns_by_name[name] for name in columns if name in columns_by_name]
+        column_names = [c['name'] for c in query_data['columns']]
+        query_data['rows'] = [project(row, column_names) for row in query_data['rows']]
+
+    return query_data
+
+
+CSV_CHUNK_SIZE = 64 * 1024
+
+
+def _iter_csv(column_names, rows):
+    s = cStringIO.StringIO()
+    writer = utils.UnicodeWriter(s)
+    writer.writerow(column_names)
+
+    for row in rows:
+        writer.writerow(row)
+        if s.tell() >= CSV_CHUNK_SIZE:
+            yield s.getvalue()
+            s.seek(0)
+            s.truncate()
+
+    yield s.getvalue()
+
+
+def next_run_time(previous_iteration, schedule, failures):
     if schedule.isdigit():
         ttl = int(schedule)
         next_iteration = previous_iteration + datetime.timedelta(seconds=ttl)
@@ -836,7 +1168,11 @@ def should_schedule_next(previous_iteration, now, schedule, failures):
         next_iteration = (previous_iteration + datetime.timedelta(days=1)).replace(hour=hour, minute=minute)
     if failures:
         next_iteration += datetime.timedelta(minutes=2**failures)
-    return now > next_iteration
+    return next_iteration
+
+
+def should_schedule_next(previous_iteration, now, schedule, failures):
+    return now > next_run_time(previous_iteration, schedule, failures)
 
 
 class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
@@ -846,7 +1182,7 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
     org = db.relationship(Organization, backref="queries")
     data_source_id = Column(db.Integer, db.ForeignKey("data_sources.id"), nullable=True)
     data_source = db.relationship(DataSource, backref='queries')
-    latest_query_data_id = Column(db.Integer, db.ForeignKey("query_results.id"), nullable=True)
+    latest_query_data_id = Column(db.Integer, db.ForeignKey("query_results.id"), nullable=True, index=True)
     latest_query_data = db.relationship(QueryResult)
     name = Column(db.String(255))
     description = Column(db.String(4096), nullable=True)
@@ -862,6 +1198,8 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
     is_draft = Column(db.Boolean, default=True, index=True)
     schedule = Column(db.String(10), nullable=True)
     schedule_failures = Column(db.Integer, default=0)
+    # When the query is due to be refreshed by the scheduler, kept up to date by update_next_run.
+    next_run_at = Column(db.DateTime(True), nullable=True, index=True)
     visualizations = db.relationship("Visualization", cascade="all, delete-orphan")
     options = Column(MutableDict.as_mutable(PseudoJSON), default={})
     search_vector = Column(TSVectorType('id', 'name', 'description', 'query',
@@ -873,6 +1211,7 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
 
     query_class = SearchBaseQuery
     __tablename__ = 'queries'
+    __table_args__ = (db.Index('queries_query_hash_data_source_id', 'query_hash', 'data_source_id'),)
     __mapper_args__ = {
         "version_id_col": version,
         'version_id_generator': False
@@ -968,16 +1307,66 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
     def by_user(cls, user):
         return cls.all_queries(user.group_ids, user.id).filter(Query.user == user)
 
+    def update_next_run(self, failed_at=None):
+        """
+        Computes when the query is due based on its schedule, the time its latest result was retrieved and the
+        recorded failures. Queries without a schedule or a result are never due.
+
+        A query whose scheduled run failed at failed_at is due again a schedule period plus the failures backoff after
+        that attempt, as its latest result's retrieval time doesn't move.
+        """
+        self.next_run_at = None
+
+        if self.schedule and self.latest_query_data is not None:
+            try:
+                self.next_run_at = next_run_time(self.latest_query_data.retrieved_at, self.schedule,
+                                                 self.schedule_failures)
+                if failed_at is not None:
+                    self.next_run_at = max(self.next_run_at,
+                                           next_run_time(failed_at, self.schedule, self.schedule_failures))
+            except ValueError:
+                logging.warning("Invalid schedule for query %s: %s", self.id, self.schedule)
+
+    @classmethod
+    def update_next_runs(cls, queries, retrieved_at):
+        """
+        Updates the next run time of queries that got a new result through a bulk update (given as id, schedule and
+        failures count tuples), which update_queries_next_run doesn't see. Their instances loaded in the session are
+        expired, so they're reloaded with the new values.
+        """
+        next_runs = []
+        for query_id, schedule, failures in queries:
+            if not schedule:
+                continue
+
+            try:
+                next_runs.append({'query_id': query_id,
+                                  'next_run': next_run_time(retrieved_at, schedule, failures)})
+            except ValueError:
+                logging.warning("Invalid schedule for query %s: %s", query_id, schedule)
+
+        if next_runs:
+            db.session.execute(cls.__table__.update()
+                               .where(cls.id == bindparam('query_id'))
+                               .values(next_run_at=bindparam('next_run')), next_runs)
+
+        for query_id, _, _ in queries:
+            query = db.session.identity_map.get(cls.__mapper__.identity_key_from_primary_key([query_id]))
+            if query is not None:
+                db.session.expire(query, ['latest_query_data', 'latest_query_data_id', 'next_run_at', 'updated_at'])
+
     @classmethod
     def outdated_queries(cls):
+        now = utils.utcnow()
+        # Only the queries whose next run time passed are loaded (using the index on next_run_at). They are then
+        # checked against the last time the scheduler executed them, as they might still be running.
         queries = (db.session.query(Query)
                    .options(joinedload(Query.latest_query_data).load_only('retrieved_at'))
-                   .filter(Query.schedule != None)
-                   .order_by(Query.id))
+                   .filter(Query.schedule != None, Query.next_run_at < now)
+                   .order_by(Query.id)).all()
 
-        now = utils.utcnow()
         outdated_queries = {}
-        scheduled_queries_executions.refresh()
+        scheduled_queries_executions.refresh([query.id for query in queries])
 
         for query in queries:
             if query.latest_query_data:
@@ -1097,6 +1486,39 @@ def query_last_modified_by(target, val, oldval, initiator):
     target.last_modified_by_id = val
 
 
+@listens_for(Session, 'after_commit')
+def forget_stored_results(session):
+    session.info.pop(QueryResult.STORED_LOCATIONS_KEY, None)
+
+
+@listens_for(Session, 'after_soft_rollback')
+def delete_rolled_back_results(session, previous_transaction):
+    # Only the payloads of results whose outermost transaction was rolled back are orphans.
+    if previous_transaction.parent is None:
+        result_storage.delete(session.info.pop(QueryResult.STORED_LOCATIONS_KEY, []))
+
+
+@listens_for(Session, 'before_flush')
+def update_queries_next_run(session, flush_context, instances):
+    updated_results = set(obj.id for obj in session.dirty
+                          if isinstance(obj, QueryResult) and inspect(obj).attrs.retrieved_at.history.has_changes())
+
+    # Queries whose latest result's retrieved_at changed aren't necessarily modified themselves.
+    candidates = itertools.chain(session.new, session.dirty, session.identity_map.values() if updated_results else [])
+
+    for obj in candidates:
+        if not isinstance(obj, Query) or obj in session.deleted:
+            continue
+
+        state = inspect(obj)
+        # A failure was just recorded: the scheduled run failed now.
+        failed = bool(obj.schedule_failures) and state.attrs.schedule_failures.history.has_changes()
+        if (failed or state.pending or obj.latest_query_data_id in updated_results or
+                any(state.attrs[name].history.has_changes()
+                    for name in ('schedule', 'latest_query_data', 'latest_query_data_id'))):
+            obj.update_next_run(utils.utcnow() if failed else None)
+
+
 class AccessPermission(GFKBase, db.Model):
     id = Column(db.Integer, primary_key=True)
     # 'object' defined in GFKBase
@@ -1256,10 +1678,30 @@ class Alert(TimestampMixin, db.Model):
 
         return d
 
-    def evaluate(self):
-        data = json.loads(self.query_rel.latest_query_data.data)
-        if data['rows']:
-            value = data['rows'][0][self.options['column']]
+    @classmethod
+    def watched_columns(cls, query_hash, data_source_id):
+        """
+        Returns the columns watched by the alerts of the queries with the given hash and data source.
+        """
+        options = (db.session.query(cls.options)
+                   .join(Query)
+                   .filter(Query.query_hash == query_hash, Query.data_source_id == data_source_id))
+        return sorted(set(o['column'] for o, in options if o and o.get('column') is not None))
+
+    def evaluate(self, alert_values=None):
+        """
+        Evaluates the alert against the values extracted when the latest result was stored (see
+        QueryResult.alert_values), falling back to reading the first row of the result when they don't include the
+        alert's column.
+        """
+        column = self.options['column']
+        if alert_values is not None and (column in alert_values['values'] or not alert_values['has_rows']):
+            first_row = alert_values['values'] if alert_values['has_rows'] else None
+        else:
+            first_row = self.query_rel.latest_query_data.first_row([column])
+
+        if first_row is not None:
+            value = first_row[column]
             op = self.options['op']
 
             if op == 'greater than' and value > self.options['value']:
@@ -3,14 +3,18 @@ import logging
 import json
 
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 from redash import settings
+from redash.results.result_set import ResultSet
 
 logger = logging.getLogger(__name__)
 
 __all__ = [
     'BaseQueryRunner',
     'InterruptException',
+    'QueryRunnerError',
     'BaseSQLQueryRunner',
+    'ResultSet',
     'TYPE_DATETIME',
     'TYPE_BOOLEAN',
     'TYPE_INTEGER',
@@ -49,8 +53,14 @@ class NotSupported(Exception):
     pass
 
 
+class QueryRunnerError(Exception):
+    pass
+
+
 class BaseQueryRunner(object):
     noop_query = None
+    # Set by get_query_runner, to key the connection pools (see redash.query_runner.connection_pool).
+    data_source_id = None
 
     def __init__(self, configuration):
         self.syntax = 'sql'
@@ -87,6 +97,61 @@ class BaseQueryRunner(object):
     def run_query(self, query, user):
         raise NotImplementedError()
 
+    def run_query_iter(self, query, user):
+        """
+        Runs the query and yields its result incrementally: first the list of columns, then batches (lists) of rows.
+        Each row is either a sequence of values in column order or a dict keyed by column name. Failures are raised
+        as QueryRunnerError.
+
+        Metadata about the result (like the amount of data the query scanned) can be yielded as a dict anywhere after
+        the columns. Runners should yield it as early as they can, as consumers stop iterating when they truncate the
+        result.
+
+        The default implementation wraps run_query, so the whole result is still loaded in memory. Runners able to
+        fetch rows incrementally should override it.
+        """
+        json_data, error = self.run_query(query, user)
+
+        if error is not None:
+            raise QueryRunnerError(error)
+
+        if json_data is None:
+            return
+
+        results = ResultSet.from_json(json_data)
+        yield results.columns
+
+        if results.metadata is not None:
+            yield results.metadata
+
+        for rows in results.iter_batches(settings.QUERY_RESULTS_BATCH_SIZE):
+            yield rows
+
+    def _run_query_from_iter(self, query, user):
+        """
+        Implements the run_query contract on top of run_query_iter, for runners that fetch rows incrementally.
+        """
+        try:
+            results = self.run_query_iter(query, user)
+            columns = next(results, None)
+
+            if columns is None:
+                return None, 'Query completed but it returned no data.'
+
+            result_set = ResultSet(columns)
+            column_names = result_set.column_names
+            for batch in results:
+                if isinstance(batch, dict):
+                    result_set.metadata = dict(result_set.metadata or {}, **batch)
+                    continue
+
+                result_set.extend(tuple(row.get(name) for name in column_names) if isinstance(row, dict) else row
+                                  for row in batch)
+        except QueryRunnerError as e:
+            return None, e.message
+
+        return result_set.to_json(), None
+
     def fetch_columns(self, columns):
         column_names = []
         duplicates_counter = 1
@@ -108,6 +173,13 @@ class BaseQueryRunner(object):
     def get_schema(self, get_stats=False):
         raise NotSupported()
 
+    def get_schema_change_marker(self):
+        """
+        Returns a value read from the data source's catalog that changes whenever its schema does, or None if it
+        doesn't expose one. Lets scheduled schema refreshes skip the data sources whose schema didn't change.
+        """
+        return None
+
     def _run_query_internal(self, query):
         results, error = self.run_query(query, None)
 
@@ -128,21 +200,49 @@ class BaseSQLQueryRunner(BaseQueryRunner):
     def __init__(self, configuration):
         super(BaseSQLQueryRunner, self).__init__(configuration)
 
-    def get_schema(self, datasource_id, get_stats=False):
+    def get_schema(self, get_stats=False):
         schema_dict = {}
-        self._get_tables(schema_dict, datasource_id)
+        self._get_tables(schema_dict)
         if settings.SCHEMA_RUN_TABLE_SIZE_CALCULATIONS and get_stats:
             self._get_tables_stats(schema_dict)
         return schema_dict.values()
 
-    def _get_tables(self, schema_dict, datasource_id):
+    def _get_tables(self, schema_dict):
         return []
 
+    def _get_table_size_estimates(self):
+        """
+        Returns the estimated row counts of the tables (by table name) kept in the data source's catalog, or None if
+        it doesn't keep any.
+        """
+        return None
+
+    def _get_table_size(self, table_name):
+        return self._run_query_internal('select count(*) as cnt from %s' % table_name)[0]['cnt']
+
     def _get_tables_stats(self, tables_dict):
-        for t in tables_dict.keys():
-            if type(tables_dict[t]) == dict:
-                res = self._run_query_internal('select count(*) as cnt from %s' % t)
-                tables_dict[t]['size'] = res[0]['cnt']
+        tables = [t for t in tables_dict.keys() if type(tables_dict[t]) == dict]
+
+        estimates = None if settings.SCHEMA_EXACT_TABLE_SIZES else self._get_table_size_estimates()
+        if estimates is not None:
+            for t in tables:
+                if t in estimates:
+                    tables_dict[t]['size'] = estimates[t]
+            return
+
+        if not tables:
+            return
+
+        # Counting the rows of every table takes a full scan of each, so run a few at a time.
+        pool = ThreadPool(min(len(tables), settings.SCHEMA_TABLE_SIZE_CONCURRENCY))
+        try:
+            sizes = pool.map(self._get_table_size, tables)
+        finally:
+            pool.close()
+            pool.join()
+
+        for t, size in zip(tables, sizes):
+            tables_dict[t]['size'] = size
 
 
 query_runners = {}
@@ -158,12 +258,14 @@ def register(query_runner_class):
                      "dependencies.", query_runner_class.name())
 
 
-def get_query_runner(query_runner_type, configuration):
+def get_query_runner(query_runner_type, configuration, data_source_id=None):
     query_runner_class = query_runners.get(query_runner_type, None)
     if query_runner_class is None:
         return None
 
-    return query_runner_class(configuration)
+    query_runner = query_runner_class(configuration)
+    query_runner.data_source_id = data_source_id
+    return query_runner
 
 
 def get_configuration_schema_for_query_runner_type(query_runner_type):
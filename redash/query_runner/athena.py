@@ -2,9 +2,9 @@ import json
 import logging
 import os
 
+from redash import settings
 from redash.query_runner import *
 from redash.settings import parse_boolean
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 ANNOTATE_QUERY = parse_boolean(os.environ.get('ATHENA_ANNOTATE_QUERY', 'true'))
@@ -163,8 +163,8 @@ class Athena(BaseQueryRunner):
 
         return schema.values()
 
-    def run_query(self, query, user):
-        cursor = pyathena.connect(
+    def _get_cursor(self):
+        return pyathena.connect(
             s3_staging_dir=self.configuration['s3_staging_dir'],
             region_name=self.configuration['region'],
             aws_access_key_id=self.configuration.get('aws_access_key', None),
@@ -174,31 +174,40 @@ class Athena(BaseQueryRunner):
             kms_key=self.configuration.get('kms_key', None),
             formatter=SimpleFormatter()).cursor()
 
+    def _data_scanned(self, cursor):
+        try:
+            return cursor.data_scanned_in_bytes
+        except AttributeError as e:
+            logger.debug("Athena Upstream can't get data_scanned_in_bytes: %s", e)
+            return None
+
+    def run_query_iter(self, query, user):
+        cursor = self._get_cursor()
+
         try:
             cursor.execute(query)
             column_tuples = [(i[0], _TYPE_MAPPINGS.get(i[1], None)) for i in cursor.description]
-            columns = self.fetch_columns(column_tuples)
-            rows = [dict(zip(([c['name'] for c in columns]), r)) for i, r in enumerate(cursor.fetchall())]
-            qbytes = None
-            try:
-                qbytes = cursor.data_scanned_in_bytes
-            except AttributeError as e:
-                logger.debug("Athena Upstream can't get data_scanned_in_bytes: %s", e)
-            data = {'columns': columns, 'rows': rows, 'metadata': {'data_scanned': qbytes}}
-            json_data = json.dumps(data, cls=JSONEncoder)
-            error = None
+            yield self.fetch_columns(column_tuples)
+            # The query has completed once execute returns, so the amount of data it scanned is already known.
+            yield {'data_scanned': self._data_scanned(cursor)}
+
+            # The rows are fetched from the result set page by page, as they're consumed.
+            while True:
+                rows = cursor.fetchmany(settings.QUERY_RESULTS_BATCH_SIZE)
+                if not rows:
+                    break
+                yield rows
         except KeyboardInterrupt:
             if cursor.query_id:
                 cursor.cancel()
-            error = "Query cancelled by user."
-            json_data = None
+            raise QueryRunnerError("Query cancelled by user.")
         except Exception as ex:
             if cursor.query_id:
                 cursor.cancel()
-            error = ex.message
-            json_data = None
+            raise QueryRunnerError(ex.message)
 
-        return json_data, error
+    def run_query(self, query, user):
+        return self._run_query_from_iter(query, user)
 
 
 register(Athena)
@@ -6,7 +6,6 @@ import uuid
 import csv
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -69,9 +68,7 @@ def generate_rows_and_columns(csv_response):
                 'type': resolve_redash_type(i['datatype']),
                 'name': i['name']}
                for i in meta_columns]
-    column_names = [c['name'] for c in columns]
-    rows = [dict(zip(column_names, row)) for row in reader]
-    return columns, rows
+    return columns, list(reader)
 
 
 class AxibaseTSD(BaseQueryRunner):
@@ -160,9 +157,7 @@ class AxibaseTSD(BaseQueryRunner):
                                                  'queryId': query_id})
 
             columns, rows = generate_rows_and_columns(data)
-
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+            json_data = ResultSet(columns, rows).to_json()
             error = None
 
         except SQLException as e:
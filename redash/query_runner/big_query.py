@@ -10,7 +10,6 @@ import requests
 
 from redash import settings
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -251,7 +250,7 @@ class BigQuery(BaseQueryRunner):
             data = self._get_query_result(jobs, query)
             error = None
 
-            json_data = json.dumps(data, cls=JSONEncoder)
+            json_data = ResultSet.from_dicts(data['columns'], data['rows'], data.get('metadata')).to_json()
         except apiclient.errors.HttpError as e:
             json_data = None
             if e.resp.status == 400:
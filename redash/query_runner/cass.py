@@ -2,7 +2,7 @@ import json
 import logging
 import uuid
 
-from redash.query_runner import BaseQueryRunner, register
+from redash.query_runner import BaseQueryRunner, ResultSet, register
 from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
@@ -132,10 +132,7 @@ class Cassandra(BaseQueryRunner):
 
             columns = self.fetch_columns(map(lambda c: (c, 'string'), column_names))
 
-            rows = [dict(zip(column_names, row)) for row in result]
-
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=CassandraJSONEncoder)
+            json_data = ResultSet(columns, list(result)).to_json(cls=CassandraJSONEncoder)
 
             error = None
         except KeyboardInterrupt:
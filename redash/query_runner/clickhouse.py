@@ -1,7 +1,6 @@
 import json
 import logging
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 import requests
 import re
 logger = logging.getLogger(__name__)
@@ -110,7 +109,7 @@ class ClickHouse(BaseSQLQueryRunner):
             return json_data, error
         try:
             q = self._clickhouse_query(query)
-            data = json.dumps(q, cls=JSONEncoder)
+            data = ResultSet.from_dicts(q['columns'], q['rows']).to_json()
             error = None
         except Exception as e:
             data = None
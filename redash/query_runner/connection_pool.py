@@ -0,0 +1,262 @@
+"""
+Per process pools of data source connections.
+
+Query runners that hold a connection to their data source (and pay for a TCP/TLS handshake and authentication to open
+one) get it from a pool instead of connecting for every query. Pools are kept per process, keyed by the query runner
+type, the data source and a hash of its configuration: when the configuration of a data source changes, the next query
+uses a new pool and the connections of the previous one are closed.
+
+Every pool holds up to settings.QUERY_RUNNER_POOL_SIZE connections (0 disables pooling). Idle connections are closed
+after settings.QUERY_RUNNER_POOL_IDLE_TIMEOUT seconds. Connections are reset (their session state cleared) when they're
+checked in, and the ones that have been idle for longer than settings.QUERY_RUNNER_POOL_CHECK_INTERVAL seconds are
+checked before being handed out again.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from redash import settings, statsd_client
+from redash.metrics.celery import metric_name
+from redash.query_runner import QueryRunnerError
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(QueryRunnerError):
+    pass
+
+
+class ConnectionPool(object):
+    def __init__(self, connect, check=None, close=None, reset=None, max_size=None, idle_timeout=None,
+                 wait_timeout=None, check_interval=None, metric_tags=None):
+        """
+        :param connect: function returning a new connection.
+        :param check: function returning whether an idle connection is still usable.
+        :param close: function closing a connection (calls its close method by default).
+        :param reset: function clearing the session state a query left on a connection, returning whether it can be
+            reused.
+        """
+        self._connect = connect
+        self._check = check or (lambda connection: True)
+        self._close = close or (lambda connection: connection.close())
+        self._reset = reset or (lambda connection: True)
+        self.max_size = settings.QUERY_RUNNER_POOL_SIZE if max_size is None else max_size
+        self.idle_timeout = settings.QUERY_RUNNER_POOL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.wait_timeout = settings.QUERY_RUNNER_POOL_WAIT_TIMEOUT if wait_timeout is None else wait_timeout
+        self.check_interval = settings.QUERY_RUNNER_POOL_CHECK_INTERVAL if check_interval is None else check_interval
+        self.metric_tags = metric_tags or {}
+        # (connection, time it was checked in) tuples, most recently used last:
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle_count(self):
+        return len(self._idle)
+
+    def _metric_name(self, name):
+        return metric_name(name, self.metric_tags)
+
+    def _discard(self, connection):
+        try:
+            self._close(connection)
+        except Exception:
+            logger.debug("Failed closing pooled connection.", exc_info=1)
+
+    def close_idle(self, now=None):
+        """
+        Closes the connections that have been idle for longer than the idle timeout.
+        """
+        now = now or time.time()
+        with self._condition:
+            expired = [connection for connection, checked_in_at in self._idle
+                       if now - checked_in_at >= self.idle_timeout]
+            self._idle = [(connection, checked_in_at) for connection, checked_in_at in self._idle
+                          if now - checked_in_at < self.idle_timeout]
+            self._size -= len(expired)
+            if expired:
+                self._condition.notify(len(expired))
+
+        for connection in expired:
+            self._discard(connection)
+
+    def checkout(self):
+        if self.max_size <= 0:
+            # Pooling is disabled.
+            return self._connect()
+
+        start_time = time.time()
+        self.close_idle(start_time)
+
+        while True:
+            connection = None
+            checked_in_at = None
+            with self._condition:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = self.wait_timeout - (time.time() - start_time)
+                    if remaining <= 0:
+                        statsd_client.incr(self._metric_name('connection_pool.timeout'))
+                        raise PoolTimeout("Timed out waiting for a connection.")
+                    self._condition.wait(remaining)
+
+                if self._idle:
+                    connection, checked_in_at = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+
+                statsd_client.incr(self._metric_name('connection_pool.miss'))
+                break
+
+            # Connections that were used recently are handed out without a round trip to the server.
+            if time.time() - checked_in_at < self.check_interval or self._is_healthy(connection):
+                statsd_client.incr(self._metric_name('connection_pool.hit'))
+                break
+
+            self._release_slot()
+            self._discard(connection)
+
+        statsd_client.timing(self._metric_name('connection_pool.wait_time'), 1000 * (time.time() - start_time))
+        return connection
+
+    def _is_healthy(self, connection):
+        try:
+            return self._check(connection)
+        except Exception:
+            logger.debug("Pooled connection failed its health check.", exc_info=1)
+            return False
+
+    def _reset_session(self, connection):
+        try:
+            return self._reset(connection)
+        except Exception:
+            logger.debug("Failed resetting pooled connection.", exc_info=1)
+            return False
+
+    def _release_slot(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def checkin(self, connection, discard=False):
+        """
+        Returns a connection to the pool. Connections that might be in an unknown state (like after an interrupted
+        query) should be discarded instead, and so are the ones that can't be reset.
+        """
+        if self.max_size <= 0:
+            self._discard(connection)
+            return
+
+        if not discard and not self._closed:
+            discard = not self._reset_session(connection)
+
+        with self._condition:
+            keep = not discard and not self._closed
+            if keep:
+                self._idle.append((connection, time.time()))
+                self._condition.notify()
+
+        if not keep:
+            self._release_slot()
+            self._discard(connection)
+
+    @contextmanager
+    def connection(self, reusable=True):
+        """
+        Checks out a connection for the duration of the block. It's discarded if the block raises, or when it isn't
+        reusable (like when the block leaves session state that can't be reset).
+        """
+        connection = self.checkout()
+        try:
+            yield connection
+        except BaseException:
+            self.checkin(connection, discard=True)
+            raise
+        else:
+            self.checkin(connection, discard=not reusable)
+
+    def close(self):
+        """
+        Closes the idle connections, and the others when they're checked in.
+        """
+        with self._condition:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle = []
+            self._size -= len(idle)
+
+        for connection in idle:
+            self._discard(connection)
+
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def configuration_hash(configuration):
+    return hashlib.sha1(json.dumps(dict(configuration.iteritems()), sort_keys=True)).hexdigest()
+
+
+def get_pool(query_runner, connect, check=None, close=None, reset=None):
+    """
+    Returns the connection pool of the query runner's data source and configuration, creating it if needed (and
+    closing the pools of previous configurations of the data source).
+    """
+    global _pools_pid
+
+    config_hash = configuration_hash(query_runner.configuration)
+    key = (query_runner.type(), query_runner.data_source_id or config_hash)
+
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Connections opened by the parent process can't be shared with it.
+            _pools.clear()
+            _pools_pid = os.getpid()
+
+        stale_pool = None
+        pool_hash, pool = _pools.get(key, (None, None))
+        if pool is not None and pool_hash != config_hash:
+            stale_pool, pool = pool, None
+
+        if pool is None:
+            pool = ConnectionPool(connect, check, close, reset,
+                                  metric_tags={'type': query_runner.type(),
+                                               'data_source_id': query_runner.data_source_id})
+            _pools[key] = (config_hash, pool)
+
+        pools = [p for _, p in _pools.values()]
+
+    if stale_pool is not None:
+        stale_pool.close()
+
+    # Pools of data sources that aren't used anymore eventually close all their connections:
+    for other_pool in pools:
+        if other_pool is not pool:
+            other_pool.close_idle()
+
+    return pool
+
+
+def close_all():
+    with _pools_lock:
+        pools = [pool for _, pool in _pools.values()]
+        _pools.clear()
+
+    for pool in pools:
+        pool.close()
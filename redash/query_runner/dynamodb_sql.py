@@ -1,9 +1,7 @@
-import json
 import logging
 import sys
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -121,8 +119,7 @@ class DynamoDBSQL(BaseSQLQueryRunner):
                         })
                 rows.append(item)
 
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+            json_data = ResultSet.from_dicts(columns, rows).to_json()
             error = None
         except ParseException as e:
             error = u"Error parsing query at line {} (column {}):\n{}".format(e.lineno, e.column, e.line)
@@ -1,12 +1,15 @@
 import logging
 import sys
+import time
 import urllib
 
 import requests
 import simplejson as json
 from requests.auth import HTTPBasicAuth
 
+from redash import settings
 from redash.query_runner import *
+from redash.query_runner.connection_pool import configuration_hash
 
 try:
     import http.client as http_client
@@ -33,6 +36,9 @@ ELASTICSEARCH_BUILTIN_FIELDS_MAPPING = {
     "_score": "Score"
 }
 
+# (data source, configuration hash, index) -> (expiry time, mappings), see BaseElasticSearch._get_index_mappings.
+_mappings_cache = {}
+
 PYTHON_TYPES_MAPPING = {
     str: TYPE_STRING,
     unicode: TYPE_STRING,
@@ -142,6 +148,75 @@ class BaseElasticSearch(BaseQueryRunner):
 
         return mappings, error
 
+    def _get_index_mappings(self, index_name):
+        """
+        Returns the mappings of the index (see _get_query_mappings), cached for
+        settings.ELASTICSEARCH_MAPPINGS_CACHE_TTL seconds so they aren't downloaded for every query.
+        """
+        key = (self.data_source_id, configuration_hash(self.configuration), index_name)
+        now = time.time()
+
+        cached = _mappings_cache.get(key)
+        if cached is not None and cached[0] > now:
+            # Parsing results adds the types of the values it finds to the mappings.
+            return dict(cached[1]), None
+
+        mapping_url = "{0}/{1}/_mapping".format(self.server_url, index_name)
+        mappings, error = self._get_query_mappings(mapping_url)
+
+        if error is None and settings.ELASTICSEARCH_MAPPINGS_CACHE_TTL > 0:
+            for expired_key in [k for k, (expires_at, _) in _mappings_cache.items() if expires_at <= now]:
+                _mappings_cache.pop(expired_key, None)
+
+            _mappings_cache[key] = (now + settings.ELASTICSEARCH_MAPPINGS_CACHE_TTL, mappings)
+            mappings = dict(mappings)
+
+        return mappings, error
+
+    def _scroll(self, raw_result, limit=None):
+        """
+        Yields the pages of a search started with the scroll parameter (raw_result being its first page) until limit
+        hits were returned, or all of them. Only the current page is held in memory. The scroll context is cleared at
+        the end.
+        """
+        scroll_id = raw_result.get('_scroll_id')
+        returned = 0
+
+        try:
+            while True:
+                hits = raw_result.get('hits', {}).get('hits', [])
+                if limit is not None and returned + len(hits) > limit:
+                    del hits[limit - returned:]
+
+                yield raw_result
+
+                returned += len(hits)
+                if not hits or not scroll_id or (limit is not None and returned >= limit):
+                    break
+
+                r = requests.post("{0}/_search/scroll".format(self.server_url),
+                                  data=json.dumps({'scroll': settings.ELASTICSEARCH_SCROLL_TIMEOUT,
+                                                   'scroll_id': scroll_id}),
+                                  headers={'Content-Type': 'application/json'},
+                                  auth=self.auth)
+                r.raise_for_status()
+
+                raw_result = r.json()
+                scroll_id = raw_result.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id:
+                self._clear_scroll(scroll_id)
+
+    def _clear_scroll(self, scroll_id):
+        # Scroll contexts expire by themselves, clearing them just frees their resources sooner.
+        try:
+            requests.delete("{0}/_search/scroll".format(self.server_url),
+                            data=json.dumps({'scroll_id': [scroll_id]}),
+                            headers={'Content-Type': 'application/json'},
+                            auth=self.auth)
+        except requests.exceptions.RequestException:
+            logger.debug("Failed clearing scroll context.", exc_info=1)
+
     def get_schema(self, *args, **kwargs):
         def parse_doc(doc, path=None):
             '''Recursively parse a doc type dictionary
@@ -297,21 +372,6 @@ class Kibana(BaseElasticSearch):
     def annotate_query(cls):
         return False
 
-    def _execute_simple_query(self, url, auth, _from, mappings, result_fields, result_columns, result_rows):
-        url += "&from={0}".format(_from)
-        r = requests.get(url, auth=self.auth)
-        r.raise_for_status()
-
-        raw_result = r.json()
-
-        self._parse_results(mappings, result_fields, raw_result, result_columns, result_rows)
-
-        total = raw_result["hits"]["total"]
-        result_size = len(raw_result["hits"]["hits"])
-        logger.debug("Result Size: {0}  Total: {1}".format(result_size, total))
-
-        return raw_result["hits"]["total"]
-
     def run_query(self, query, user):
         try:
             error = None
@@ -331,12 +391,10 @@ class Kibana(BaseElasticSearch):
                 return None, error
 
             url = "{0}/{1}/_search?".format(self.server_url, index_name)
-            mapping_url = "{0}/{1}/_mapping".format(self.server_url, index_name)
 
-            mappings, error = self._get_query_mappings(mapping_url)
+            mappings, error = self._get_index_mappings(index_name)
             if error:
                 return None, error
-            #logger.debug(json.dumps(mappings, indent=4))
 
             if sort:
                 url += "&sort={0}".format(urllib.quote_plus(sort))
@@ -349,27 +407,26 @@ class Kibana(BaseElasticSearch):
             result_columns = []
             result_rows = []
             if isinstance(query_data, str) or isinstance(query_data, unicode):
-                _from = 0
-                while True:
-                    query_size = size if limit >= (_from + size) else (limit - _from)
-                    total = self._execute_simple_query(url + "&size={0}".format(query_size), self.auth, _from, mappings, result_fields, result_columns, result_rows)
-                    _from += size
-                    if _from >= limit:
-                        break
+                # Pages of size hits are scrolled through (instead of paging with from, which gets slower with every
+                # page and can't go past the index's max_result_window) and parsed one at a time.
+                url += "&size={0}&scroll={1}".format(min(size, limit), settings.ELASTICSEARCH_SCROLL_TIMEOUT)
+                r = requests.get(url, auth=self.auth)
+                r.raise_for_status()
+
+                for raw_result in self._scroll(r.json(), limit):
+                    self._parse_results(mappings, result_fields, raw_result, result_columns, result_rows)
             else:
                 # TODO: Handle complete ElasticSearch queries (JSON based sent over HTTP POST)
                 raise Exception("Advanced queries are not supported")
 
-            json_data = json.dumps({
-                "columns": result_columns,
-                "rows": result_rows
-            })
+            json_data = ResultSet.from_dicts(result_columns, result_rows).to_json()
         except KeyboardInterrupt:
             error = "Query cancelled by user."
             json_data = None
         except requests.HTTPError as e:
             logger.exception(e)
-            error = "Failed to execute query. Return Code: {0}   Reason: {1}".format(r.status_code, r.text)
+            error = "Failed to execute query. Return Code: {0}   Reason: {1}".format(e.response.status_code,
+                                                                                      e.response.text)
             json_data = None
         except requests.exceptions.RequestException as e:
             logger.exception(e)
@@ -414,34 +471,45 @@ class ElasticSearch(BaseElasticSearch):
                 return None, error
 
             url = "{0}/{1}/_search".format(self.server_url, index_name)
-            mapping_url = "{0}/{1}/_mapping".format(self.server_url, index_name)
 
-            mappings, error = self._get_query_mappings(mapping_url)
+            mappings, error = self._get_index_mappings(index_name)
             if error:
                 return None, error
 
+            # Searches for many hits are scrolled through in pages, so they aren't bound by the index's
+            # max_result_window and the hits are parsed one page at a time. Aggregations and explicit offsets keep
+            # using a single request.
+            size = query_dict.get("size")
+            page_size = settings.QUERY_RESULTS_BATCH_SIZE
+            scroll = (isinstance(size, (int, long)) and size > page_size and "from" not in query_dict and
+                      "aggs" not in query_dict and "aggregations" not in query_dict)
+            if scroll:
+                query_dict["size"] = page_size
+
             params = {"source": json.dumps(query_dict), "source_content_type": "application/json"}
+            if scroll:
+                params["scroll"] = settings.ELASTICSEARCH_SCROLL_TIMEOUT
+
             logger.debug("Using URL: %s", url)
             logger.debug("Using params : %s", params)
             r = requests.get(url, params=params, auth=self.auth)
             r.raise_for_status()
-            logger.debug("Result: %s", r.json())
 
             result_columns = []
             result_rows = []
-            self._parse_results(mappings, result_fields, r.json(), result_columns, result_rows)
+            raw_results = self._scroll(r.json(), size) if scroll else [r.json()]
+            for raw_result in raw_results:
+                self._parse_results(mappings, result_fields, raw_result, result_columns, result_rows)
 
-            json_data = json.dumps({
-                "columns": result_columns,
-                "rows": result_rows
-            })
+            json_data = ResultSet.from_dicts(result_columns, result_rows).to_json()
         except KeyboardInterrupt:
             logger.exception(e)
             error = "Query cancelled by user."
             json_data = None
         except requests.HTTPError as e:
             logger.exception(e)
-            error = "Failed to execute query. Return Code: {0}   Reason: {1}".format(r.status_code, r.text)
+            error = "Failed to execute query. Return Code: {0}   Reason: {1}".format(e.response.status_code,
+                                                                                      e.response.text)
             json_data = None
         except requests.exceptions.RequestException as e:
             logger.exception(e)
@@ -7,7 +7,6 @@ from datetime import datetime
 from urlparse import parse_qs, urlparse
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -170,7 +169,7 @@ class GoogleAnalytics(BaseSQLQueryRunner):
                 response = api.get(**params).execute()
                 data = parse_ga_response(response)
                 error = None
-                json_data = json.dumps(data, cls=JSONEncoder)
+                json_data = ResultSet.from_dicts(data['columns'], data['rows']).to_json()
             except HttpError as e:
                 # Make sure we return a more readable error to the end user
                 error = e._get_reason()
@@ -6,7 +6,6 @@ from dateutil import parser
 from requests import Session
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -93,7 +92,7 @@ class WorksheetNotFoundError(Exception):
 
 def parse_worksheet(worksheet):
     if not worksheet:
-        return {'columns': [], 'rows': []}
+        return ResultSet([])
 
     column_names = []
     columns = []
@@ -115,10 +114,9 @@ def parse_worksheet(worksheet):
         for j, value in enumerate(worksheet[HEADER_INDEX + 1]):
             columns[j]['type'] = _guess_type(value)
 
-    rows = [dict(zip(column_names, _value_eval_list(row))) for row in worksheet[HEADER_INDEX + 1:]]
-    data = {'columns': columns, 'rows': rows}
+    rows = [_value_eval_list(row) for row in worksheet[HEADER_INDEX + 1:]]
 
-    return data
+    return ResultSet(columns, rows)
 
 
 def parse_spreadsheet(spreadsheet, worksheet_num):
@@ -197,7 +195,7 @@ class GoogleSpreadsheet(BaseQueryRunner):
 
             data = parse_spreadsheet(spreadsheet, worksheet_num)
 
-            json_data = json.dumps(data, cls=JSONEncoder)
+            json_data = data.to_json()
             error = None
         except gspread.SpreadsheetNotFound:
             error = "Spreadsheet ({}) not found. Make sure you used correct id.".format(key)
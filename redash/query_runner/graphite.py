@@ -1,27 +1,24 @@
-import json
 import datetime
 import requests
 import logging
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
 
 def _transform_result(response):
-    columns = ({'name': 'Time::x', 'type': TYPE_DATETIME},
+    columns = [{'name': 'Time::x', 'type': TYPE_DATETIME},
                {'name': 'value::y', 'type': TYPE_FLOAT},
-               {'name': 'name::series', 'type': TYPE_STRING})
+               {'name': 'name::series', 'type': TYPE_STRING}]
 
     rows = []
 
     for series in response.json():
         for values in series['datapoints']:
             timestamp = datetime.datetime.fromtimestamp(int(values[1]))
-            rows.append({'Time::x': timestamp, 'name::series': series['target'], 'value::y': values[0]})
+            rows.append((timestamp, values[0], series['target']))
 
-    data = {'columns': columns, 'rows': rows}
-    return json.dumps(data, cls=JSONEncoder)
+    return ResultSet(columns, rows).to_json()
 
 
 class Graphite(BaseQueryRunner):
@@ -1,9 +1,7 @@
-import json
 import logging
 import sys
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -105,12 +103,10 @@ class Impala(BaseSQLQueryRunner):
 
             cursor.execute(query)
 
-            column_names = []
             columns = []
 
             for column in cursor.description:
                 column_name = column[COLUMN_NAME]
-                column_names.append(column_name)
 
                 columns.append({
                     'name': column_name,
@@ -118,10 +114,7 @@ class Impala(BaseSQLQueryRunner):
                     'type': types_map.get(column[COLUMN_TYPE], None)
                 })
 
-            rows = [dict(zip(column_names, row)) for row in cursor]
-
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+            json_data = ResultSet(columns, cursor.fetchall()).to_json()
             error = None
             cursor.close()
         except DatabaseError as e:
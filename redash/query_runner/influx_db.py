@@ -1,8 +1,6 @@
-import json
 import logging
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -31,21 +29,19 @@ def _transform_result(results):
     for result in results:
         for series in result.raw.get('series', []):
             for point in series['values']:
-                result_row = {}
+                result_row = []
                 for column in result_columns:
                     tags = series.get('tags', {})
                     if column in tags:
-                        result_row[column] = tags[column]
+                        result_row.append(tags[column])
                     elif column in series['columns']:
                         index = series['columns'].index(column)
-                        value = point[index]
-                        result_row[column] = value
-                result_rows.append(result_row)
-
-    return json.dumps({
-        "columns": [{'name': c} for c in result_columns],
-        "rows": result_rows
-    }, cls=JSONEncoder)
+                        result_row.append(point[index])
+                    else:
+                        result_row.append(None)
+                result_rows.append(tuple(result_row))
+
+    return ResultSet([{'name': c} for c in result_columns], result_rows).to_json()
 
 
 class InfluxDB(BaseQueryRunner):
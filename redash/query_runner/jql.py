@@ -7,24 +7,15 @@ from collections import OrderedDict
 from redash.query_runner import *
 
 
-# TODO: make this more general and move into __init__.py
-class ResultSet(object):
-    def __init__(self):
-        self.columns = OrderedDict()
-        self.rows = []
-
-    def add_row(self, row):
+def _build_result_set(rows):
+    # Issues only have the fields that are set, so the columns are the union of the fields of all the rows.
+    columns = OrderedDict()
+    for row in rows:
         for key in row.keys():
-            self.add_column(key)
-
-        self.rows.append(row)
-
-    def add_column(self, column, column_type=TYPE_STRING):
-        if column not in self.columns:
-            self.columns[column] = {'name': column, 'type': column_type, 'friendly_name': column}
+            if key not in columns:
+                columns[key] = {'name': key, 'type': TYPE_STRING, 'friendly_name': key}
 
-    def to_json(self):
-        return json.dumps({'rows': self.rows, 'columns': self.columns.values()})
+    return ResultSet.from_dicts(columns.values(), rows)
 
 
 def parse_issue(issue, field_mapping):
@@ -83,18 +74,11 @@ def parse_issue(issue, field_mapping):
 
 
 def parse_issues(data, field_mapping):
-    results = ResultSet()
-
-    for issue in data['issues']:
-        results.add_row(parse_issue(issue, field_mapping))
-
-    return results
+    return _build_result_set([parse_issue(issue, field_mapping) for issue in data['issues']])
 
 
 def parse_count(data):
-    results = ResultSet()
-    results.add_row({'count': data['total']})
-    return results
+    return _build_result_set([{'count': data['total']}])
 
 
 class FieldMapping:
@@ -8,9 +8,8 @@ try:
 except ImportError:
     enabled = False
 
-from redash.query_runner import BaseSQLQueryRunner, register
+from redash.query_runner import BaseSQLQueryRunner, ResultSet, register
 from redash.query_runner import TYPE_STRING, TYPE_DATE, TYPE_DATETIME, TYPE_INTEGER, TYPE_FLOAT, TYPE_BOOLEAN
-from redash.utils import json_dumps
 
 TYPES_MAP = {
     0: TYPE_INTEGER,
@@ -84,10 +83,8 @@ class Mapd(BaseSQLQueryRunner):
         try:
             cursor.execute(query)
             columns = self.fetch_columns([(i[0], TYPES_MAP.get(i[1], None)) for i in cursor.description])
-            rows = [dict(zip((c['name'] for c in columns), row)) for row in cursor]
-            data = {'columns': columns, 'rows': rows}
             error = None
-            json_data = json_dumps(data)
+            json_data = ResultSet(columns, cursor.fetchall()).to_json()
         finally:
             cursor.close()
             connection.close()
@@ -1,9 +1,7 @@
-import json
 import logging
 import sys
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -133,8 +131,7 @@ class MemSQL(BaseSQLQueryRunner):
                         'type': TYPE_STRING
                     })
 
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+            json_data = ResultSet.from_dicts(columns, rows).to_json()
             error = None
         except KeyboardInterrupt:
             cursor.close()
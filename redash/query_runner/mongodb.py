@@ -6,6 +6,7 @@ import re
 from dateutil.parser import parse
 
 from redash.query_runner import *
+from redash.query_runner import connection_pool
 from redash.utils import JSONEncoder, parse_human_time
 
 logger = logging.getLogger(__name__)
@@ -43,6 +44,8 @@ class MongoDBJSONEncoder(JSONEncoder):
         return super(MongoDBJSONEncoder, self).default(o)
 
 
+DEFAULT_SCHEMA_SAMPLE_SIZE = 1000
+
 date_regex = re.compile("ISODate\(\"(.*)\"\)", re.IGNORECASE)
 
 
@@ -74,47 +77,106 @@ def parse_query_json(query):
     return query_data
 
 
-def _get_column_by_name(columns, column_name):
-    for c in columns:
-        if "name" in c and c["name"] == column_name:
-            return c
-
-    return None
-
-
-def parse_results(results):
-    rows = []
-    columns = []
-
-    for row in results:
-        parsed_row = {}
-
-        for key in row:
-            if isinstance(row[key], dict):
-                for inner_key in row[key]:
-                    column_name = '{}.{}'.format(key, inner_key)
-                    if _get_column_by_name(columns, column_name) is None:
-                        columns.append({
-                            "name": column_name,
-                            "friendly_name": column_name,
-                            "type": TYPES_MAP.get(type(row[key][inner_key]), TYPE_STRING)
-                        })
-
-                    parsed_row[column_name] = row[key][inner_key]
-
-            else:
-                if _get_column_by_name(columns, key) is None:
-                    columns.append({
-                        "name": key,
-                        "friendly_name": key,
-                        "type": TYPES_MAP.get(type(row[key]), TYPE_STRING)
-                    })
-
-                parsed_row[key] = row[key]
-
-        rows.append(parsed_row)
-
-    return rows, columns
+def _flatten(document, prefix=u''):
+    """
+    Yields the (name, value) pairs of a document, naming the values of embedded documents (at any depth) by their
+    dotted path.
+    """
+    for key, value in document.iteritems():
+        name = prefix + key
+        if isinstance(value, dict):
+            for item in _flatten(value, name + u'.'):
+                yield item
+        else:
+            yield name, value
+
+
+class ColumnRegistry(object):
+    """
+    The columns of a result, indexed by name. A column's type is guessed from its first value that isn't null.
+    """
+
+    def __init__(self):
+        self.columns = []
+        self._indexes = {}
+        self._untyped = set()
+
+    def __len__(self):
+        return len(self.columns)
+
+    def get_index(self, name):
+        return self._indexes.get(name)
+
+    def add(self, name, value):
+        """
+        Returns the index of the column, registering it if it's new.
+        """
+        index = self._indexes.get(name)
+        if index is None:
+            index = self._indexes[name] = len(self.columns)
+            self.columns.append({
+                "name": name,
+                "friendly_name": name,
+                "type": TYPES_MAP.get(type(value), TYPE_STRING)
+            })
+            if value is None:
+                self._untyped.add(index)
+        elif value is not None and index in self._untyped:
+            self.columns[index]["type"] = TYPES_MAP.get(type(value), TYPE_STRING)
+            self._untyped.discard(index)
+
+        return index
+
+    def flatten(self, document):
+        """
+        Returns the values of the document as a list in column order. Documents flattened before a column was added
+        have shorter lists.
+        """
+        row = [None] * len(self.columns)
+        self._flatten_into(row, document, u'')
+        return row
+
+    def _flatten_into(self, row, document, prefix):
+        # The hot path of parsing results: known columns only take a dict lookup.
+        indexes = self._indexes
+        untyped = self._untyped
+        for key, value in document.iteritems():
+            if isinstance(value, dict):
+                self._flatten_into(row, value, prefix + key + u'.')
+                continue
+
+            name = prefix + key if prefix else key
+            index = indexes.get(name)
+            if index is None or (untyped and value is not None and index in untyped):
+                index = self.add(name, value)
+                if index >= len(row):
+                    row.extend([None] * (index + 1 - len(row)))
+
+            row[index] = value
+
+
+def parse_result_set(results, fields=None):
+    """
+    Returns the documents flattened as a ResultSet. When fields (the projection of the query, mapping field names to
+    their position) is given, the result only has these columns, in that order.
+    """
+    registry = ColumnRegistry()
+    rows = [registry.flatten(document) for document in results]
+
+    indexes = range(len(registry))
+    if fields:
+        indexes = [registry.get_index(name) for name in sorted(fields, key=fields.get)]
+        indexes = [index for index in indexes if index is not None]
+
+    # Rows flattened before the last columns were added are padded while being converted to tuples.
+    width = len(registry)
+    projected = indexes != range(width)
+    for i, row in enumerate(rows):
+        if len(row) < width:
+            row.extend([None] * (width - len(row)))
+        rows[i] = tuple(row[index] for index in indexes) if projected else tuple(row)
+
+    return ResultSet([registry.columns[index] for index in indexes], rows)
 
 
 class MongoDB(BaseQueryRunner):
@@ -135,6 +197,11 @@ class MongoDB(BaseQueryRunner):
                     'type': 'string',
                     'title': 'Replica Set Name'
                 },
+                'schemaSampleSize': {
+                    'type': 'number',
+                    'title': 'Number of Documents Sampled for the Schema',
+                    'default': DEFAULT_SCHEMA_SAMPLE_SIZE
+                },
             },
             'required': ['connectionString', 'dbName']
         }
@@ -156,62 +223,64 @@ class MongoDB(BaseQueryRunner):
 
         self.is_replica_set = True if "replicaSetName" in self.configuration and self.configuration["replicaSetName"] else False
 
-    def _get_db(self):
+    def _get_client(self):
         if self.is_replica_set:
-            db_connection = pymongo.MongoClient(self.configuration["connectionString"],
-                                                replicaSet=self.configuration["replicaSetName"])
-        else:
-            db_connection = pymongo.MongoClient(self.configuration["connectionString"])
+            return pymongo.MongoClient(self.configuration["connectionString"],
+                                       replicaSet=self.configuration["replicaSetName"])
 
-        return db_connection[self.db_name]
+        return pymongo.MongoClient(self.configuration["connectionString"])
+
+    def _get_db(self):
+        return self._get_client()[self.db_name]
 
     def test_connection(self):
         db = self._get_db()
         if not db.command("connectionStatus")["ok"]:
             raise Exception("MongoDB connection error")
 
-    def _merge_property_names(self, columns, document):
-        for property in document:
-              if property not in columns:
-                  columns.append(property)
-
     def _get_collection_fields(self, db, collection_name):
         # Since MongoDB is a document based database and each document doesn't have
         # to have the same fields as another documet in the collection its a bit hard to
         # show these attributes as fields in the schema.
         #
-        # For now, the logic is to take the first and last documents (last is determined
-        # by the Natural Order (http://www.mongodb.org/display/DOCS/Sorting+and+Natural+Order)
-        # as we don't know the correct order. In most single server installations it would be
-        # find. In replicaset when reading from non master it might not return the really last
-        # document written.
-        first_document = None
-        last_document = None
-
-        for d in db[collection_name].find().sort([("$natural", 1)]).limit(1):
-            first_document = d
-
-        for d in db[collection_name].find().sort([("$natural", -1)]).limit(1):
-            last_document = d
+        # The fields are taken from a random sample of documents ($sample, MongoDB 3.2+), falling back to the first
+        # and last documents in natural order (http://www.mongodb.org/display/DOCS/Sorting+and+Natural+Order).
+        sample_size = self.configuration.get('schemaSampleSize', DEFAULT_SCHEMA_SAMPLE_SIZE)
+        collection = db[collection_name]
 
-        columns = []
-        if first_document: self._merge_property_names(columns, first_document)
-        if last_document: self._merge_property_names(columns, last_document)
+        try:
+            documents = collection.aggregate([{'$sample': {'size': sample_size}}])
+            # Older pymongo versions return the result of the aggregate command instead of a cursor.
+            if isinstance(documents, dict):
+                documents = documents['result']
+            documents = list(documents)
+        except pymongo.errors.OperationFailure:
+            logger.debug("Failed sampling collection %s.", collection_name, exc_info=1)
+            documents = list(collection.find().sort([("$natural", 1)]).limit(1))
+            documents.extend(collection.find().sort([("$natural", -1)]).limit(1))
+
+        columns = set()
+        for document in documents:
+            columns.update(name for name, _ in _flatten(document))
 
         return columns
 
-    def get_schema(self, datasource_id, get_stats=False):
+    def get_schema(self, get_stats=False):
         schema = {}
         db = self._get_db()
         for collection_name in db.collection_names():
             columns = self._get_collection_fields(db, collection_name)
-            schema[collection_name] = { "name" : collection_name, "columns" : sorted(columns) }
+            schema[collection_name] = {"name": collection_name, "columns": sorted(columns)}
 
         return schema.values()
 
     def run_query(self, query, user):
-        db = self._get_db()
+        # MongoClient reconnects by itself, so pooled clients don't need to be checked.
+        pool = connection_pool.get_pool(self, self._get_client)
+        with pool.connection() as client:
+            return self._run_query(client[self.db_name], query)
 
+    def _run_query(self, db, query):
         logger.debug("mongodb connection string: %s", self.configuration['connectionString'])
         logger.debug("mongodb got query: %s", query)
 
@@ -254,9 +323,6 @@ class MongoDB(BaseQueryRunner):
             for field_data in query_data["sort"]:
                 s.append((field_data["name"], field_data["direction"]))
 
-        columns = []
-        rows = []
-
         cursor = None
         if q or (not q and not aggregate):
             if s:
@@ -288,31 +354,18 @@ class MongoDB(BaseQueryRunner):
                 cursor = r
 
         if "count" in query_data:
-            columns.append({
-                "name" : "count",
-                "friendly_name" : "count",
-                "type" : TYPE_INTEGER
-            })
+            columns = [{
+                "name": "count",
+                "friendly_name": "count",
+                "type": TYPE_INTEGER
+            }]
 
-            rows.append({ "count" : cursor })
+            results = ResultSet(columns, [(cursor,)])
         else:
-            rows, columns = parse_results(cursor)
+            results = parse_result_set(cursor, f)
 
-        if f:
-            ordered_columns = []
-            for k in sorted(f, key=f.get):
-                column = _get_column_by_name(columns, k)
-                if column:
-                    ordered_columns.append(column)
-
-            columns = ordered_columns
-
-        data = {
-            "columns": columns,
-            "rows": rows
-        }
         error = None
-        json_data = json.dumps(data, cls=MongoDBJSONEncoder)
+        json_data = results.to_json(cls=MongoDBJSONEncoder)
 
         return json_data, error
 
@@ -133,10 +133,7 @@ class SQLServerODBC(BaseSQLQueryRunner):
 
             if cursor.description is not None:
                 columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
-                rows = [dict(zip((c['name'] for c in columns), row)) for row in data]
-
-                data = {'columns': columns, 'rows': rows}
-                json_data = json.dumps(data, cls=MSSQLJSONEncoder)
+                json_data = ResultSet(columns, data).to_json(cls=MSSQLJSONEncoder)
                 error = None
             else:
                 error = "No data was returned."
@@ -2,9 +2,13 @@ import json
 import logging
 import os
 
+import sqlparse
+from sqlparse import tokens
+
+from redash import settings
 from redash.query_runner import *
+from redash.query_runner import connection_pool
 from redash.settings import parse_boolean
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 types_map = {
@@ -27,8 +31,30 @@ types_map = {
 }
 
 
+def _is_blank(statement):
+    return all(token.is_whitespace or token.ttype in tokens.Comment or token.match(tokens.Punctuation, ';')
+               for token in statement.flatten())
+
+
+def _statements_count(query):
+    return len([statement for statement in sqlparse.parse(query) if not _is_blank(statement)])
+
+
+def _fetch_last_result_set(cursor):
+    """
+    Returns the description and rows of the last result set of the executed statements, reading (and discarding) the
+    previous ones.
+    """
+    description, rows = cursor.description, cursor.fetchall()
+    while cursor.nextset():
+        description, rows = cursor.description, cursor.fetchall()
+
+    return description, rows
+
+
 class Mysql(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    _supports_reset_connection = True
 
     @classmethod
     def configuration_schema(cls):
@@ -126,53 +152,129 @@ class Mysql(BaseSQLQueryRunner):
 
         return schema.values()
 
-    def run_query(self, query, user):
-        import MySQLdb
+    def get_schema_change_marker(self):
+        # Altering a table rebuilds it, which updates its creation time.
+        query = """
+        SELECT CONCAT_WS(':', COUNT(*), MAX(tbl.create_time),
+                         (SELECT COUNT(*)
+                          FROM `information_schema`.`columns` col
+                          WHERE col.table_schema NOT IN ('information_schema', 'performance_schema', 'mysql')))
+               AS marker
+        FROM `information_schema`.`tables` tbl
+        WHERE tbl.table_schema NOT IN ('information_schema', 'performance_schema', 'mysql');
+        """
 
-        connection = None
-        try:
-            connection = MySQLdb.connect(host=self.configuration.get('host', ''),
-                                         user=self.configuration.get('user', ''),
-                                         passwd=self.configuration.get('passwd', ''),
-                                         db=self.configuration['db'],
-                                         port=self.configuration.get('port', 3306),
-                                         charset='utf8', use_unicode=True,
-                                         ssl=self._get_ssl_parameters(),
-                                         connect_timeout=60)
-            cursor = connection.cursor()
-            logger.debug("MySQL running query: %s", query)
-            cursor.execute(query)
-
-            data = cursor.fetchall()
-
-            while cursor.nextset():
-                data = cursor.fetchall()
-
-            # TODO - very similar to pg.py
-            if cursor.description is not None:
-                columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
-                rows = [dict(zip((c['name'] for c in columns), row)) for row in data]
-
-                data = {'columns': columns, 'rows': rows}
-                json_data = json.dumps(data, cls=JSONEncoder)
-                error = None
+        return self._run_query_internal(query)[0]['marker']
+
+    def _get_table_size_estimates(self):
+        query = """
+        SELECT tbl.table_schema,
+               tbl.table_name,
+               tbl.table_rows
+        FROM `information_schema`.`tables` tbl
+        WHERE tbl.table_schema NOT IN ('information_schema', 'performance_schema', 'mysql')
+          AND tbl.table_rows IS NOT NULL;
+        """
+
+        estimates = {}
+        for row in self._run_query_internal(query):
+            if row['table_schema'] != self.configuration['db']:
+                table_name = u'{}.{}'.format(row['table_schema'], row['table_name'])
             else:
-                json_data = None
-                error = "No data was returned."
+                table_name = row['table_name']
+
+            estimates[table_name] = row['table_rows']
+
+        return estimates
+
+    def _connect(self):
+        import MySQLdb
+
+        connection = MySQLdb.connect(host=self.configuration.get('host', ''),
+                                     user=self.configuration.get('user', ''),
+                                     passwd=self.configuration.get('passwd', ''),
+                                     db=self.configuration['db'],
+                                     port=self.configuration.get('port', 3306),
+                                     charset='utf8', use_unicode=True,
+                                     ssl=self._get_ssl_parameters(),
+                                     connect_timeout=60)
+        # Pooled connections are reused, so queries mustn't see the snapshot of a transaction left open by the
+        # previous one.
+        connection.autocommit(True)
+        return connection
+
+    def _check_connection(self, connection):
+        connection.ping()
+        return True
 
-            cursor.close()
+    def _reset_connection(self, connection):
+        # Resetting the connection clears the session state (variables, temporary tables, open transactions...) the
+        # query left, without logging in again. Servers older than 5.7.3 don't support it: they log in again instead.
+        if self._supports_reset_connection:
+            try:
+                connection.query('RESET CONNECTION')
+            except connection.ProgrammingError:
+                logger.info("MySQL server doesn't support RESET CONNECTION, logging in again to reset connections.")
+                self._supports_reset_connection = False
+
+        if not self._supports_reset_connection:
+            connection.change_user(self.configuration.get('user', ''), self.configuration.get('passwd', ''),
+                                   self.configuration['db'])
+
+        connection.autocommit(True)
+        return True
+
+    def run_query_iter(self, query, user):
+        import MySQLdb
+        import MySQLdb.cursors
+
+        pool = connection_pool.get_pool(self, self._connect, self._check_connection,
+                                        reset=self._reset_connection)
+
+        try:
+            # Connections are discarded (instead of going back to the pool) when the query fails or is cancelled, or
+            # when the results aren't fetched to the end.
+            with pool.connection() as connection:
+                logger.debug("MySQL running query: %s", query)
+
+                if _statements_count(query) > 1:
+                    # The result of the last statement is returned, which is only known once the previous ones are
+                    # read: the results of queries made of several statements aren't streamed.
+                    cursor = connection.cursor()
+                    cursor.execute(query)
+                    description, rows = _fetch_last_result_set(cursor)
+                    cursor.close()
+                else:
+                    # Rows are streamed from the server in batches, instead of being loaded at once.
+                    cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+                    cursor.execute(query)
+                    description, rows = cursor.description, None
+
+                if description is None:
+                    raise QueryRunnerError("No data was returned.")
+
+                yield self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in description])
+
+                if rows is not None:
+                    for i in range(0, len(rows), settings.QUERY_RESULTS_BATCH_SIZE):
+                        yield rows[i:i + settings.QUERY_RESULTS_BATCH_SIZE]
+                    return
+
+                while True:
+                    rows = cursor.fetchmany(settings.QUERY_RESULTS_BATCH_SIZE)
+                    if not rows:
+                        break
+                    yield rows
+
+                # Reads the remaining result sets, so the connection can be used again.
+                cursor.close()
         except MySQLdb.Error as e:
-            json_data = None
-            error = e.args[1]
-        except KeyboardInterrupt:
-            cursor.close()
-            error = "Query cancelled by user."
-            json_data = None
-        finally:
-            if connection:
-                connection.close()
-
-        return json_data, error
+            raise QueryRunnerError(e.args[1])
+        except (KeyboardInterrupt, InterruptException):
+            raise QueryRunnerError("Query cancelled by user.")
+
+    def run_query(self, query, user):
+        return self._run_query_from_iter(query, user)
 
     def _get_ssl_parameters(self):
         ssl_params = {}
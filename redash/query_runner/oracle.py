@@ -4,7 +4,6 @@ import sys
 
 from redash.models import DataSourceTable, DataSourceColumn
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 try:
     import cx_Oracle
@@ -167,15 +166,11 @@ class Oracle(BaseSQLQueryRunner):
             rows_count = cursor.rowcount
             if cursor.description is not None:
                 columns = self.fetch_columns([(i[0], Oracle.get_col_type(i[1], i[5])) for i in cursor.description])
-                rows = [dict(zip((c['name'] for c in columns), row)) for row in cursor]
-                data = {'columns': columns, 'rows': rows}
                 error = None
-                json_data = json.dumps(data, cls=JSONEncoder)
+                json_data = ResultSet(columns, cursor.fetchall()).to_json()
             else:
                 columns = [{'name': 'Row(s) Affected', 'type': 'TYPE_INTEGER'}]
-                rows = [{'Row(s) Affected': rows_count}]
-                data = {'columns': columns, 'rows': rows}
-                json_data = json.dumps(data, cls=JSONEncoder)
+                json_data = ResultSet(columns, [(rows_count,)]).to_json()
                 connection.commit()   
         except cx_Oracle.DatabaseError as err:
             error = u"Query failed. {}.".format(err.message)
@@ -4,9 +4,12 @@ import logging
 import select
 
 import psycopg2
+import sqlparse
+from sqlparse import tokens
 
+from redash import settings
 from redash.query_runner import *
-from redash.utils import JSONEncoder
+from redash.query_runner import connection_pool
 
 logger = logging.getLogger(__name__)
 
@@ -45,8 +48,48 @@ def _wait(conn, timeout=None):
             raise psycopg2.OperationalError("select.error received")
 
 
+def _is_blank(statement):
+    return all(token.is_whitespace or token.ttype in tokens.Comment or token.match(tokens.Punctuation, ';')
+               for token in statement.flatten())
+
+
+def _single_select_statement(query):
+    """
+    Returns the query without its trailing semicolon if it's a single plain SELECT statement (the only kind of
+    statement a cursor can be declared for), or None otherwise. SELECT ... INTO and SELECT statements with data
+    modifying WITH queries aren't plain SELECT statements.
+    """
+    statements = [statement for statement in sqlparse.parse(query) if not _is_blank(statement)]
+    if len(statements) != 1 or statements[0].get_type() != 'SELECT':
+        return None
+
+    statement_tokens = list(statements[0].flatten())
+    for token in statement_tokens:
+        if token.ttype in tokens.Keyword.DML and token.normalized != 'SELECT':
+            return None
+        if token.ttype in tokens.Keyword and token.normalized == 'INTO':
+            return None
+
+    for i in reversed(range(len(statement_tokens))):
+        token = statement_tokens[i]
+        if token.is_whitespace or token.ttype in tokens.Comment:
+            continue
+        if token.match(tokens.Punctuation, ';'):
+            del statement_tokens[i]
+        break
+
+    # Comments are kept as they are, so a trailing single line comment needs a line break after it.
+    return u''.join(token.value for token in statement_tokens) + u'\n'
+
+
 class PostgreSQL(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    # SELECT queries are fetched in batches through a server side cursor, so large results are never held in memory
+    # at once.
+    use_server_side_cursors = True
+    # Clears the session state a query leaves on a pooled connection. Without it, connections are only reused after
+    # plain SELECT queries.
+    reset_session_query = 'DISCARD ALL'
 
     @classmethod
     def configuration_schema(cls):
@@ -131,6 +174,46 @@ class PostgreSQL(BaseSQLQueryRunner):
 
         return schema.values()
 
+    def get_schema_change_marker(self):
+        # DDL statements write new versions of the catalog rows of the relations and columns they change, so the
+        # transaction ids (xmin) of these rows change with the schema.
+        query = """
+        SELECT (SELECT count(*) || ':' || coalesce(sum(xmin::text::bigint), 0)
+                FROM pg_class
+                WHERE relkind IN ('r', 'v', 'm', 'f', 'p')) || '/' ||
+               (SELECT count(*) || ':' || coalesce(sum(xmin::text::bigint), 0)
+                FROM pg_attribute
+                WHERE attnum > 0) AS marker;
+        """
+
+        return self._run_query_internal(query)[0]['marker']
+
+    def _get_table_size_estimates(self):
+        query = """
+        SELECT ns.nspname AS table_schema,
+               cls.relname AS table_name,
+               cls.reltuples AS row_count
+        FROM pg_class cls
+          JOIN pg_namespace ns ON cls.relnamespace = ns.oid
+        WHERE cls.relkind IN ('r', 'm', 'p')
+          AND ns.nspname NOT IN ('pg_catalog', 'information_schema');
+        """
+
+        estimates = {}
+        for row in self._run_query_internal(query):
+            # Tables that were never analyzed have no estimate (reltuples is -1 or 0 on older versions).
+            if row['row_count'] < 0:
+                continue
+
+            if row['table_schema'] != 'public':
+                table_name = '{}.{}'.format(row['table_schema'], row['table_name'])
+            else:
+                table_name = row['table_name']
+
+            estimates[table_name] = int(row['row_count'])
+
+        return estimates
+
     def _get_connection(self):
         connection = psycopg2.connect(user=self.configuration.get('user'),
                                       password=self.configuration.get('password'),
@@ -142,43 +225,126 @@ class PostgreSQL(BaseSQLQueryRunner):
 
         return connection
 
-    def run_query(self, query, user):
+    def _connect(self):
         connection = self._get_connection()
         _wait(connection, timeout=10)
+        return connection
 
-        cursor = connection.cursor()
+    def _check_connection(self, connection):
+        # The server might have closed the connection while it was idle.
+        if connection.closed:
+            return False
 
+        cursor = connection.cursor()
         try:
-            cursor.execute(query)
-            _wait(connection)
+            cursor.execute('SELECT 1')
+            _wait(connection, timeout=10)
+        finally:
+            cursor.close()
 
-            if cursor.description is not None:
-                columns = self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
-                rows = [dict(zip((c['name'] for c in columns), row)) for row in cursor]
+        return True
 
-                data = {'columns': columns, 'rows': rows}
-                error = None
-                json_data = json.dumps(data, cls=JSONEncoder)
-            else:
-                error = 'Query completed but it returned no data.'
-                json_data = None
-        except (select.error, OSError) as e:
-            error = "Query interrupted. Please retry."
-            json_data = None
-        except psycopg2.DatabaseError as e:
-            error = e.message
-            json_data = None
-        except (KeyboardInterrupt, InterruptException):
-            connection.cancel()
-            error = "Query cancelled by user."
-            json_data = None
+    def _reset_connection(self, connection):
+        # Clears the session state (settings, temporary tables, prepared statements...) the query left. Connections
+        # with a transaction left open by the query aren't reused.
+        if connection.closed or connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+
+        if self.reset_session_query is None:
+            return True
+
+        cursor = connection.cursor()
+        try:
+            self._execute(connection, cursor, self.reset_session_query)
         finally:
-            connection.close()
+            cursor.close()
+
+        return True
+
+    def _execute(self, connection, cursor, query):
+        cursor.execute(query)
+        _wait(connection)
+
+    def _fetch_client_side(self, connection, cursor, query):
+        self._execute(connection, cursor, query)
 
-        return json_data, error
+        if cursor.description is None:
+            raise QueryRunnerError('Query completed but it returned no data.')
+
+        yield self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
+
+        while True:
+            rows = cursor.fetchmany(settings.QUERY_RESULTS_BATCH_SIZE)
+            if not rows:
+                break
+            yield rows
+
+    def _fetch_server_side(self, connection, cursor, select_query):
+        # Asynchronous connections don't support named cursors, so the cursor is declared explicitly (in a
+        # transaction, as the connection is in autocommit mode).
+        self._execute(connection, cursor, 'BEGIN')
+        self._execute(connection, cursor, u'DECLARE redash_cursor NO SCROLL CURSOR FOR ' + select_query)
+
+        fetch_query = 'FETCH FORWARD {} FROM redash_cursor'.format(settings.QUERY_RESULTS_BATCH_SIZE)
+        self._execute(connection, cursor, fetch_query)
+        yield self.fetch_columns([(i[0], types_map.get(i[1], None)) for i in cursor.description])
+
+        rows = cursor.fetchall()
+        while rows:
+            yield rows
+            self._execute(connection, cursor, fetch_query)
+            rows = cursor.fetchall()
+
+        self._execute(connection, cursor, 'COMMIT')
+
+    def run_query_iter(self, query, user):
+        pool = connection_pool.get_pool(self, self._connect, self._check_connection,
+                                        reset=self._reset_connection)
+
+        plain_select_query = _single_select_statement(query)
+        select_query = plain_select_query if self.use_server_side_cursors else None
+        reusable = plain_select_query is not None or self.reset_session_query is not None
+
+        # Connections are discarded (instead of going back to the pool) when the query fails or is cancelled, or when
+        # the session state it leaves can't be reset.
+        with pool.connection(reusable) as connection:
+            cursor = connection.cursor()
+
+            try:
+                if select_query is None:
+                    batches = self._fetch_client_side(connection, cursor, query)
+                else:
+                    batches = self._fetch_server_side(connection, cursor, select_query)
+
+                for batch in batches:
+                    yield batch
+            except GeneratorExit:
+                # The results weren't fetched to the end (they were truncated). The transaction of the cursor is
+                # ended, so the connection can go back to the pool.
+                batches.close()
+                if select_query is not None:
+                    self._execute(connection, cursor, 'CLOSE redash_cursor')
+                    self._execute(connection, cursor, 'COMMIT')
+            except (select.error, OSError) as e:
+                raise QueryRunnerError("Query interrupted. Please retry.")
+            except psycopg2.DatabaseError as e:
+                raise QueryRunnerError(e.message)
+            except (KeyboardInterrupt, InterruptException):
+                connection.cancel()
+                raise QueryRunnerError("Query cancelled by user.")
+            finally:
+                cursor.close()
+
+    def run_query(self, query, user):
+        return self._run_query_from_iter(query, user)
 
 
 class Redshift(PostgreSQL):
+    # Cursors on the leader node are materialized before the first fetch, and limited in number and size.
+    use_server_side_cursors = False
+    # Redshift doesn't support DISCARD.
+    reset_session_query = None
+
     @classmethod
     def type(cls):
         return "redshift"
@@ -251,8 +417,31 @@ class Redshift(PostgreSQL):
 
         return schema.values()
 
+    def get_schema_change_marker(self):
+        # External (Spectrum) tables and late binding views aren't tracked in pg_class.
+        return None
+
+    def _get_table_size_estimates(self):
+        query = """
+        SELECT "schema" AS table_schema, "table" AS table_name, tbl_rows AS row_count
+        FROM svv_table_info;
+        """
+
+        estimates = {}
+        for row in self._run_query_internal(query):
+            if row['table_schema'] != 'public':
+                table_name = '{}.{}'.format(row['table_schema'], row['table_name'])
+            else:
+                table_name = row['table_name']
+
+            estimates[table_name] = int(row['row_count'])
+
+        return estimates
+
 
 class CockroachDB(PostgreSQL):
+    use_server_side_cursors = False
+
     def __init__(self, configuration):
         super(CockroachDB, self).__init__(configuration)
 
@@ -260,6 +449,12 @@ class CockroachDB(PostgreSQL):
     def type(cls):
         return "cockroach"
 
+    def get_schema_change_marker(self):
+        return None
+
+    def _get_table_size_estimates(self):
+        return None
+
 register(PostgreSQL)
 register(Redshift)
 register(CockroachDB)
@@ -1,6 +1,6 @@
 import json
 
-from redash.utils import JSONEncoder
+from redash import settings
 from redash.query_runner import *
 
 import logging
@@ -94,7 +94,7 @@ class Presto(BaseQueryRunner):
 
         return schema.values()
 
-    def run_query(self, query, user):
+    def run_query_iter(self, query, user):
         connection = presto.connect(
                 host=self.configuration.get('host', ''),
                 port=self.configuration.get('port', 8080),
@@ -104,30 +104,35 @@ class Presto(BaseQueryRunner):
 
         cursor = connection.cursor()
 
-
         try:
             cursor.execute(query)
             column_tuples = [(i[0], PRESTO_TYPES_MAPPING.get(i[1], None)) for i in cursor.description]
-            columns = self.fetch_columns(column_tuples)
-            rows = [dict(zip(([c['name'] for c in columns]), r)) for i, r in enumerate(cursor.fetchall())]
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
-            error = None
+            yield self.fetch_columns(column_tuples)
+
+            # The rows are fetched from the coordinator page by page, as they're consumed.
+            while True:
+                rows = cursor.fetchmany(settings.QUERY_RESULTS_BATCH_SIZE)
+                if not rows:
+                    break
+                yield rows
         except DatabaseError as db:
-            json_data = None
             default_message = 'Unspecified DatabaseError: {0}'.format(db.message)
             message = db.message.get('failureInfo', {'message', None}).get('message')
-            error = default_message if message is None else message
+            raise QueryRunnerError(default_message if message is None else message)
         except (KeyboardInterrupt, InterruptException) as e:
             cursor.cancel()
-            error = "Query cancelled by user."
-            json_data = None
+            raise QueryRunnerError("Query cancelled by user.")
+        except GeneratorExit:
+            # The results weren't fetched to the end (they were truncated).
+            cursor.cancel()
+            raise
         except Exception as ex:
-            json_data = None
             error = ex.message
             if not isinstance(error, basestring):
                 error = unicode(error)
+            raise QueryRunnerError(error)
 
-        return json_data, error
+    def run_query(self, query, user):
+        return self._run_query_from_iter(query, user)
 
 register(Presto)
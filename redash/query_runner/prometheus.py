@@ -1,8 +1,7 @@
 import requests
 from datetime import datetime
 from urlparse import parse_qs
-from redash.query_runner import BaseQueryRunner, register, TYPE_DATETIME, TYPE_STRING
-from redash.utils import json_dumps
+from redash.query_runner import BaseQueryRunner, ResultSet, register, TYPE_DATETIME, TYPE_STRING
 
 
 def get_instant_rows(metrics_data):
@@ -143,12 +142,7 @@ class Prometheus(BaseQueryRunner):
             else:
                 rows = get_instant_rows(metrics)
 
-            json_data = json_dumps(
-                {
-                    'rows': rows,
-                    'columns': columns
-                }
-            )
+            json_data = ResultSet.from_dicts(columns, rows).to_json()
 
         except requests.RequestException as e:
             return None, str(e)
@@ -4,9 +4,8 @@ import requests
 import logging
 from cStringIO import StringIO
 
-from redash.query_runner import BaseQueryRunner, register
+from redash.query_runner import BaseQueryRunner, ResultSet, register
 from redash.query_runner import TYPE_STRING
-from redash.utils import json_dumps
 
 try:
     import qds_sdk
@@ -90,9 +89,9 @@ class Qubole(BaseQueryRunner):
 
                 data = results.split('\r\n')
                 columns = self.fetch_columns([(i, TYPE_STRING) for i in data.pop(0).split('\t')])
-                rows = [dict(zip((c['name'] for c in columns), row.split('\t'))) for row in data]
+                rows = [row.split('\t') for row in data]
 
-            json_data = json_dumps({'columns': columns, 'rows': rows})
+            json_data = ResultSet(columns, rows).to_json()
         except KeyboardInterrupt:
             logging.info('Sending KILL signal to Qubole Command Id: %s', cmd.id)
             cmd.cancel()
@@ -1,20 +1,53 @@
-import json
+import errno
+import hashlib
 import logging
 import numbers
+import os
 import re
 import sqlite3
+import tempfile
+import threading
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 from dateutil import parser
+from flask import current_app, has_app_context
 
-from redash import models
+from redash import models, settings
 from redash.permissions import has_access, not_view_only
-from redash.query_runner import (TYPE_BOOLEAN, TYPE_DATETIME, TYPE_FLOAT,
-                                 TYPE_INTEGER, TYPE_STRING, BaseQueryRunner,
-                                 register)
+from redash.query_runner import (TYPE_BOOLEAN, TYPE_DATE, TYPE_DATETIME,
+                                 TYPE_FLOAT, TYPE_INTEGER, TYPE_STRING,
+                                 BaseQueryRunner, QueryRunnerError, register)
+from redash.results import ColumnarResult, QueryResultWriter
 from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
+# Number of rows used to guess the type of output columns which aren't a plain reference to a loaded column.
+TYPE_SAMPLE_SIZE = 100
+
+# Declared types of the loaded columns, which record their Redash type. They all have BLOB affinity (they contain
+# BLOB but none of INT, CHAR, CLOB or TEXT), so SQLite stores the values as given.
+DECLARED_TYPES = {
+    TYPE_INTEGER: 'BLOB_WHOLE',
+    TYPE_FLOAT: 'BLOB_FLOAT',
+    TYPE_BOOLEAN: 'BLOB_BOOLEAN',
+    TYPE_STRING: 'BLOB_STRING',
+    TYPE_DATETIME: 'BLOB_DATETIME',
+    TYPE_DATE: 'BLOB_DATE',
+}
+COLUMN_TYPES = dict((declared_type, column_type) for column_type, declared_type in DECLARED_TYPES.items())
+
+# Temporary view used to read the declared types of the output columns.
+OUTPUT_VIEW = '_redash_output'
+
+# Maximum number of referenced queries executed at the same time.
+MAX_PARALLEL_QUERIES = 4
+
+# Seconds to wait for the referenced queries executed in parallel. Waiting with a timeout keeps the waiting thread
+# interruptible (by the SIGINT cancelling a query).
+PARALLEL_QUERIES_TIMEOUT = 365 * 24 * 3600
+
 
 class PermissionError(Exception):
     pass
@@ -42,11 +75,36 @@ def _guess_type(value):
     return TYPE_STRING
 
 
+def _guess_column_type(values):
+    """
+    Guesses the type of a column from a sample of its values, ignoring empty ones. Falls back to string when the
+    values' types disagree.
+    """
+    column_type = None
+
+    for value in values:
+        if value == '' or value is None:
+            continue
+
+        guess = _guess_type(value)
+        if column_type is None:
+            column_type = guess
+        elif column_type != guess:
+            return TYPE_STRING
+
+    return column_type or TYPE_STRING
+
+
 def extract_query_ids(query):
     queries = re.findall(r'(?:join|from)\s+query_(\d+)', query, re.IGNORECASE)
     return [int(q) for q in queries]
 
 
+def extract_cached_query_ids(query):
+    queries = re.findall(r'(?:join|from)\s+cached_query_(\d+)', query, re.IGNORECASE)
+    return [int(q) for q in queries]
+
+
 def _load_query(user, query_id):
     query = models.Query.get_by_id(query_id)
 
@@ -60,45 +118,321 @@ def _load_query(user, query_id):
     return query
 
 
-def create_tables_from_query_ids(user, connection, query_ids):
+def _until_cancelled(results, cancelled):
+    for item in results:
+        if cancelled.is_set():
+            raise QueryRunnerError("Query cancelled.")
+        yield item
+
+
+def _execute_query(args, cancelled=None):
+    """
+    Runs a referenced query into a QueryResultWriter. Stops fetching its results once cancelled (an Event) is set.
+    """
+    query_id, query_runner, query_text, user = args
+    writer = QueryResultWriter()
+    results = query_runner.run_query_iter(query_text, user)
+    if cancelled is not None:
+        results = _until_cancelled(results, cancelled)
+
+    try:
+        writer.consume(results)
+    except QueryRunnerError:
+        writer.close()
+        raise Exception(
+            "Failed loading results for query id {}.".format(query_id))
+    finally:
+        if hasattr(results, 'close'):
+            results.close()
+
+    if writer.columns is None:
+        writer.close()
+        raise Exception(
+            "Failed loading results for query id {}.".format(query_id))
+
+    return writer
+
+
+def _execute_query_in_thread(app, cancelled, args):
+    # Referenced queries can use the database (like the ones of Query Results data sources), which needs an
+    # application context in every thread.
+    if app is None:
+        return _execute_query(args, cancelled)
+
+    with app.app_context():
+        return _execute_query(args, cancelled)
+
+
+def _execute_queries(queries):
+    if len(queries) <= 1:
+        return map(_execute_query, queries)
+
+    app = current_app._get_current_object() if has_app_context() else None
+    cancelled = threading.Event()
+    pool = ThreadPool(min(len(queries), MAX_PARALLEL_QUERIES))
+    try:
+        writers = pool.map_async(partial(_execute_query_in_thread, app, cancelled), queries)
+        writers = writers.get(PARALLEL_QUERIES_TIMEOUT)
+    except BaseException:
+        # Interrupted or failed: the queries still running stop at their next batch of rows, without waiting for them.
+        cancelled.set()
+        pool.terminate()
+        raise
+
+    pool.close()
+    pool.join()
+    return writers
+
+
+def _resolve_tables(user, query_ids, cached_query_ids=(), max_age=0):
+    """
+    Checks access to the referenced queries and resolves the content of their tables: the latest stored results for
+    cached_query_<id> tables, and for query_<id> tables a stored result retrieved in the last max_age seconds or else
+    the query to execute.
+
+    Returns a list of (table name, query result) tuples and a list of (table name, _execute_query arguments) tuples.
+    """
+    stored_results = []
+    queries_to_execute = []
+
     for query_id in set(query_ids):
         query = _load_query(user, query_id)
+        table_name = 'query_{query_id}'.format(query_id=query_id)
+        query_result = None
 
-        results, error = query.data_source.query_runner.run_query(
-            query.query_text, user)
+        if max_age > 0:
+            query_result = models.QueryResult.get_latest(query.data_source, query.query_text, max_age)
 
-        if error:
-            raise Exception(
-                "Failed loading results for query id {}.".format(query.id))
+        if query_result is not None:
+            stored_results.append((table_name, query_result))
+        else:
+            queries_to_execute.append((table_name, (query.id, query.data_source.query_runner, query.query_text, user)))
 
-        results = json.loads(results)
-        table_name = 'query_{query_id}'.format(query_id=query_id)
-        create_table(connection, table_name, results)
+    for query_id in set(cached_query_ids):
+        query = _load_query(user, query_id)
+
+        if query.latest_query_data is None:
+            raise Exception("Query id {} has no cached result.".format(query.id))
+
+        stored_results.append(('cached_query_{query_id}'.format(query_id=query_id), query.latest_query_data))
+
+    return stored_results, queries_to_execute
+
+
+def _load_tables(connection, stored_results, queries_to_execute):
+    """
+    Loads the tables resolved by _resolve_tables, executing the queries in parallel.
+    """
+    tables = [(table_name,) + query_result.iter_rows() for table_name, query_result in stored_results]
+
+    writers = _execute_queries([args for _, args in queries_to_execute])
+    try:
+        for (table_name, _), writer in zip(queries_to_execute, writers):
+            result = ColumnarResult(writer.getvalue())
+            tables.append((table_name, result.columns, result.iter_rows()))
+
+        for table_name, columns, rows in tables:
+            load_table(connection, table_name, columns, [rows])
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+def create_tables_from_query_ids(user, connection, query_ids, cached_query_ids=(), max_age=0):
+    """
+    Loads the results of the given queries into tables named query_<id>, and the latest stored results of the queries
+    given in cached_query_ids into tables named cached_query_<id>. Stored results retrieved in the last max_age seconds
+    are reused for query_<id> tables too.
+    """
+    stored_results, queries_to_execute = _resolve_tables(user, query_ids, cached_query_ids, max_age)
+    _load_tables(connection, stored_results, queries_to_execute)
+
+
+class DatabaseCache(object):
+    """
+    Worker local cache of the SQLite databases built from stored query results. A database is keyed by the ids of the
+    query results it holds (which never change), so it can be reused as is by any query over the same results. The
+    least recently used databases are removed when the cache grows over max_size bytes.
+    """
+    # Set as the database's user_version once it's completely written.
+    LOADED_VERSION = 1
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def key(stored_results):
+        tables = sorted('{}:{}'.format(table_name, query_result.id) for table_name, query_result in stored_results)
+        return hashlib.sha1(','.join(tables)).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.path, key + '.sqlite')
+
+    def _open(self, path):
+        connection = sqlite3.connect(path)
+        try:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+        except sqlite3.Error:
+            version = None
+
+        if version != self.LOADED_VERSION:
+            # Evicted (or never completely written) in the meantime.
+            connection.close()
+            return None
+
+        return connection
+
+    def _build(self, path, load):
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Built in a temporary file first, so other workers never open a partially loaded database.
+        fd, temp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        os.close(fd)
+
+        try:
+            connection = sqlite3.connect(temp_path)
+            try:
+                load(connection)
+                connection.execute('PRAGMA user_version = {}'.format(self.LOADED_VERSION))
+            finally:
+                connection.close()
+
+            os.rename(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def connect(self, key, load):
+        """
+        Returns a read only connection to the database with the given key. Missing databases are built by calling
+        load with a connection.
+        """
+        path = self._path(key)
+        connection = None
+
+        if os.path.exists(path):
+            connection = self._open(path)
+
+        if connection is None:
+            self._build(path, load)
+            connection = self._open(path)
+            self.evict()
+        else:
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+
+        connection.execute('PRAGMA query_only = ON')
+        return connection
+
+    def evict(self):
+        try:
+            names = [name for name in os.listdir(self.path) if name.endswith('.sqlite')]
+        except OSError:
+            return
+
+        files = []
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+
+        total_size = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total_size <= self.max_size:
+                break
+
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total_size -= size
 
 
 def fix_column_name(name):
     return name.replace(':', '_').replace('.', '_').replace(' ', '_')
 
 
-def create_table(connection, table_name, query_results):
-    columns = [column['name']
-               for column in query_results['columns']]
-    safe_columns = [fix_column_name(column) for column in columns]
+def _to_sqlite_value(value, encoder):
+    if value is None or isinstance(value, (basestring, int, long, float)):
+        return value
+
+    if isinstance(value, (list, dict)):
+        return encoder.encode(value)
+
+    return encoder.default(value)
+
+
+def load_table(connection, table_name, columns, batches):
+    """
+    Creates a table with the given columns and loads the batches of rows (as yielded by
+    BaseQueryRunner.run_query_iter) into it, with one executemany per batch in a single transaction. The columns
+    are declared with the type recorded in DECLARED_TYPES.
+    """
+    column_names = [column['name'] for column in columns]
+    safe_columns = [fix_column_name(column) for column in column_names]
 
     column_list = ", ".join(safe_columns)
-    create_table = u"CREATE TABLE {table_name} ({column_list})".format(
-        table_name=table_name, column_list=column_list)
+    column_definitions = ", ".join(
+        u"{} {}".format(name, DECLARED_TYPES.get(column.get('type'), '')).strip()
+        for name, column in zip(safe_columns, columns))
+    create_table = u"CREATE TABLE {table_name} ({column_definitions})".format(
+        table_name=table_name, column_definitions=column_definitions)
     logger.debug("CREATE TABLE query: %s", create_table)
     connection.execute(create_table)
 
     insert_template = u"insert into {table_name} ({column_list}) values ({place_holders})".format(
         table_name=table_name,
         column_list=column_list,
-        place_holders=','.join(['?'] * len(columns)))
+        place_holders=','.join(['?'] * len(column_names)))
 
-    for row in query_results['rows']:
-        values = [row.get(column) for column in columns]
-        connection.execute(insert_template, values)
+    encoder = JSONEncoder()
+
+    def values(rows):
+        for row in rows:
+            if isinstance(row, dict):
+                row = [row.get(column) for column in column_names]
+            yield [_to_sqlite_value(value, encoder) for value in row]
+
+    with connection:
+        for rows in batches:
+            connection.executemany(insert_template, values(rows))
+
+
+def create_table(connection, table_name, query_results):
+    load_table(connection, table_name, query_results['columns'], [query_results['rows']])
+
+
+def _output_column_types(connection, query):
+    """
+    Returns the types of the query's output columns, by position. Only columns referencing a loaded column (possibly
+    renamed) have one; the others (expressions) are None. Returns None when the query can't be inspected (it isn't a
+    single SELECT statement).
+    """
+    query_only = connection.execute('PRAGMA query_only').fetchone()[0]
+    # The view is created in the temp database, which read only connections don't allow writing to either.
+    connection.execute('PRAGMA query_only = OFF')
+    try:
+        connection.execute(u'CREATE TEMP VIEW {} AS {}'.format(OUTPUT_VIEW, query.strip().rstrip(';')))
+    except (sqlite3.Error, sqlite3.Warning):
+        connection.execute('PRAGMA query_only = {}'.format(query_only))
+        return None
+
+    try:
+        columns = connection.execute('PRAGMA temp.table_info({})'.format(OUTPUT_VIEW)).fetchall()
+    finally:
+        connection.execute('DROP VIEW temp.{}'.format(OUTPUT_VIEW))
+        connection.execute('PRAGMA query_only = {}'.format(query_only))
+
+    return [COLUMN_TYPES.get(column[2]) for column in columns]
 
 
 class Results(BaseQueryRunner):
@@ -109,6 +443,10 @@ class Results(BaseQueryRunner):
         return {
             "type": "object",
             "properties": {
+                "max_age": {
+                    "type": "number",
+                    "title": "Reuse results of query_<id> tables retrieved in the last (seconds)"
+                }
             }
         }
 
@@ -120,48 +458,66 @@ class Results(BaseQueryRunner):
     def name(cls):
         return "Query Results (Beta)"
 
-    def run_query(self, query, user):
-        connection = sqlite3.connect(':memory:')
+    def _connect(self, query, user):
+        """
+        Returns a connection to a SQLite database with the tables referenced by the query. Databases made only of
+        stored results come from the cache when it's enabled.
+        """
+        stored_results, queries_to_execute = _resolve_tables(user, extract_query_ids(query),
+                                                             extract_cached_query_ids(query),
+                                                             self.configuration.get('max_age', 0))
+
+        if stored_results and not queries_to_execute and settings.QUERY_RESULTS_RUNNER_CACHE_MAX_SIZE > 0:
+            cache = DatabaseCache(settings.QUERY_RESULTS_RUNNER_CACHE_PATH,
+                                  settings.QUERY_RESULTS_RUNNER_CACHE_MAX_SIZE)
+            return cache.connect(DatabaseCache.key(stored_results),
+                                 lambda connection: _load_tables(connection, stored_results, []))
 
-        query_ids = extract_query_ids(query)
-        create_tables_from_query_ids(user, connection, query_ids)
+        connection = sqlite3.connect(':memory:')
+        try:
+            _load_tables(connection, stored_results, queries_to_execute)
+            return connection
+        except Exception:
+            connection.close()
+            raise
 
-        cursor = connection.cursor()
+    def run_query_iter(self, query, user):
+        connection = self._connect(query, user)
 
         try:
+            column_types = _output_column_types(connection, query)
+
+            cursor = connection.cursor()
             cursor.execute(query)
 
-            if cursor.description is not None:
-                columns = self.fetch_columns(
-                    [(i[0], None) for i in cursor.description])
+            if cursor.description is None:
+                raise QueryRunnerError('Query completed but it returned no data.')
 
-                rows = []
-                column_names = [c['name'] for c in columns]
+            if column_types is None or len(column_types) != len(cursor.description):
+                column_types = [None] * len(cursor.description)
 
-                for i, row in enumerate(cursor):
-                    for j, col in enumerate(row):
-                        guess = _guess_type(col)
+            columns = self.fetch_columns(
+                [(i[0], column_type) for i, column_type in zip(cursor.description, column_types)])
 
-                        if columns[j]['type'] is None:
-                            columns[j]['type'] = guess
-                        elif columns[j]['type'] != guess:
-                            columns[j]['type'] = TYPE_STRING
+            # Types of expression columns are guessed from the first batch of rows only.
+            rows = cursor.fetchmany(settings.QUERY_RESULTS_BATCH_SIZE)
+            for j, column in enumerate(columns):
+                if column['type'] is None:
+                    column['type'] = _guess_column_type(row[j] for row in rows[:TYPE_SAMPLE_SIZE])
 
-                    rows.append(dict(zip(column_names, row)))
+            yield columns
 
-                data = {'columns': columns, 'rows': rows}
-                error = None
-                json_data = json.dumps(data, cls=JSONEncoder)
-            else:
-                error = 'Query completed but it returned no data.'
-                json_data = None
+            while rows:
+                yield rows
+                rows = cursor.fetchmany(settings.QUERY_RESULTS_BATCH_SIZE)
         except KeyboardInterrupt:
-            connection.cancel()
-            error = "Query cancelled by user."
-            json_data = None
+            connection.interrupt()
+            raise QueryRunnerError("Query cancelled by user.")
         finally:
             connection.close()
-        return json_data, error
+
+    def run_query(self, query, user):
+        return self._run_query_from_iter(query, user)
 
 
 register(Results)
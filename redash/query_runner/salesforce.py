@@ -3,9 +3,8 @@
 import re
 import logging
 from collections import OrderedDict
-from redash.query_runner import BaseQueryRunner, register
+from redash.query_runner import BaseQueryRunner, ResultSet, register
 from redash.query_runner import TYPE_STRING, TYPE_DATE, TYPE_DATETIME, TYPE_INTEGER, TYPE_FLOAT, TYPE_BOOLEAN
-from redash.utils import json_dumps
 logger = logging.getLogger(__name__)
 
 try:
@@ -165,8 +164,7 @@ class Salesforce(BaseQueryRunner):
                 rows = self._build_rows(cols, records)
                 columns = self.fetch_columns(cols)
             error = None
-            data = {'columns': columns, 'rows': rows}
-            json_data = json_dumps(data)
+            json_data = ResultSet.from_dicts(columns, rows).to_json()
         except SalesforceError as err:
             error = err.content
             json_data = None
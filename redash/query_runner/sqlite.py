@@ -5,9 +5,8 @@ import sys
 
 from redash.query_runner import BaseSQLQueryRunner
 from redash.models import DataSourceTable, DataSourceColumn
-from redash.query_runner import register
+from redash.query_runner import ResultSet, register
 
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -89,11 +88,8 @@ class Sqlite(BaseSQLQueryRunner):
 
             if cursor.description is not None:
                 columns = self.fetch_columns([(i[0], None) for i in cursor.description])
-                rows = [dict(zip((c['name'] for c in columns), row)) for row in cursor]
-
-                data = {'columns': columns, 'rows': rows}
                 error = None
-                json_data = json.dumps(data, cls=JSONEncoder)
+                json_data = ResultSet(columns, cursor.fetchall()).to_json()
             else:
                 error = 'Query completed but it returned no data.'
                 json_data = None
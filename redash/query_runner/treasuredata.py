@@ -1,8 +1,6 @@
-import json
 import logging
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -114,9 +112,8 @@ class TreasureData(BaseQueryRunner):
             if cursor.rowcount == 0:
                 rows = []
             else:
-                rows = [dict(zip(([c[0] for c in columns_data]), r)) for i, r in enumerate(cursor.fetchall())]
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+                rows = cursor.fetchall()
+            json_data = ResultSet(columns, rows).to_json()
             error = None
         except errors.InternalError as e:
             json_data = None
@@ -2,7 +2,6 @@ import sys
 import json
 import logging
 
-from redash.utils import JSONEncoder
 from redash.query_runner import *
 
 logger = logging.getLogger(__name__)
@@ -125,13 +124,11 @@ class Vertica(BaseSQLQueryRunner):
             if cursor.description is not None:
                 columns_data = [(i[0], i[1]) for i in cursor.description]
 
-                rows = [dict(zip((c[0] for c in columns_data), row)) for row in cursor.fetchall()]
                 columns = [{'name': col[0],
                             'friendly_name': col[0],
                             'type': types_map.get(col[1], None)} for col in columns_data]
 
-                data = {'columns': columns, 'rows': rows}
-                json_data = json.dumps(data, cls=JSONEncoder)
+                json_data = ResultSet(columns, cursor.fetchall()).to_json()
                 error = None
             else:
                 json_data = None
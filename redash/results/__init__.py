@@ -0,0 +1,3 @@
+from .encoding import ColumnarResult, EncodingError, decode, encode, encode_json, is_encoded  # noqa: F401
+from .result_set import ResultSet  # noqa: F401
+from .writer import QueryResultWriter  # noqa: F401
@@ -0,0 +1,286 @@
+"""
+Compressed, column oriented encoding of query results.
+
+An encoded result is laid out as follows:
+
+    HEADER
+    row group 1: one zlib compressed JSON array per column
+    row group 2: ...
+    footer: zlib compressed JSON object with the columns, the row count, the byte offsets of every row group and the
+        metadata of the result (like the amount of data a query scanned), if any
+    footer length (4 bytes, big endian)
+    HEADER
+
+Storing the values column by column avoids repeating the column names in every row (as the row oriented JSON
+format does) and compresses considerably better. Keeping the index in a footer allows writing the result in a single
+pass, and reading back only the row groups and columns that are needed.
+"""
+import cStringIO
+import json
+import struct
+import zlib
+from itertools import islice, izip
+
+from redash.utils import JSONEncoder
+
+MAGIC = 'RDR'
+VERSION = 1
+HEADER = MAGIC + chr(VERSION)
+TRAILER_LENGTH = 4 + len(HEADER)
+DEFAULT_ROW_GROUP_SIZE = 5000
+COMPRESSION_LEVEL = 6
+
+
+class EncodingError(Exception):
+    pass
+
+
+def is_encoded(value):
+    return isinstance(value, str) and value.startswith(MAGIC)
+
+
+class ColumnarWriter(object):
+    """
+    Writes an encoded result into a file object. Rows are buffered until a row group is complete, so memory usage is
+    bounded by the row group size.
+    """
+
+    def __init__(self, fileobj, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        self._file = fileobj
+        self._row_group_size = row_group_size
+        self._encoder = JSONEncoder()
+        self._buffer = []
+        self._row_groups = []
+        self._offset = 0
+        self._finished = False
+        self.columns = None
+        self.metadata = None
+        self.row_count = 0
+
+        self._write(HEADER)
+
+    @property
+    def size(self):
+        return self._offset
+
+    def _write(self, chunk):
+        self._file.write(chunk)
+        self._offset += len(chunk)
+
+    def write_columns(self, columns):
+        self.columns = columns
+
+    def write_metadata(self, metadata):
+        self.metadata = metadata
+
+    def write_rows(self, rows):
+        """
+        Buffers rows, given as sequences of values in column order.
+        """
+        self._buffer.extend(rows)
+        self.row_count += len(rows)
+
+        while len(self._buffer) >= self._row_group_size:
+            self._flush(self._buffer[:self._row_group_size])
+            del self._buffer[:self._row_group_size]
+
+    def _flush(self, rows):
+        if not rows:
+            return
+
+        sizes = []
+        offset = self._offset
+        values = izip(*rows) if rows[0] else ()
+
+        for column_values in values:
+            block = zlib.compress(self._encoder.encode(column_values), COMPRESSION_LEVEL)
+            self._write(block)
+            sizes.append(len(block))
+
+        self._row_groups.append({'offset': offset, 'rows': len(rows), 'sizes': sizes})
+
+    def finish(self):
+        if self._finished:
+            return
+
+        self._flush(self._buffer)
+        self._buffer = []
+
+        footer = {
+            'version': VERSION,
+            'columns': self.columns or [],
+            'row_count': self.row_count,
+            'row_groups': self._row_groups
+        }
+        if self.metadata is not None:
+            footer['metadata'] = self.metadata
+
+        footer = zlib.compress(self._encoder.encode(footer), COMPRESSION_LEVEL)
+
+        self._write(footer)
+        self._write(struct.pack('>I', len(footer)))
+        self._write(HEADER)
+        self._finished = True
+
+
+class ColumnarResult(object):
+    """
+    Reads an encoded result, given as a string or any buffer supporting slicing (like mmap). Row groups are
+    decompressed lazily, one at a time.
+    """
+
+    def __init__(self, payload):
+        if payload[:len(MAGIC)] != MAGIC or len(payload) < len(HEADER) + TRAILER_LENGTH:
+            raise EncodingError("Not an encoded query result.")
+
+        version = ord(payload[len(MAGIC)])
+        if version != VERSION:
+            raise EncodingError("Unsupported query result encoding version: {}.".format(version))
+
+        footer_length, = struct.unpack('>I', payload[-TRAILER_LENGTH:-len(HEADER)])
+        footer_end = len(payload) - TRAILER_LENGTH
+        footer = json.loads(zlib.decompress(payload[footer_end - footer_length:footer_end]))
+
+        self._payload = payload
+        self.columns = footer['columns']
+        self.row_count = footer['row_count']
+        self.row_groups = footer['row_groups']
+        self.metadata = footer.get('metadata')
+
+    @property
+    def column_names(self):
+        return [c['name'] for c in self.columns]
+
+    def _read_column(self, row_group, index):
+        offset = row_group['offset'] + sum(row_group['sizes'][:index])
+        block = self._payload[offset:offset + row_group['sizes'][index]]
+        return json.loads(zlib.decompress(block))
+
+    def select(self, columns=None):
+        """
+        Returns the indexes and the definitions of the given columns (all of them if columns is None), ignoring names
+        that aren't part of the result.
+        """
+        if columns is None:
+            return range(len(self.columns)), self.columns
+
+        column_names = self.column_names
+        indexes = [column_names.index(name) for name in columns if name in column_names]
+        return indexes, [self.columns[i] for i in indexes]
+
+    def _iter_row_groups(self, offset=0, limit=None, indexes=None):
+        """
+        Yields iterators over the rows of every row group overlapping the requested range. Only the row groups and
+        the columns that are needed are decompressed.
+        """
+        if indexes is None:
+            indexes = range(len(self.columns))
+
+        end = None if limit is None else offset + limit
+        group_start = 0
+
+        for row_group in self.row_groups:
+            group_end = group_start + row_group['rows']
+
+            if end is not None and group_start >= end:
+                break
+
+            if group_end > offset:
+                values = [self._read_column(row_group, i) for i in indexes]
+                yield islice(izip(*values), max(offset - group_start, 0), None if end is None else end - group_start)
+
+            group_start = group_end
+
+    def iter_rows(self, offset=0, limit=None, columns=None):
+        """
+        Yields the rows as tuples of values in column order, optionally limited to a range of rows and to the given
+        columns.
+        """
+        indexes, _ = self.select(columns)
+        for rows in self._iter_row_groups(offset, limit, indexes):
+            for row in rows:
+                yield row
+
+    def to_dict(self):
+        column_names = self.column_names
+        rows = [dict(izip(column_names, row)) for row in self.iter_rows()]
+        data = {'columns': self.columns, 'rows': rows}
+        if self.metadata is not None:
+            data['metadata'] = self.metadata
+
+        return data
+
+    def iter_json(self, offset=0, limit=None, columns=None):
+        """
+        Yields the result serialized as JSON in the row oriented format, one row group at a time. The range of rows and
+        the columns can be limited like in iter_rows.
+        """
+        indexes, selected_columns = self.select(columns)
+        return iter_json(selected_columns, self._iter_row_groups(offset, limit, indexes), metadata=self.metadata)
+
+
+def iter_json(columns, batches, encoder=None, metadata=None):
+    """
+    Serializes a result given as its columns and batches of rows (sequences of values in column order) to JSON in the
+    row oriented format ({"columns": [...], "rows": [{...}, ...]}), yielding it in chunks. Rows are turned into dicts
+    one batch at a time.
+    """
+    encoder = encoder or JSONEncoder()
+    column_names = [c['name'] for c in columns]
+
+    yield '{"columns": ' + encoder.encode(columns) + ', "rows": ['
+    separator = ''
+    for rows in batches:
+        chunk = encoder.encode([dict(izip(column_names, row)) for row in rows])[1:-1]
+        if chunk:
+            yield separator + chunk
+            separator = ', '
+
+    if metadata is not None:
+        yield '], "metadata": ' + encoder.encode(metadata) + '}'
+    else:
+        yield ']}'
+
+
+def encode(data, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """
+    Encodes a query result given in the row oriented format ({'columns': [...], 'rows': [{...}, ...]}, with optional
+    'metadata').
+    """
+    buf = cStringIO.StringIO()
+    writer = ColumnarWriter(buf, row_group_size)
+    writer.write_columns(data['columns'])
+    writer.write_metadata(data.get('metadata'))
+
+    column_names = [c['name'] for c in data['columns']]
+    writer.write_rows([tuple(row.get(name) for name in column_names) for row in data['rows']])
+    writer.finish()
+
+    return buf.getvalue()
+
+
+def encode_json(json_data):
+    """
+    Encodes a query result serialized as JSON. Returns None when it doesn't look like a query result, in which case
+    it should be stored as is.
+    """
+    try:
+        data = json.loads(json_data)
+    except (TypeError, ValueError):
+        return None
+
+    if not isinstance(data, dict) or not isinstance(data.get('columns'), list) or \
+            not isinstance(data.get('rows'), list):
+        return None
+
+    if not all(isinstance(c, dict) and 'name' in c for c in data['columns']):
+        return None
+
+    if not all(isinstance(row, dict) for row in data['rows']):
+        return None
+
+    return encode(data)
+
+
+def decode(payload):
+    return ColumnarResult(payload).to_dict()
@@ -0,0 +1,189 @@
+"""
+Incremental garbage collection of unused query results.
+
+Results become unused when a newer result replaces them as the latest result of their queries, or when no query uses
+them in the first place (ad-hoc queries). QueryResult.store_result records those as candidates, which are deleted
+once they are older than the configured maximum age. A sweep over all the results retrieved before that, in retrieval
+time order (using its index), catches the results that became unused some other way and the ones stored before
+candidates were recorded. The sweep keeps its position once it reaches the end, so it only goes through the results
+that got old since, and starts over every settings.QUERY_RESULTS_CLEANUP_FULL_SWEEP_INTERVAL days. Another sweep over
+the external result storage deletes the payloads no result refers to, left behind by workers that died before
+committing the result they stored, and at the end of every pass the temporary files of workers that died while
+writing a payload.
+
+Results are deleted in batches, resized after every batch so it takes about settings.QUERY_RESULTS_CLEANUP_BATCH_TIME
+seconds.
+"""
+import datetime
+import json
+import logging
+import time
+from itertools import islice
+
+from dateutil.parser import parse as parse_date
+from sqlalchemy.exc import IntegrityError
+
+from redash import models, redis_connection, settings, statsd_client, utils
+from redash.results import storage as result_storage
+
+logger = logging.getLogger(__name__)
+
+SWEEP_POSITION_KEY = 'query_results:gc:sweep_position'
+SWEEP_STARTED_KEY = 'query_results:gc:sweep_started'
+ORPHANS_POSITION_KEY = 'query_results:gc:orphans_position'
+BATCH_SIZE_KEY = 'query_results:gc:batch_size'
+MIN_BATCH_SIZE = 10
+
+
+class QueryResultsCollector(object):
+    def __init__(self, max_age=None, time_limit=None):
+        """
+        :param max_age: minimum age (in days) of the results to delete.
+        :param time_limit: seconds after which run() stops (0 for no limit).
+        """
+        if max_age is None:
+            max_age = settings.QUERY_RESULTS_CLEANUP_MAX_AGE
+
+        if time_limit is None:
+            time_limit = settings.QUERY_RESULTS_CLEANUP_TIME_LIMIT
+
+        self.max_age = max_age
+        self.time_limit = time_limit
+        self.batch_size = int(redis_connection.get(BATCH_SIZE_KEY) or settings.QUERY_RESULTS_CLEANUP_COUNT)
+        self.deleted_count = 0
+        self.reclaimed_bytes = 0
+
+    @property
+    def older_than(self):
+        return utils.utcnow() - datetime.timedelta(days=self.max_age)
+
+    def run(self):
+        """
+        Deletes unused results until there are none left to delete or the time limit is reached. Returns the number
+        of results deleted.
+        """
+        start_time = time.time()
+
+        for collect in (self._collect_candidates, self._sweep, self._collect_orphans):
+            while not self._out_of_time(start_time) and collect():
+                pass
+
+        redis_connection.set(BATCH_SIZE_KEY, self.batch_size)
+        statsd_client.gauge('query_results_gc.backlog', self.backlog())
+        logger.info("Deleted %d unused query results (%d bytes) in %.2f seconds.", self.deleted_count,
+                    self.reclaimed_bytes, time.time() - start_time)
+
+        return self.deleted_count
+
+    def backlog(self):
+        """
+        Returns the number of candidates old enough to be deleted.
+        """
+        return redis_connection.zcount(models.QueryResult.UNUSED_CANDIDATES_KEY, '-inf',
+                                       time.time() - self.max_age * 24 * 3600)
+
+    def _out_of_time(self, start_time):
+        return self.time_limit and time.time() - start_time >= self.time_limit
+
+    def _collect_candidates(self):
+        """
+        Deletes a batch of candidates. Returns whether there might be more to delete.
+        """
+        result_ids = redis_connection.zrangebyscore(models.QueryResult.UNUSED_CANDIDATES_KEY, '-inf',
+                                                    time.time() - self.max_age * 24 * 3600, 0, self.batch_size)
+        if not result_ids:
+            return False
+
+        self._delete([int(result_id) for result_id in result_ids])
+        # Candidates that weren't deleted are still used by a query. They'll be recorded again when they're replaced.
+        redis_connection.zrem(models.QueryResult.UNUSED_CANDIDATES_KEY, *result_ids)
+
+        return len(result_ids) == self.batch_size
+
+    def _sweep(self):
+        """
+        Deletes the unused results of the next batch of old results. Returns whether the sweep has more to go through;
+        once it's done, the next one resumes from the last result it went through.
+        """
+        started_at = float(redis_connection.get(SWEEP_STARTED_KEY) or 0)
+        if time.time() - started_at >= settings.QUERY_RESULTS_CLEANUP_FULL_SWEEP_INTERVAL * 24 * 3600:
+            redis_connection.delete(SWEEP_POSITION_KEY)
+            redis_connection.set(SWEEP_STARTED_KEY, time.time())
+
+        position = redis_connection.get(SWEEP_POSITION_KEY)
+        if position is not None:
+            retrieved_at, result_id = json.loads(position)
+            position = (parse_date(retrieved_at), result_id)
+
+        batch_size = self.batch_size
+        results = models.QueryResult.old_results(self.older_than, after=position, limit=batch_size)
+        models.db.session.commit()
+
+        if not results:
+            return False
+
+        self._delete([result_id for result_id, _ in results])
+
+        last_id, last_retrieved_at = results[-1]
+        redis_connection.set(SWEEP_POSITION_KEY, json.dumps([last_retrieved_at.isoformat(), last_id]))
+
+        return len(results) == batch_size
+
+    def _collect_orphans(self):
+        """
+        Deletes the orphans among the next batch of old payloads of the external storage. Returns whether there are
+        more payloads to go through; once it's done, the next sweep starts over.
+        """
+        start_time = time.time()
+        position = redis_connection.get(ORPHANS_POSITION_KEY)
+
+        batch_size = self.batch_size
+        locations = list(islice(result_storage.iter_locations(start_time - self.max_age * 24 * 3600, after=position),
+                                batch_size))
+
+        if locations:
+            referenced = models.QueryResult.referenced_locations(locations)
+            models.db.session.commit()
+            orphans = [location for location in locations if location not in referenced]
+            result_storage.delete(orphans)
+            statsd_client.incr('query_results_gc.orphans_deleted', len(orphans))
+            self._resize_batch(time.time() - start_time)
+
+        if len(locations) < batch_size:
+            redis_connection.delete(ORPHANS_POSITION_KEY)
+            deleted = result_storage.delete_temporary_files(start_time - self.max_age * 24 * 3600)
+            statsd_client.incr('query_results_gc.temporary_files_deleted', deleted)
+            return False
+
+        redis_connection.set(ORPHANS_POSITION_KEY, locations[-1])
+        return True
+
+    def _delete(self, result_ids):
+        start_time = time.time()
+
+        try:
+            deleted = models.QueryResult.delete_unused(result_ids, self.older_than)
+            models.db.session.commit()
+        except IntegrityError:
+            # A query started using one of the results while they were being deleted.
+            logger.warning("Failed deleting a batch of %d query results.", len(result_ids), exc_info=1)
+            models.db.session.rollback()
+            deleted = []
+
+        result_storage.delete([location for _, location, _ in deleted if location is not None])
+
+        reclaimed_bytes = sum(size for _, _, size in deleted)
+        self.deleted_count += len(deleted)
+        self.reclaimed_bytes += reclaimed_bytes
+        statsd_client.incr('query_results_gc.deleted', len(deleted))
+        statsd_client.incr('query_results_gc.reclaimed_bytes', reclaimed_bytes)
+
+        self._resize_batch(time.time() - start_time)
+
+    def _resize_batch(self, batch_time):
+        # Grow or shrink towards the target time, by at most a factor of 2 at a time to smooth out outliers.
+        factor = 2.0 if batch_time <= 0 else min(2.0, max(0.5, settings.QUERY_RESULTS_CLEANUP_BATCH_TIME / batch_time))
+        self.batch_size = int(min(max(self.batch_size * factor, MIN_BATCH_SIZE),
+                                  settings.QUERY_RESULTS_CLEANUP_MAX_BATCH_SIZE))
+        statsd_client.gauge('query_results_gc.batch_size', self.batch_size)
+        statsd_client.timing('query_results_gc.batch_time', 1000 * batch_time)
@@ -0,0 +1,82 @@
+import json
+from itertools import islice
+
+from redash.results.encoding import iter_json
+from redash.utils import JSONEncoder
+
+SERIALIZE_BATCH_SIZE = 1000
+
+
+class ResultSet(object):
+    """
+    The result of a query as returned by query runners: a single list of columns, and the rows as tuples of values in
+    column order. A tuple takes a fraction of the memory of a dict keyed by column name, so results are kept in this
+    form until they're serialized.
+    """
+
+    def __init__(self, columns, rows=None, metadata=None):
+        self.columns = columns
+        self.rows = [] if rows is None else rows
+        # Additional information about the query (like the amount of data it scanned), serialized with the result.
+        self.metadata = metadata
+
+    @property
+    def column_names(self):
+        return [c['name'] for c in self.columns]
+
+    @classmethod
+    def from_dicts(cls, columns, rows, metadata=None):
+        """
+        Creates a result set from rows given as dicts keyed by column name (missing values are None).
+        """
+        column_names = [c['name'] for c in columns]
+        return cls(columns, [tuple(row.get(name) for name in column_names) for row in rows], metadata)
+
+    @classmethod
+    def from_json(cls, json_data):
+        """
+        Parses a result serialized in the row oriented JSON format (as returned by BaseQueryRunner.run_query).
+        """
+        data = json.loads(json_data)
+        rows = data.pop('rows')
+        column_names = [c['name'] for c in data['columns']]
+        # Converted in place, so every dict can be freed as soon as it was replaced by its tuple.
+        for i, row in enumerate(rows):
+            if isinstance(row, dict):
+                rows[i] = tuple(row.get(name) for name in column_names)
+
+        return cls(data['columns'], rows, data.get('metadata'))
+
+    def append(self, row):
+        self.rows.append(row)
+
+    def extend(self, rows):
+        self.rows.extend(rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def iter_batches(self, batch_size):
+        rows = iter(self.rows)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            yield batch
+
+    def to_dict(self):
+        column_names = self.column_names
+        data = {'columns': self.columns, 'rows': [dict(zip(column_names, row)) for row in self.rows]}
+        if self.metadata is not None:
+            data['metadata'] = self.metadata
+
+        return data
+
+    def to_json(self, cls=JSONEncoder):
+        """
+        Serializes the result to the row oriented JSON format ({"columns": [...], "rows": [{...}, ...]}) expected
+        from BaseQueryRunner.run_query.
+
+        :param cls: the JSON encoder class, for runners returning values of types it doesn't support by default.
+        """
+        return ''.join(iter_json(self.columns, self.iter_batches(SERIALIZE_BATCH_SIZE), cls(), self.metadata))
@@ -0,0 +1,311 @@
+"""
+Pluggable storage for large query results.
+
+Encoded results bigger than settings.QUERY_RESULTS_STORAGE_THRESHOLD are written to the configured storage backend
+instead of the query_results table, which then only holds their location ("<storage type>:<key>") and the checksum
+computed while writing them. A payload's checksum is verified the first time a process loads it: payloads never change
+once written, so the following loads skip hashing it.
+"""
+import calendar
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import uuid
+
+from redash import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import boto3
+    s3_enabled = True
+except ImportError:
+    s3_enabled = False
+
+
+# Locations whose payload was verified by this process. Cleared when it grows over MAX_VERIFIED_LOCATIONS.
+_verified_locations = set()
+MAX_VERIFIED_LOCATIONS = 10000
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class BaseResultStorage(object):
+    @classmethod
+    def type(cls):
+        raise NotImplementedError()
+
+    @classmethod
+    def enabled(cls):
+        return True
+
+    def put(self, key, fileobj):
+        raise NotImplementedError()
+
+    def get(self, key):
+        """
+        Returns the stored payload, either as a string or as a read only buffer supporting slicing (like mmap).
+        """
+        raise NotImplementedError()
+
+    def delete(self, keys):
+        raise NotImplementedError()
+
+    def iter_keys(self, older_than, after=None):
+        """
+        Yields, in order, the keys of the payloads written before older_than (a timestamp), starting after the given
+        key.
+        """
+        raise NotImplementedError()
+
+    def delete_temporary_files(self, older_than):
+        """
+        Deletes the temporary files of the payloads whose writing started before older_than (a timestamp) and never
+        completed. Returns the number of files deleted.
+        """
+        return 0
+
+
+class FileSystemResultStorage(BaseResultStorage):
+    def __init__(self):
+        self.path = settings.QUERY_RESULTS_STORAGE_PATH
+
+    @classmethod
+    def type(cls):
+        return 'fs'
+
+    def _path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def put(self, key, fileobj):
+        path = self._path(key)
+        directory = os.path.dirname(path)
+
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        # Write to a temporary file first, so readers never see a partially written result.
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as f:
+            shutil.copyfileobj(fileobj, f)
+
+        os.rename(f.name, path)
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def iter_keys(self, older_than, after=None):
+        if not os.path.isdir(self.path):
+            return
+
+        for directory in sorted(os.listdir(self.path)):
+            if (after is not None and directory < after[:2]) or not os.path.isdir(os.path.join(self.path, directory)):
+                continue
+
+            for key in sorted(os.listdir(os.path.join(self.path, directory))):
+                # Skips the temporary files of payloads being written.
+                if (after is not None and key <= after) or key[:2] != directory:
+                    continue
+
+                try:
+                    modified_at = os.path.getmtime(self._path(key))
+                except OSError:
+                    continue
+
+                if modified_at < older_than:
+                    yield key
+
+    def delete_temporary_files(self, older_than):
+        if not os.path.isdir(self.path):
+            return 0
+
+        deleted = 0
+        for directory in os.listdir(self.path):
+            if not os.path.isdir(os.path.join(self.path, directory)):
+                continue
+
+            for name in os.listdir(os.path.join(self.path, directory)):
+                # Payloads are named after their directory, the other files are temporary ones (see put).
+                if name[:2] == directory:
+                    continue
+
+                path = os.path.join(self.path, directory, name)
+                try:
+                    if os.path.getmtime(path) < older_than:
+                        os.remove(path)
+                        deleted += 1
+                except OSError:
+                    pass
+
+        return deleted
+
+
+class S3ResultStorage(BaseResultStorage):
+    """
+    Stores results in S3 or any S3 compatible service (set settings.QUERY_RESULTS_STORAGE_S3_ENDPOINT_URL). AWS
+    credentials are resolved the usual boto3 way (environment, configuration files or instance role).
+    """
+    DELETE_BATCH_SIZE = 1000
+
+    def __init__(self):
+        self.bucket = settings.QUERY_RESULTS_STORAGE_S3_BUCKET
+        self.prefix = settings.QUERY_RESULTS_STORAGE_S3_PREFIX
+        self.client = boto3.client('s3', endpoint_url=settings.QUERY_RESULTS_STORAGE_S3_ENDPOINT_URL or None)
+
+    @classmethod
+    def type(cls):
+        return 's3'
+
+    @classmethod
+    def enabled(cls):
+        return s3_enabled
+
+    def put(self, key, fileobj):
+        self.client.upload_fileobj(fileobj, self.bucket, self.prefix + key)
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+
+    def delete(self, keys):
+        for i in range(0, len(keys), self.DELETE_BATCH_SIZE):
+            objects = [{'Key': self.prefix + key} for key in keys[i:i + self.DELETE_BATCH_SIZE]]
+            self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects, 'Quiet': True})
+
+    def iter_keys(self, older_than, after=None):
+        params = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        if after is not None:
+            params['StartAfter'] = self.prefix + after
+
+        for page in self.client.get_paginator('list_objects_v2').paginate(**params):
+            for item in page.get('Contents', []):
+                if calendar.timegm(item['LastModified'].utctimetuple()) < older_than:
+                    yield item['Key'][len(self.prefix):]
+
+
+storages = {}
+_instances = {}
+
+
+def register(storage_class):
+    if storage_class.enabled():
+        storages[storage_class.type()] = storage_class
+    else:
+        logger.debug("%s result storage is not enabled (missing dependencies?), not registering.",
+                     storage_class.type())
+
+
+def get_storage(storage_type):
+    if storage_type not in _instances:
+        if storage_type not in storages:
+            raise ValueError("Unknown query results storage: {}".format(storage_type))
+        _instances[storage_type] = storages[storage_type]()
+
+    return _instances[storage_type]
+
+
+register(FileSystemResultStorage)
+register(S3ResultStorage)
+
+
+def should_store_externally(size):
+    return bool(settings.QUERY_RESULTS_STORAGE) and size > settings.QUERY_RESULTS_STORAGE_THRESHOLD
+
+
+class _ChecksumReader(object):
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self.checksum = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self._file.read(size)
+        self.checksum.update(chunk)
+        return chunk
+
+
+def store(fileobj):
+    """
+    Writes the payload read from fileobj to the configured storage. Returns its location and checksum.
+    """
+    storage = get_storage(settings.QUERY_RESULTS_STORAGE)
+    key = uuid.uuid4().hex
+    reader = _ChecksumReader(fileobj)
+    storage.put(key, reader)
+
+    return '{}:{}'.format(storage.type(), key), reader.checksum.hexdigest()
+
+
+def load(location, checksum=None):
+    """
+    Returns the payload stored at location. When its checksum is given, it's verified the first time this process
+    loads the payload: a truncated or corrupted payload raises ChecksumMismatch.
+    """
+    storage_type, key = location.split(':', 1)
+    payload = get_storage(storage_type).get(key)
+
+    if checksum is not None and location not in _verified_locations:
+        if hashlib.sha256(payload).hexdigest() != checksum:
+            logger.error("Checksum mismatch of the query result stored at %s.", location)
+            raise ChecksumMismatch("The stored query result is corrupted ({}).".format(location))
+
+        if len(_verified_locations) >= MAX_VERIFIED_LOCATIONS:
+            _verified_locations.clear()
+        _verified_locations.add(location)
+
+    return payload
+
+
+def delete(locations):
+    keys_by_type = {}
+    for location in locations:
+        storage_type, key = location.split(':', 1)
+        keys_by_type.setdefault(storage_type, []).append(key)
+
+    for storage_type, keys in keys_by_type.iteritems():
+        try:
+            get_storage(storage_type).delete(keys)
+        except Exception:
+            logger.exception("Failed deleting %d query results from %s storage.", len(keys), storage_type)
+
+
+def delete_temporary_files(older_than):
+    """
+    Deletes the temporary files left in the configured storage by workers that died while writing a payload before
+    older_than (a timestamp). Returns the number of files deleted.
+    """
+    if not settings.QUERY_RESULTS_STORAGE:
+        return 0
+
+    return get_storage(settings.QUERY_RESULTS_STORAGE).delete_temporary_files(older_than)
+
+
+def iter_locations(older_than, after=None):
+    """
+    Yields, in order, the locations of the payloads in the configured storage written before older_than (a timestamp),
+    starting after the given location.
+    """
+    if not settings.QUERY_RESULTS_STORAGE:
+        return
+
+    storage = get_storage(settings.QUERY_RESULTS_STORAGE)
+    prefix = storage.type() + ':'
+    after_key = after[len(prefix):] if after is not None and after.startswith(prefix) else None
+
+    for key in storage.iter_keys(older_than, after_key):
+        yield prefix + key
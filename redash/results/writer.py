@@ -0,0 +1,109 @@
+import tempfile
+
+from redash import settings
+from redash.results.encoding import ColumnarWriter
+
+
+class QueryResultWriter(object):
+    """
+    Encodes a query result incrementally into a spooled temporary file, so only the rows of the row group currently
+    being written have to be kept in memory as Python objects.
+    """
+
+    def __init__(self, spool_max_size=None, row_group_size=None):
+        if spool_max_size is None:
+            spool_max_size = settings.QUERY_RESULTS_SPOOL_MAX_SIZE
+
+        if row_group_size is None:
+            row_group_size = settings.QUERY_RESULTS_ROW_GROUP_SIZE
+
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+        self._writer = ColumnarWriter(self._file, row_group_size)
+        self._column_names = None
+        self._first_row = None
+        self.truncated = False
+
+    @property
+    def columns(self):
+        return self._writer.columns
+
+    @property
+    def metadata(self):
+        return self._writer.metadata
+
+    @property
+    def row_count(self):
+        return self._writer.row_count
+
+    @property
+    def size(self):
+        return self._writer.size
+
+    def write_columns(self, columns):
+        self._column_names = [c['name'] for c in columns]
+        self._writer.write_columns(columns)
+
+    def write_metadata(self, metadata):
+        self._writer.write_metadata(dict(self._writer.metadata or {}, **metadata))
+
+    def write_rows(self, rows):
+        column_names = self._column_names
+        rows = [tuple(row.get(name) for name in column_names) if isinstance(row, dict) else row for row in rows]
+        if self._first_row is None and rows:
+            self._first_row = rows[0]
+
+        self._writer.write_rows(rows)
+
+    def first_row(self, columns):
+        """
+        Returns the values of the given columns in the first row written, as a dict, or None if no rows were written.
+        """
+        if self._first_row is None:
+            return None
+
+        return {name: value for name, value in zip(self._column_names, self._first_row) if name in columns}
+
+    def finish(self):
+        self._writer.finish()
+
+    def consume(self, results, max_rows=0):
+        """
+        Writes the output of BaseQueryRunner.run_query_iter: the list of columns followed by batches of rows (and
+        metadata dicts).
+
+        Stops consuming once max_rows rows were written (unless it's 0), setting truncated (which is also recorded in
+        the metadata of the result, with the limit). The caller should then close results, so the runner stops
+        fetching.
+        """
+        columns = next(results, None)
+        if columns is not None:
+            self.write_columns(columns)
+
+            for rows in results:
+                if isinstance(rows, dict):
+                    self.write_metadata(rows)
+                    continue
+
+                if max_rows and self.row_count + len(rows) > max_rows:
+                    self.write_rows(rows[:max_rows - self.row_count])
+                    self.truncated = True
+                    self.write_metadata({'truncated': True, 'row_limit': max_rows})
+                    break
+
+                self.write_rows(rows)
+
+        self.finish()
+
+    def open(self):
+        """
+        Returns the file holding the encoded result, positioned at its beginning.
+        """
+        self.finish()
+        self._file.seek(0)
+        return self._file
+
+    def getvalue(self):
+        return self.open().read()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,148 @@
+"""
+Per table cache of data source schemas.
+
+The schema of every data source is kept in Redis as:
+
+    data_source:schema:<id>:tables     hash of table name -> zlib compressed JSON of the table (name, columns, ...)
+    data_source:schema:<id>:checksums  hash of table name -> checksum of the table's JSON
+    data_source:schema:<id>:names      sorted set of the table names (all with the same score, so sorted by name)
+    data_source:schema:<id>:version    incremented every time the schema changes
+    data_source:schema:<id>:marker     the schema change marker of the data source when the schema was last loaded
+
+Refreshing compares the checksums and only writes the tables that changed, and reading can be limited to a page of
+table names or to the tables being looked at, so large schemas never have to be loaded at once.
+"""
+import hashlib
+import json
+import zlib
+
+from redash import redis_connection
+
+COMPRESSION_LEVEL = 6
+
+
+class SchemaCache(object):
+    def __init__(self, data_source_id, connection=None):
+        self.data_source_id = data_source_id
+        self.connection = connection or redis_connection
+        # Size (in bytes, as JSON) of the schema stored by the last call to update.
+        self.size = 0
+
+    def _key(self, name):
+        return 'data_source:schema:{}:{}'.format(self.data_source_id, name)
+
+    @property
+    def tables_key(self):
+        return self._key('tables')
+
+    @property
+    def checksums_key(self):
+        return self._key('checksums')
+
+    @property
+    def names_key(self):
+        return self._key('names')
+
+    @property
+    def version_key(self):
+        return self._key('version')
+
+    @property
+    def marker_key(self):
+        return self._key('marker')
+
+    @property
+    def refresh_lock_key(self):
+        return self._key('refreshing')
+
+    @property
+    def legacy_key(self):
+        # The whole schema as a single JSON string, as it was cached before.
+        return 'data_source:schema:{}'.format(self.data_source_id)
+
+    @property
+    def version(self):
+        """
+        The version of the cached schema, or None if it isn't cached.
+        """
+        version = self.connection.get(self.version_key)
+        return None if version is None else int(version)
+
+    @property
+    def marker(self):
+        return self.connection.get(self.marker_key)
+
+    def update(self, schema, marker=None, marker_max_age=None):
+        """
+        Stores the schema (a list of tables), writing only the tables that changed since the last update. Returns
+        whether the schema changed.
+
+        :param marker: the schema change marker of the data source, kept for up to marker_max_age seconds.
+        """
+        checksums = self.connection.hgetall(self.checksums_key)
+        tables = {}
+        new_checksums = {}
+        self.size = 0
+        for table in schema:
+            # Redis returns the names as UTF-8 encoded strings.
+            name = table['name'].encode('utf-8') if isinstance(table['name'], unicode) else table['name']
+            serialized = json.dumps(table, sort_keys=True)
+            self.size += len(serialized)
+            checksum = hashlib.sha1(serialized).hexdigest()
+            new_checksums[name] = checksum
+            if checksums.get(name) != checksum:
+                tables[name] = zlib.compress(serialized, COMPRESSION_LEVEL)
+
+        removed = [name for name in checksums if name not in new_checksums]
+        changed = bool(tables or removed)
+
+        pipe = self.connection.pipeline()
+        if tables:
+            pipe.hmset(self.tables_key, tables)
+            pipe.hmset(self.checksums_key, {name: new_checksums[name] for name in tables})
+            pipe.zadd(self.names_key, *[arg for name in tables for arg in (0, name)])
+        if removed:
+            pipe.hdel(self.tables_key, *removed)
+            pipe.hdel(self.checksums_key, *removed)
+            pipe.zrem(self.names_key, *removed)
+        if changed:
+            pipe.incr(self.version_key)
+        else:
+            pipe.setnx(self.version_key, 0)
+        if marker is not None:
+            pipe.set(self.marker_key, marker, ex=marker_max_age)
+        else:
+            pipe.delete(self.marker_key)
+        pipe.delete(self.legacy_key)
+        pipe.execute()
+
+        return changed
+
+    def get_tables(self, names=None):
+        """
+        Returns the given tables (all of them if names is None), sorted by name. Unknown names are ignored.
+        """
+        if names is None:
+            names = self.connection.zrange(self.names_key, 0, -1)
+
+        if not names:
+            return []
+
+        tables = self.connection.hmget(self.tables_key, sorted(names))
+        return [json.loads(zlib.decompress(table)) for table in tables if table is not None]
+
+    def search(self, term=None, offset=0, limit=None):
+        """
+        Returns the number of tables whose name contains term (case insensitive), and a page of their names.
+        """
+        names = [name.decode('utf-8') for name in self.connection.zrange(self.names_key, 0, -1)]
+        if term:
+            term = term.lower()
+            names = [name for name in names if term in name.lower()]
+
+        end = None if limit is None else offset + limit
+        return len(names), names[offset:end]
+
+    def delete(self):
+        self.connection.delete(self.tables_key, self.checksums_key, self.names_key, self.version_key,
+                               self.marker_key, self.legacy_key)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from funcy import distinct, remove
 
 from .helpers import parse_db_url, fix_assets_path, array_from_string, parse_boolean, int_or_none, set_from_string
@@ -34,11 +35,76 @@ SQLALCHEMY_ECHO = False
 CELERY_BROKER = os.environ.get("REDASH_CELERY_BROKER", REDIS_URL)
 CELERY_BACKEND = os.environ.get("REDASH_CELERY_BACKEND", CELERY_BROKER)
 CELERY_TASK_RESULT_EXPIRES = int(os.environ.get('REDASH_CELERY_TASK_RESULT_EXPIRES', 3600 * 4))
+# Messages reserved ahead by each worker process. Queries of higher priority classes are only picked first among the
+# messages that aren't reserved yet (see QUERY_PRIORITY_DELAYS).
+CELERYD_PREFETCH_MULTIPLIER = int(os.environ.get('REDASH_CELERYD_PREFETCH_MULTIPLIER', 1))
 
 # The following enables periodic job (every 5 minutes) of removing unused query results.
 QUERY_RESULTS_CLEANUP_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_ENABLED", "true"))
 QUERY_RESULTS_CLEANUP_COUNT = int(os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_COUNT", "100"))
 QUERY_RESULTS_CLEANUP_MAX_AGE = int(os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_MAX_AGE", "7"))
+# Unused results are deleted in batches (starting with QUERY_RESULTS_CLEANUP_COUNT results), resized so every batch
+# takes about QUERY_RESULTS_CLEANUP_BATCH_TIME seconds. Every run of the job stops deleting after
+# QUERY_RESULTS_CLEANUP_TIME_LIMIT seconds.
+QUERY_RESULTS_CLEANUP_BATCH_TIME = float(os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_BATCH_TIME", "0.5"))
+QUERY_RESULTS_CLEANUP_MAX_BATCH_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_MAX_BATCH_SIZE", "5000"))
+QUERY_RESULTS_CLEANUP_TIME_LIMIT = int(os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_TIME_LIMIT", "60"))
+# The sweep over all old results only goes through the ones that got old since its last pass, and starts over from
+# the oldest result every QUERY_RESULTS_CLEANUP_FULL_SWEEP_INTERVAL days.
+QUERY_RESULTS_CLEANUP_FULL_SWEEP_INTERVAL = float(
+    os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_FULL_SWEEP_INTERVAL", "7"))
+
+# Query runners hand rows over to the worker in batches of this size, and results are buffered in memory up to
+# QUERY_RESULTS_SPOOL_MAX_SIZE bytes before being spilled to a temporary file while they are being stored.
+QUERY_RESULTS_BATCH_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_BATCH_SIZE", "1000"))
+QUERY_RESULTS_SPOOL_MAX_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_SPOOL_MAX_SIZE", 10 * 1024 * 1024))
+# Queries stop fetching rows once their result has this many (0 means unlimited), unless their data source sets its own
+# limit. The rows fetched until then are stored.
+QUERY_RESULTS_ROW_LIMIT = int(os.environ.get("REDASH_QUERY_RESULTS_ROW_LIMIT", "0"))
+# Results are stored compressed and column oriented, in row groups of this many rows.
+QUERY_RESULTS_ROW_GROUP_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_ROW_GROUP_SIZE", "5000"))
+
+# Results larger than QUERY_RESULTS_STORAGE_THRESHOLD bytes (encoded) can be offloaded from the database to an external
+# storage: "fs" (a local or shared directory) or "s3" (S3 or any S3 compatible service). Leave empty to keep all
+# results in the database.
+QUERY_RESULTS_STORAGE = os.environ.get("REDASH_QUERY_RESULTS_STORAGE", "")
+QUERY_RESULTS_STORAGE_THRESHOLD = int(os.environ.get("REDASH_QUERY_RESULTS_STORAGE_THRESHOLD", 1024 * 1024))
+QUERY_RESULTS_STORAGE_PATH = os.environ.get("REDASH_QUERY_RESULTS_STORAGE_PATH", "/var/lib/redash/query_results")
+QUERY_RESULTS_STORAGE_S3_BUCKET = os.environ.get("REDASH_QUERY_RESULTS_STORAGE_S3_BUCKET", "")
+QUERY_RESULTS_STORAGE_S3_PREFIX = os.environ.get("REDASH_QUERY_RESULTS_STORAGE_S3_PREFIX", "query_results/")
+QUERY_RESULTS_STORAGE_S3_ENDPOINT_URL = os.environ.get("REDASH_QUERY_RESULTS_STORAGE_S3_ENDPOINT_URL", None)
+
+# The Query Results data source keeps the SQLite databases it builds from stored results in a worker local cache, so
+# running another query over the same results doesn't load them again. The least recently used databases are removed
+# when the cache grows over QUERY_RESULTS_RUNNER_CACHE_MAX_SIZE bytes (0 disables the cache).
+QUERY_RESULTS_RUNNER_CACHE_PATH = os.environ.get("REDASH_QUERY_RESULTS_RUNNER_CACHE_PATH",
+                                                 os.path.join(tempfile.gettempdir(), "redash_query_results_cache"))
+QUERY_RESULTS_RUNNER_CACHE_MAX_SIZE = int(os.environ.get("REDASH_QUERY_RESULTS_RUNNER_CACHE_MAX_SIZE",
+                                                         512 * 1024 * 1024))
+
+# Default maximum number of queries running at the same time against a single data source (0 means unlimited). Data
+# sources can override it. Queries over the limit wait for a slot (in the order described below): their task is
+# requeued to check again after QUERY_CONCURRENCY_POLL_INTERVAL seconds. Running queries renew the lease of their slot
+# every third of QUERY_CONCURRENCY_LEASE_TIME seconds; a slot that wasn't renewed for that long is considered abandoned
+# (the worker died) and is given to the next query.
+QUERY_CONCURRENCY_LIMIT = int(os.environ.get("REDASH_QUERY_CONCURRENCY_LIMIT", "0"))
+QUERY_CONCURRENCY_POLL_INTERVAL = float(os.environ.get("REDASH_QUERY_CONCURRENCY_POLL_INTERVAL", "5"))
+QUERY_CONCURRENCY_LEASE_TIME = int(os.environ.get("REDASH_QUERY_CONCURRENCY_LEASE_TIME", "120"))
+# Queries are picked from their Celery queue by priority class: "interactive", then "dashboard", "scheduled" and
+# "backfill", whether or not their data source limits its concurrency.
+# Queries waiting for a slot are ordered by priority and fair share. Each priority class ("interactive", "dashboard",
+# "scheduled" or "backfill") goes behind the queries that arrived less than its delay (in seconds) before it, so queries
+# of lower classes still run once they waited long enough. Every query also charges its user and organization
+# QUERY_FAIR_SHARE_COST seconds (divided by their weight, see the organization settings), which the next queries of the
+# same user or organization wait behind.
+QUERY_PRIORITY_DELAYS = dict((name, float(delay)) for name, delay in (
+    item.split(':') for item in array_from_string(os.environ.get(
+        "REDASH_QUERY_PRIORITY_DELAYS", "interactive:0,dashboard:30,scheduled:300,backfill:1800"))))
+QUERY_FAIR_SHARE_COST = float(os.environ.get("REDASH_QUERY_FAIR_SHARE_COST", "60"))
+# Celery queues of priority classes (like "interactive:queries,dashboard:dashboard_queries"), so their queries are
+# run by separate workers instead of the data source's queue. The same queue can be given to several classes.
+QUERY_PRIORITY_QUEUES = dict(item.split(':') for item in array_from_string(
+    os.environ.get("REDASH_QUERY_PRIORITY_QUEUES", "")))
 
 SCHEMAS_REFRESH_SCHEDULE = int(os.environ.get("REDASH_SCHEMAS_REFRESH_SCHEDULE", 30))
 
@@ -216,8 +282,29 @@ FEATURE_AUTO_PUBLISH_NAMED_QUERIES = parse_boolean(os.environ.get("REDASH_FEATUR
 # BigQuery
 BIGQUERY_HTTP_TIMEOUT = int(os.environ.get("REDASH_BIGQUERY_HTTP_TIMEOUT", "600"))
 
+# Elasticsearch: index mappings are cached by every worker process for this many seconds (0 disables caching), and
+# searches for more hits than QUERY_RESULTS_BATCH_SIZE are scrolled through, keeping the scroll context alive for
+# ELASTICSEARCH_SCROLL_TIMEOUT between pages.
+ELASTICSEARCH_MAPPINGS_CACHE_TTL = int(os.environ.get("REDASH_ELASTICSEARCH_MAPPINGS_CACHE_TTL", "300"))
+ELASTICSEARCH_SCROLL_TIMEOUT = os.environ.get("REDASH_ELASTICSEARCH_SCROLL_TIMEOUT", "1m")
+
+# Query runners keep up to QUERY_RUNNER_POOL_SIZE connections per data source in every worker process (0 disables
+# pooling), closing them after QUERY_RUNNER_POOL_IDLE_TIMEOUT seconds of inactivity. Connections idle for longer than
+# QUERY_RUNNER_POOL_CHECK_INTERVAL seconds are checked before being reused.
+QUERY_RUNNER_POOL_SIZE = int(os.environ.get("REDASH_QUERY_RUNNER_POOL_SIZE", "2"))
+QUERY_RUNNER_POOL_IDLE_TIMEOUT = int(os.environ.get("REDASH_QUERY_RUNNER_POOL_IDLE_TIMEOUT", "300"))
+QUERY_RUNNER_POOL_WAIT_TIMEOUT = int(os.environ.get("REDASH_QUERY_RUNNER_POOL_WAIT_TIMEOUT", "60"))
+QUERY_RUNNER_POOL_CHECK_INTERVAL = int(os.environ.get("REDASH_QUERY_RUNNER_POOL_CHECK_INTERVAL", "30"))
+
 # Enhance schema fetching
 SCHEMA_RUN_TABLE_SIZE_CALCULATIONS = parse_boolean(os.environ.get("REDASH_SCHEMA_RUN_TABLE_SIZE_CALCULATIONS", "false"))
+# Table sizes are read from the catalog estimates when the data source keeps them, unless exact sizes are required,
+# in which case up to SCHEMA_TABLE_SIZE_CONCURRENCY tables are counted at a time.
+SCHEMA_EXACT_TABLE_SIZES = parse_boolean(os.environ.get("REDASH_SCHEMA_EXACT_TABLE_SIZES", "false"))
+SCHEMA_TABLE_SIZE_CONCURRENCY = int(os.environ.get("REDASH_SCHEMA_TABLE_SIZE_CONCURRENCY", "4"))
+# Scheduled refreshes skip data sources whose schema change marker didn't change, but not for longer than this many
+# seconds (so the table sizes are still updated once in a while).
+SCHEMA_CHANGE_MARKER_MAX_AGE = int(os.environ.get("REDASH_SCHEMA_CHANGE_MARKER_MAX_AGE", str(24 * 60 * 60)))
 
 # Allow Parameters in Embeds
 # WARNING: With this option enabled, Redash reads query parameters from the request URL (risk of SQL injection!)
@@ -17,11 +17,16 @@ SAML_LOGIN_ENABLED = SAML_METADATA_URL != ""
 
 DATE_FORMAT = os.environ.get("REDASH_DATE_FORMAT", "DD/MM/YY")
 
+# Fair share weights of the organization and of its users (by user id) when queries wait for a data source slot.
+QUERY_FAIR_SHARE_WEIGHT = float(os.environ.get("REDASH_QUERY_FAIR_SHARE_WEIGHT", "1"))
+
 settings = {
     "auth_password_login_enabled": PASSWORD_LOGIN_ENABLED,
     "auth_saml_enabled": SAML_LOGIN_ENABLED,
     "auth_saml_entity_id": SAML_ENTITY_ID,
     "auth_saml_metadata_url": SAML_METADATA_URL,
     "auth_saml_nameid_format": SAML_NAMEID_FORMAT,
-    "date_format": DATE_FORMAT
+    "date_format": DATE_FORMAT,
+    "query_fair_share_weight": QUERY_FAIR_SHARE_WEIGHT,
+    "query_fair_share_user_weights": {}
 }
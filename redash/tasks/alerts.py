@@ -38,9 +38,11 @@ def check_alerts_for_query(query_id):
     logger.debug("Checking query %d for alerts", query_id)
 
     query = models.Query.query.get(query_id)
+    # All the alerts are evaluated against the values extracted when the result was stored, without loading it:
+    alert_values = models.QueryResult.get_alert_values(query.latest_query_data_id)
 
     for alert in query.alerts:
-        new_state = alert.evaluate()
+        new_state = alert.evaluate(alert_values)
 
         if should_notify(alert, new_state):
             logger.info("Alert %d new state: %s", alert.id, new_state)
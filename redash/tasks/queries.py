@@ -1,16 +1,24 @@
 import json
 import logging
+import redis
 import signal
+import threading
 import time
+import uuid
 
 import pystache
-import redis
 
+from celery import states
+from celery.backends.redis import RedisBackend
 from celery.exceptions import SoftTimeLimitExceeded, TimeLimitExceeded
 from celery.result import AsyncResult
 from celery.utils.log import get_task_logger
 from redash import models, redis_connection, settings, statsd_client, utils
-from redash.query_runner import InterruptException
+from redash.metrics.celery import metric_name
+from redash.query_runner import InterruptException, QueryRunnerError
+from redash.results import QueryResultWriter
+from redash.results.gc import QueryResultsCollector
+from redash.schema_cache import SchemaCache
 from redash.utils import gen_query_hash
 from redash.worker import celery
 from redash.tasks.alerts import check_alerts_for_query
@@ -35,14 +43,19 @@ class QueryTaskTracker(object):
     IN_PROGRESS_LIST = 'query_task_trackers:in_progress'
     ALL_LISTS = (DONE_LIST, WAITING_LIST, IN_PROGRESS_LIST)
 
-    def __init__(self, data):
+    def __init__(self, data, stored=False):
         self.data = data
+        # Whether the tracker is stored as a hash, so updates can write only the fields that changed.
+        self._stored = stored
 
     @classmethod
-    def create(cls, task_id, state, query_hash, data_source_id, scheduled, metadata):
+    def create(cls, task_id, state, query_hash, data_source_id, scheduled, metadata, priority=None,
+               fair_share=None):
         data = dict(task_id=task_id, state=state,
                     query_hash=query_hash, data_source_id=data_source_id,
                     scheduled=scheduled,
+                    priority=priority or ('scheduled' if scheduled else 'interactive'),
+                    fair_share=fair_share or {},
                     username=metadata.get('Username', 'unknown'),
                     query_id=metadata.get('Query ID', 'unknown'),
                     retries=0,
@@ -53,23 +66,61 @@ class QueryTaskTracker(object):
 
         return cls(data)
 
-    def save(self, connection=None):
-        if connection is None:
-            connection = redis_connection
+    # Trackers are stored as Redis hashes with one JSON encoded value per field, so a state transition only writes the
+    # fields that changed. Trackers saved before that are JSON strings; they're still read, and rewritten as hashes on
+    # their next update.
+    @staticmethod
+    def _encode(data):
+        return {k: utils.json_dumps(v) for k, v in data.iteritems()}
+
+    @staticmethod
+    def _decode(fields):
+        return {k: json.loads(v) for k, v in fields.iteritems()}
 
+    def save(self, connection=None):
+        """
+        Writes the whole tracker, in a single pipeline (unless a pipeline is given as the connection).
+        """
         self.data['updated_at'] = time.time()
         key_name = self._key_name(self.data['task_id'])
-        connection.set(key_name, utils.json_dumps(self.data))
-        connection.zadd(self._get_list(), time.time(), key_name)
+
+        pipe = connection if connection is not None else redis_connection.pipeline()
+        pipe.delete(key_name)
+        pipe.hmset(key_name, self._encode(self.data))
+        self._save_list(pipe, key_name)
+
+        if connection is None:
+            pipe.execute()
+
+        self._stored = True
+
+    def _save_list(self, pipe, key_name):
+        pipe.zadd(self._get_list(), self.data['updated_at'], key_name)
 
         for l in self.ALL_LISTS:
             if l != self._get_list():
-                connection.zrem(l, key_name)
+                pipe.zrem(l, key_name)
 
     # TOOD: this is not thread/concurrency safe. In current code this is not an issue, but better to fix this.
     def update(self, **kwargs):
+        if not self._stored:
+            self.data.update(kwargs)
+            self.save()
+            return
+
+        previous_list = self._get_list()
         self.data.update(kwargs)
-        self.save()
+        self.data['updated_at'] = time.time()
+        key_name = self._key_name(self.data['task_id'])
+
+        fields = dict(kwargs, updated_at=self.data['updated_at'])
+        pipe = redis_connection.pipeline()
+        pipe.hmset(key_name, self._encode(fields))
+        if self._get_list() != previous_list:
+            self._save_list(pipe, key_name)
+        else:
+            pipe.zadd(previous_list, self.data['updated_at'], key_name)
+        pipe.execute()
 
     @staticmethod
     def _key_name(task_id):
@@ -86,12 +137,35 @@ class QueryTaskTracker(object):
 
     @classmethod
     def get_by_task_id(cls, task_id, connection=None):
+        return cls.get_by_key_names([cls._key_name(task_id)], connection)[0]
+
+    @classmethod
+    def get_by_key_names(cls, key_names, connection=None):
+        """
+        Loads the trackers stored in the given keys with a single pipeline (plus one for legacy trackers, if any).
+        Missing trackers are returned as None.
+        """
         if connection is None:
             connection = redis_connection
 
-        key_name = cls._key_name(task_id)
-        data = connection.get(key_name)
-        return cls.create_from_data(data)
+        pipe = connection.pipeline(transaction=False)
+        for key_name in key_names:
+            pipe.hgetall(key_name)
+        results = pipe.execute(raise_on_error=False)
+
+        trackers = [cls(cls._decode(fields), stored=True) if isinstance(fields, dict) and fields else None
+                    for fields in results]
+
+        legacy = [i for i, result in enumerate(results) if isinstance(result, redis.ResponseError)]
+        if legacy:
+            pipe = connection.pipeline(transaction=False)
+            for i in legacy:
+                pipe.get(key_names[i])
+
+            for i, data in zip(legacy, pipe.execute()):
+                trackers[i] = cls.create_from_data(data)
+
+        return trackers
 
     @classmethod
     def create_from_data(cls, data):
@@ -110,12 +184,7 @@ class QueryTaskTracker(object):
             offset -= 1
 
         ids = redis_connection.zrevrange(list_name, offset, limit)
-        pipe = redis_connection.pipeline()
-        for id in ids:
-            pipe.get(id)
-
-        tasks = [cls.create_from_data(data) for data in pipe.execute()]
-        return tasks
+        return [tracker for tracker in cls.get_by_key_names(ids) if tracker is not None]
 
     @classmethod
     def prune(cls, list_name, keep_count, max_keys=100):
@@ -140,6 +209,8 @@ class QueryTask(object):
     # TODO: this is mapping to the old Job class statuses. Need to update the client side and remove this
     STATUSES = {
         'PENDING': 1,
+        # Jobs waiting for a data source slot are retried until they get one.
+        'RETRY': 1,
         'STARTED': 2,
         'SUCCESS': 3,
         'FAILURE': 4,
@@ -169,7 +240,7 @@ class QueryTask(object):
         if isinstance(result, (TimeLimitExceeded, SoftTimeLimitExceeded)):
             error = "Query exceeded Redash query execution time limit."
             status = 4
-        elif isinstance(result, Exception):
+        elif isinstance(result, Exception) and task_status != 'RETRY':
             error = result.message
             status = 4
         elif task_status == 'REVOKED':
@@ -205,63 +276,266 @@ class QueryTask(object):
         return self._async_result.revoke(terminate=True, signal='SIGINT')
 
 
-def enqueue_query(query, data_source, user_id, scheduled_query=None, metadata={}):
-    query_hash = gen_query_hash(query)
-    logging.info("Inserting job for %s with metadata=%s", query_hash, metadata)
-    try_count = 0
-    job = None
+# Atomically returns the job holding the lock of a query (KEYS[1]), or takes the lock for a new job and saves its
+# tracker (KEYS[2], given as field/value pairs after the third argument) in the waiting list (KEYS[3]). A lock whose
+# job's tracker (named KEYS[4] followed by the job id) is missing or done is stale (the worker running it died without
+# releasing it) and is taken over.
+_enqueue_job_script = redis_connection.register_script("""
+local job_id = redis.call('GET', KEYS[1])
+if job_id then
+    local tracker_key = KEYS[4] .. job_id
+    local tracker_type = redis.call('TYPE', tracker_key)['ok']
+    local state = nil
+    if tracker_type == 'hash' then
+        local encoded_state = redis.call('HGET', tracker_key, 'state')
+        if encoded_state then
+            state = cjson.decode(encoded_state)
+        end
+    elseif tracker_type == 'string' then
+        state = cjson.decode(redis.call('GET', tracker_key))['state']
+    end
+    if state and state ~= 'finished' and state ~= 'failed' and state ~= 'cancelled' then
+        return {0, job_id}
+    end
+end
+
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('DEL', KEYS[2])
+redis.call('HMSET', KEYS[2], unpack(ARGV, 4))
+redis.call('ZADD', KEYS[3], ARGV[3], KEYS[2])
+return {1, ARGV[1]}
+""")
+
+
+QUERY_PRIORITIES = ('interactive', 'dashboard', 'scheduled', 'backfill')
+
+# Celery message priority of each class. The Redis broker keeps a list per priority step (0, 3, 6 and 9) and consumes
+# the lowest step first, so higher classes are picked first from a shared queue even when no concurrency limit is set.
+MESSAGE_PRIORITIES = dict((name, 3 * i) for i, name in enumerate(QUERY_PRIORITIES))
+
+
+# Takes one of the KEYS[1] slots (a sorted set of job ids, scored by lease expiry) for a job, unless jobs ahead of it
+# are waiting for one. Waiting jobs are kept in KEYS[2], scored by the time they're due: their arrival time, pushed
+# back by the delay of their priority class and by the queries their fair share owners (user, organization) ran
+# before. KEYS[4] keeps, for every owner, the time until which its previous queries are charged. KEYS[3] keeps the last
+# time each waiting job checked, so jobs that stopped waiting (the worker died) don't block the ones after them.
+# ARGV: job id, current time, limit, lease time, time after which a waiting job is considered gone, priority delay,
+# followed by owner/cost pairs.
+# Returns whether the slot was taken and the number of jobs waiting.
+_acquire_slot_script = redis_connection.register_script("""
+local now = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+
+local gone = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now - tonumber(ARGV[5]))
+for _, job_id in ipairs(gone) do
+    redis.call('ZREM', KEYS[2], job_id)
+    redis.call('ZREM', KEYS[3], job_id)
+end
+
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    if not redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+        local due = now
+        for i = 7, #ARGV, 2 do
+            local charged_until = math.max(now, tonumber(redis.call('HGET', KEYS[4], ARGV[i]) or now))
+            due = math.max(due, charged_until)
+            redis.call('HSET', KEYS[4], ARGV[i], charged_until + tonumber(ARGV[i + 1]))
+        end
+        redis.call('EXPIRE', KEYS[4], ARGV[4])
+        redis.call('ZADD', KEYS[2], due + tonumber(ARGV[6]), ARGV[1])
+    end
+
+    local position = redis.call('ZRANK', KEYS[2], ARGV[1])
+    if redis.call('ZCARD', KEYS[1]) + position >= tonumber(ARGV[3]) then
+        redis.call('ZADD', KEYS[3], now, ARGV[1])
+        return {0, redis.call('ZCARD', KEYS[2])}
+    end
+
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('ZREM', KEYS[3], ARGV[1])
+end
+
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[4]), ARGV[1])
+return {1, redis.call('ZCARD', KEYS[2])}
+""")
+
+
+# Extends the lease of a job's slot in KEYS[1] until ARGV[2], unless the slot was released (or given away) already.
+_renew_slot_script = redis_connection.register_script("""
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+    return 1
+end
+return 0
+""")
+
+
+def fair_share_costs(org, user_id):
+    """
+    Returns the cost charged to the organization and the user for every query they run, based on their weights.
+    """
+    user_weights = org.get_setting('query_fair_share_user_weights') or {}
+    weights = {
+        'org:{}'.format(org.id): org.get_setting('query_fair_share_weight'),
+        'user:{}'.format(user_id): user_weights.get(str(user_id), 1),
+    }
 
-    while try_count < 5:
-        try_count += 1
+    return {owner: settings.QUERY_FAIR_SHARE_COST / weight for owner, weight in weights.iteritems() if weight > 0}
 
+
+class DataSourceSemaphore(object):
+    """
+    Distributed semaphore limiting the number of queries running at the same time against a data source (see
+    DataSource.max_concurrent_queries). Free slots go to the waiting jobs by priority and fair share (see
+    settings.QUERY_PRIORITY_DELAYS and settings.QUERY_FAIR_SHARE_COST).
+
+    Slots are leased for settings.QUERY_CONCURRENCY_LEASE_TIME seconds, and the lease is renewed in the background while
+    the job holds it, so the slot of a worker that died is given to the next job shortly after.
+    """
+
+    def __init__(self, data_source_id, limit, job_id, priority='interactive', fair_share=None):
+        self.data_source_id = data_source_id
+        self.limit = limit
+        self.job_id = job_id
+        self.priority = priority
+        self.fair_share = fair_share or {}
+        self._released = threading.Event()
+
+    def _keys(self):
+        prefix = 'ds:{}:concurrency'.format(self.data_source_id)
+        return [prefix + ':running', prefix + ':waiting', prefix + ':waiting_checked_at', prefix + ':charged_until']
+
+    def try_acquire(self, now=None):
+        """
+        Returns whether the job got a slot, and the number of jobs waiting for one.
+        """
+        if not self.limit:
+            return True, 0
+
+        if now is None:
+            now = time.time()
+
+        stale_waiting_time = max(30, 10 * settings.QUERY_CONCURRENCY_POLL_INTERVAL)
+        args = [self.job_id, now, self.limit, settings.QUERY_CONCURRENCY_LEASE_TIME, stale_waiting_time,
+                settings.QUERY_PRIORITY_DELAYS.get(self.priority, 0)]
+        for owner, cost in self.fair_share.iteritems():
+            args.extend((owner, cost))
+
+        acquired, waiting = _acquire_slot_script(keys=self._keys(), args=args)
+
+        return bool(acquired), waiting
+
+    def acquire(self):
+        """
+        Tries to take a slot for the job without waiting, like try_acquire, and starts renewing its lease once it's
+        taken. Returns whether the slot was taken.
+        """
+        acquired, waiting = self.try_acquire()
+        if not self.limit:
+            return acquired
+
+        self._record_waiting(waiting)
+        if acquired:
+            renewer = threading.Thread(target=self._renew_until_released, name='semaphore-lease-{}'.format(self.job_id))
+            renewer.daemon = True
+            renewer.start()
+
+        return acquired
+
+    def renew(self, now=None):
+        """
+        Extends the lease of the job's slot. Returns whether the job still held it.
+        """
+        if now is None:
+            now = time.time()
+
+        lease_expiry = now + settings.QUERY_CONCURRENCY_LEASE_TIME
+        return bool(_renew_slot_script(keys=self._keys()[:1], args=[self.job_id, lease_expiry]))
+
+    def _renew_until_released(self):
+        interval = settings.QUERY_CONCURRENCY_LEASE_TIME / 3.0
+        while not self._released.wait(interval):
+            try:
+                if not self.renew():
+                    break
+            except Exception:
+                logger.warning("Failed renewing the concurrency slot of job %s.", self.job_id, exc_info=1)
+
+    def record_wait_time(self, wait_time):
+        statsd_client.timing(self._metric_name('query_concurrency.wait_time', priority=self.priority),
+                             1000 * wait_time)
+
+    def release(self):
+        if not self.limit:
+            return
+
+        self._released.set()
         pipe = redis_connection.pipeline()
-        try:
-            pipe.watch(_job_lock_id(query_hash, data_source.id))
-            job_id = pipe.get(_job_lock_id(query_hash, data_source.id))
-            if job_id:
-                logging.info("[%s] Found existing job: %s", query_hash, job_id)
+        for key in self._keys()[:3]:
+            pipe.zrem(key, self.job_id)
+        pipe.execute()
 
-                job = QueryTask(job_id=job_id)
+    def _metric_name(self, name, **tags):
+        return metric_name(name, dict(tags, data_source_id=self.data_source_id))
 
-                if job.ready():
-                    logging.info("[%s] job found is ready (%s), removing lock", query_hash, job.celery_status)
-                    redis_connection.delete(_job_lock_id(query_hash, data_source.id))
-                    job = None
+    def _record_waiting(self, waiting):
+        statsd_client.gauge(self._metric_name('query_concurrency.queue_depth'), waiting)
 
-            if not job:
-                pipe.multi()
 
-                time_limit = None
+def enqueue_query(query, data_source, user_id, scheduled_query=None, metadata={}, priority=None):
+    query_hash = gen_query_hash(query)
+    logging.info("Inserting job for %s with metadata=%s", query_hash, metadata)
 
-                if scheduled_query:
-                    queue_name = data_source.scheduled_queue_name
-                    scheduled_query_id = scheduled_query.id
-                else:
-                    queue_name = data_source.queue_name
-                    scheduled_query_id = None
-                    time_limit = settings.ADHOC_QUERY_TIME_LIMIT
+    if priority is None:
+        priority = 'scheduled' if scheduled_query is not None else 'interactive'
 
-                result = execute_query.apply_async(args=(query, data_source.id, metadata, user_id, scheduled_query_id),
-                                                   queue=queue_name,
-                                                   time_limit=time_limit)
-                job = QueryTask(async_result=result)
-                tracker = QueryTaskTracker.create(
-                    result.id, 'created', query_hash, data_source.id,
-                    scheduled_query is not None, metadata)
-                tracker.save(connection=pipe)
+    job_id = str(uuid.uuid4())
+    tracker = QueryTaskTracker.create(job_id, 'created', query_hash, data_source.id,
+                                      scheduled_query is not None, metadata, priority=priority,
+                                      fair_share=fair_share_costs(data_source.org, user_id))
+    tracker.data['updated_at'] = time.time()
+    tracker_key = QueryTaskTracker._key_name(job_id)
 
-                logging.info("[%s] Created new job: %s", query_hash, job.id)
-                pipe.set(_job_lock_id(query_hash, data_source.id), job.id, settings.JOB_EXPIRY_TIME)
-                pipe.execute()
-            break
+    tracker_fields = [item for field in QueryTaskTracker._encode(tracker.data).iteritems() for item in field]
 
-        except redis.WatchError:
-            continue
+    created, job_id = _enqueue_job_script(
+        keys=[_job_lock_id(query_hash, data_source.id), tracker_key, QueryTaskTracker.WAITING_LIST,
+              QueryTaskTracker._key_name('')],
+        args=[job_id, settings.JOB_EXPIRY_TIME, tracker.data['updated_at']] + tracker_fields)
 
-    if not job:
-        logging.error("[Manager][%s] Failed adding job for query.", query_hash)
+    if not created:
+        logging.info("[%s] Found existing job: %s", query_hash, job_id)
+        statsd_client.incr('enqueue_query.existing_job')
+        return QueryTask(job_id=job_id)
 
-    return job
+    time_limit = None
+
+    if scheduled_query:
+        queue_name = data_source.scheduled_queue_name
+        scheduled_query_id = scheduled_query.id
+    else:
+        queue_name = data_source.queue_name
+        scheduled_query_id = None
+        time_limit = settings.ADHOC_QUERY_TIME_LIMIT
+
+    # Priority classes with a queue of their own are run by separate workers, whether or not the data source limits
+    # its concurrency:
+    queue_name = settings.QUERY_PRIORITY_QUEUES.get(priority, queue_name)
+
+    try:
+        execute_query.apply_async(args=(query, data_source.id, metadata, user_id, scheduled_query_id),
+                                  queue=queue_name,
+                                  priority=MESSAGE_PRIORITIES[priority],
+                                  time_limit=time_limit,
+                                  task_id=job_id)
+    except Exception:
+        logging.exception("[Manager][%s] Failed adding job for query.", query_hash)
+        _unlock(query_hash, data_source.id)
+        tracker.update(state='failed', error='Failed adding job for query.')
+        raise
+
+    logging.info("[%s] Created new job: %s", query_hash, job_id)
+    statsd_client.incr('enqueue_query.new_job')
+    return QueryTask(job_id=job_id)
 
 
 @celery.task(name="redash.tasks.refresh_queries")
@@ -312,24 +586,42 @@ def refresh_queries():
     statsd_client.gauge('manager.seconds_since_refresh', now - float(status.get('last_refresh_at', now)))
 
 
+def _tasks_ready(task_ids):
+    """
+    Returns a dict telling for each of the given tasks whether it's done. With the Redis result backend the task
+    states are fetched with a single pipeline, instead of one round trip per task.
+    """
+    backend = celery.backend
+    if not isinstance(backend, RedisBackend):
+        return {task_id: AsyncResult(task_id, app=celery).ready() for task_id in task_ids}
+
+    pipe = backend.client.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipe.get(backend.get_key_for_task(task_id))
+
+    ready = {}
+    for task_id, meta in zip(task_ids, pipe.execute()):
+        state = backend.decode_result(meta)['status'] if meta else states.PENDING
+        ready[task_id] = state in states.READY_STATES
+
+    return ready
+
+
 @celery.task(name="redash.tasks.cleanup_tasks")
 def cleanup_tasks():
-    in_progress = QueryTaskTracker.all(QueryTaskTracker.IN_PROGRESS_LIST)
-    for tracker in in_progress:
-        result = AsyncResult(tracker.task_id)
+    trackers = QueryTaskTracker.all(QueryTaskTracker.IN_PROGRESS_LIST) + \
+        QueryTaskTracker.all(QueryTaskTracker.WAITING_LIST)
+    ready = _tasks_ready([tracker.task_id for tracker in trackers])
 
-        if result.ready():
-            logging.info("in progress tracker %s finished", tracker.query_hash)
-            _unlock(tracker.query_hash, tracker.data_source_id)
-            tracker.update(state='finished')
-
-    waiting = QueryTaskTracker.all(QueryTaskTracker.WAITING_LIST)
-    for tracker in waiting:
-        result = AsyncResult(tracker.task_id)
+    finished = [tracker for tracker in trackers if ready[tracker.task_id]]
+    if finished:
+        pipe = redis_connection.pipeline()
+        for tracker in finished:
+            logging.info("%s tracker %s finished", tracker.state, tracker.query_hash)
+            pipe.delete(_job_lock_id(tracker.query_hash, tracker.data_source_id))
+        pipe.execute()
 
-        if result.ready():
-            logging.info("waiting tracker %s finished", tracker.query_hash)
-            _unlock(tracker.query_hash, tracker.data_source_id)
+        for tracker in finished:
             tracker.update(state='finished')
 
     # Maintain constant size of the finished tasks list:
@@ -344,19 +636,14 @@ def cleanup_query_results():
     Job to cleanup unused query results -- such that no query links to them anymore, and older than
     settings.QUERY_RESULTS_MAX_AGE (a week by default, so it's less likely to be open in someone's browser and be used).
 
-    Each time the job deletes only settings.QUERY_RESULTS_CLEANUP_COUNT (100 by default) query results so it won't choke
-    the database in case of many such results.
+    The results are deleted in batches sized so they won't choke the database (see redash.results.gc), for up to
+    settings.QUERY_RESULTS_CLEANUP_TIME_LIMIT seconds. Whatever is left is deleted by the next run.
     """
 
-    logging.info("Running query results clean up (removing maximum of %d unused results, that are %d days old or more)",
-                 settings.QUERY_RESULTS_CLEANUP_COUNT, settings.QUERY_RESULTS_CLEANUP_MAX_AGE)
+    logging.info("Running query results clean up (removing unused results that are %d days old or more)",
+                 settings.QUERY_RESULTS_CLEANUP_MAX_AGE)
 
-    unused_query_results = models.QueryResult.unused(settings.QUERY_RESULTS_CLEANUP_MAX_AGE).limit(settings.QUERY_RESULTS_CLEANUP_COUNT)
-    deleted_count = models.QueryResult.query.filter(
-        models.QueryResult.id.in_(unused_query_results.subquery())
-    ).delete(synchronize_session=False)
-    models.db.session.commit()
-    logger.info("Deleted %d unused query results.", deleted_count)
+    QueryResultsCollector().run()
 
 
 @celery.task(name="redash.tasks.refresh_schema", time_limit=90, soft_time_limit=60)
@@ -365,9 +652,17 @@ def refresh_schema(data_source_id):
     logger.info(u"task=refresh_schema state=start ds_id=%s", ds.id)
     start_time = time.time()
     try:
-        ds.get_schema(refresh=True)
-        logger.info(u"task=refresh_schema state=finished ds_id=%s runtime=%.2f", ds.id, time.time() - start_time)
-        statsd_client.incr('refresh_schema.success')
+        cache = ds.refresh_schema()
+        runtime = time.time() - start_time
+        if cache is None:
+            logger.info(u"task=refresh_schema state=unchanged ds_id=%s runtime=%.2f", ds.id, runtime)
+            statsd_client.incr('refresh_schema.unchanged')
+        else:
+            logger.info(u"task=refresh_schema state=finished ds_id=%s runtime=%.2f bytes=%d", ds.id, runtime,
+                        cache.size)
+            statsd_client.incr('refresh_schema.success')
+            statsd_client.gauge(metric_name('refresh_schema.bytes', {'data_source_id': ds.id}), cache.size)
+        statsd_client.timing(metric_name('refresh_schema.time', {'data_source_id': ds.id}), 1000 * runtime)
     except SoftTimeLimitExceeded:
         logger.info(u"task=refresh_schema state=timeout ds_id=%s runtime=%.2f", ds.id, time.time() - start_time)
         statsd_client.incr('refresh_schema.timeout')
@@ -375,12 +670,17 @@ def refresh_schema(data_source_id):
         logger.warning(u"Failed refreshing schema for the data source: %s", ds.name, exc_info=1)
         statsd_client.incr('refresh_schema.error')
         logger.info(u"task=refresh_schema state=failed ds_id=%s runtime=%.2f", ds.id, time.time() - start_time)
+    finally:
+        redis_connection.delete(SchemaCache(ds.id).refresh_lock_key)
 
 
 @celery.task(name="redash.tasks.refresh_schemas")
 def refresh_schemas():
     """
     Refreshes the data sources schemas.
+
+    Every data source is refreshed by its own refresh_schema task, so they're refreshed in parallel by the workers of
+    the schemas queue. A data source isn't refreshed again while its previous refresh is still pending or running.
     """
     blacklist = [int(ds_id) for ds_id in redis_connection.smembers('data_sources:schema:blacklist') if ds_id]
     global_start_time = time.time()
@@ -394,6 +694,9 @@ def refresh_schemas():
             logger.info(u"task=refresh_schema state=skip ds_id=%s reason=blacklist", ds.id)
         elif ds.org.is_disabled:
             logger.info(u"task=refresh_schema state=skip ds_id=%s reason=org_disabled", ds.id)
+        elif not redis_connection.set(SchemaCache(ds.id).refresh_lock_key, 1, nx=True,
+                                      ex=settings.SCHEMAS_REFRESH_SCHEDULE * 60):
+            logger.info(u"task=refresh_schema state=skip ds_id=%s reason=in_progress", ds.id)
         else:
             refresh_schema.apply_async(args=(ds.id,), queue="schemas")
 
@@ -434,28 +737,61 @@ class QueryExecutor(object):
                                                                                                    False, metadata)
         if self.tracker.scheduled:
             models.scheduled_queries_executions.update(self.tracker.query_id)
+        # Trackers created before priorities were added don't have them:
+        self.semaphore = DataSourceSemaphore(self.data_source_id, self.data_source.max_concurrent_queries,
+                                             task.request.id, priority=self.tracker.data.get('priority', 'interactive'),
+                                             fair_share=self.tracker.data.get('fair_share'))
 
     def run(self):
         signal.signal(signal.SIGINT, signal_handler)
-        self.tracker.update(started_at=time.time(), state='started')
+        self._take_slot()
+
+        try:
+            self.tracker.update(started_at=time.time(), state='started')
+
+            logger.debug("Executing query:\n%s", self.query)
 
-        logger.debug("Executing query:\n%s", self.query)
-        self._log_progress('executing_query')
+            query_runner = self.data_source.query_runner
+            annotated_query = self._annotate_query(query_runner)
 
-        query_runner = self.data_source.query_runner
-        annotated_query = self._annotate_query(query_runner)
+            writer = QueryResultWriter()
+            try:
+                result = self._execute(query_runner, annotated_query, writer)
+            finally:
+                writer.close()
+        finally:
+            self.semaphore.release()
+
+        return result
+
+    def _execute(self, query_runner, annotated_query, writer):
+        results = None
+        error = None
 
         try:
-            data, error = query_runner.run_query(annotated_query, self.user)
+            self._log_progress('executing_query')
+            results = query_runner.run_query_iter(annotated_query, self.user)
+            writer.consume(results, self.data_source.max_result_rows)
+        except QueryRunnerError as e:
+            error = e.message
+        except InterruptException:
+            error = "Query cancelled by user."
         except Exception as e:
             error = unicode(e)
-            data = None
             logging.warning('Unexpected error while running query:', exc_info=1)
+        finally:
+            # Make sure the runner releases its connection, even if we stopped consuming its results early.
+            if hasattr(results, 'close'):
+                results.close()
+            self.semaphore.release()
 
         run_time = time.time() - self.tracker.started_at
         self.tracker.update(error=error, run_time=run_time, state='saving_results')
 
-        logger.info(u"task=execute_query query_hash=%s data_length=%s error=[%s]", self.query_hash, data and len(data), error)
+        logger.info(u"task=execute_query query_hash=%s data_length=%s error=[%s]", self.query_hash, writer.size, error)
+        if writer.truncated:
+            logger.warning(u"task=execute_query query_hash=%s truncated_at=%d rows", self.query_hash, writer.row_count)
+            statsd_client.incr('query_results.truncated')
 
         _unlock(self.query_hash, self.data_source.id)
 
@@ -473,7 +809,7 @@ class QueryExecutor(object):
                 models.db.session.add(self.scheduled_query)
             query_result, updated_query_ids = models.QueryResult.store_result(
                 self.data_source.org_id, self.data_source,
-                self.query_hash, self.query, data,
+                self.query_hash, self.query, writer,
                 run_time, utils.utcnow())
             self._log_progress('checking_alerts')
             for query_id in updated_query_ids:
@@ -484,6 +820,24 @@ class QueryExecutor(object):
         models.db.session.commit()
         return result
 
+    def _take_slot(self):
+        """
+        Takes a slot of the data source's concurrency limit, or requeues the task to try again after
+        settings.QUERY_CONCURRENCY_POLL_INTERVAL seconds. Waiting this way doesn't hold a worker, nor count towards
+        the task's time limit.
+        """
+        if not self.semaphore.limit:
+            return
+
+        if not self.semaphore.acquire():
+            if self.tracker.state != 'waiting_for_slot':
+                self.tracker.update(waiting_since=time.time())
+                self._log_progress('waiting_for_slot')
+            raise self.task.retry(countdown=settings.QUERY_CONCURRENCY_POLL_INTERVAL, max_retries=None)
+
+        waiting_since = self.tracker.data.get('waiting_since')
+        self.semaphore.record_wait_time(time.time() - waiting_since if waiting_since else 0)
+
     def _annotate_query(self, query_runner):
         if query_runner.annotate_query():
             self.metadata['Task ID'] = self.task.request.id
@@ -48,6 +48,7 @@ celery.conf.update(CELERY_RESULT_BACKEND=settings.CELERY_BACKEND,
                    CELERYBEAT_SCHEDULE=celery_schedule,
                    CELERY_TIMEZONE='UTC',
                    CELERY_TASK_RESULT_EXPIRES=settings.CELERY_TASK_RESULT_EXPIRES,
+                   CELERYD_PREFETCH_MULTIPLIER=settings.CELERYD_PREFETCH_MULTIPLIER,
                    CELERYD_LOG_FORMAT=settings.CELERYD_LOG_FORMAT,
                    CELERYD_TASK_LOG_FORMAT=settings.CELERYD_TASK_LOG_FORMAT)
 
@@ -1,3 +1,4 @@
+import mock
 from funcy import pairwise
 from tests import BaseTestCase
 
@@ -14,6 +15,36 @@ class TestDataSourceGetSchema(BaseTestCase):
         response = self.make_request("get", "/api/data_sources/{}/schema".format(self.factory.data_source.id), user=other_admin)
         self.assertEqual(response.status_code, 404)
 
+    def get_schema(self, query_string=''):
+        schema = [{'name': 'public.users', 'columns': ['id']}, {'name': 'public.events', 'columns': ['id']},
+                  {'name': 'public.user_events', 'columns': ['user_id', 'event_id']}]
+        with mock.patch('redash.query_runner.pg.PostgreSQL.get_schema', return_value=schema):
+            return self.make_request("get", "/api/data_sources/{}/schema{}".format(self.factory.data_source.id,
+                                                                                  query_string))
+
+    def test_returns_whole_schema(self):
+        response = self.get_schema()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t['name'] for t in response.json['schema']],
+                         ['public.events', 'public.user_events', 'public.users'])
+        self.assertEqual(response.json['schema'][0]['columns'], ['id'])
+        self.assertEqual(response.json['version'], 1)
+
+    def test_pages_and_searches_table_names(self):
+        response = self.get_schema('?q=user&page=2&page_size=1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['count'], 2)
+        self.assertEqual(response.json['schema'], [{'name': 'public.users'}])
+
+        self.assertEqual(self.get_schema('?page=5&page_size=1').status_code, 400)
+
+    def test_returns_requested_tables(self):
+        response = self.get_schema('?table=public.users&table=public.events')
+
+        self.assertEqual([t['name'] for t in response.json['schema']], ['public.events', 'public.users'])
+
 
 class TestDataSourceListGet(BaseTestCase):
     def test_returns_each_data_source_once(self):
@@ -69,6 +100,33 @@ class TestDataSourceResourcePost(BaseTestCase):
         self.assertEqual(data_source.name, new_name)
         self.assertEqual(data_source.options.to_dict(), new_options)
 
+    def test_updates_concurrency_limit(self):
+        admin = self.factory.create_admin()
+        data = {'name': 'DS 1', 'type': 'pg', 'options': {"dbname": "newdb"}, 'concurrency_limit': 5}
+        rv = self.make_request('post', self.path, data=data, user=admin)
+
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.json['concurrency_limit'], 5)
+        self.assertEqual(DataSource.query.get(self.factory.data_source.id).max_concurrent_queries, 5)
+
+        data['concurrency_limit'] = -1
+        rv = self.make_request('post', self.path, data=data, user=admin)
+        self.assertEqual(rv.status_code, 400)
+
+
+    def test_updates_row_limit(self):
+        admin = self.factory.create_admin()
+        data = {'name': 'DS 1', 'type': 'pg', 'options': {"dbname": "newdb"}, 'row_limit': 1000}
+        rv = self.make_request('post', self.path, data=data, user=admin)
+
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.json['row_limit'], 1000)
+        self.assertEqual(DataSource.query.get(self.factory.data_source.id).max_result_rows, 1000)
+
+        data['row_limit'] = 'many'
+        rv = self.make_request('post', self.path, data=data, user=admin)
+        self.assertEqual(rv.status_code, 400)
+
 
 class TestDataSourceResourceDelete(BaseTestCase):
     def test_deletes_the_data_source(self):
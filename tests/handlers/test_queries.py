@@ -1,3 +1,5 @@
+import mock
+
 from tests import BaseTestCase
 from redash import models
 from redash.models import db
@@ -137,6 +139,17 @@ class QueryRefreshTest(BaseTestCase):
         response = self.make_request('post', self.path)
         self.assertEqual(200, response.status_code)
 
+    def test_refresh_with_priority(self):
+        with mock.patch('redash.handlers.query_results.enqueue_query') as enqueue_query:
+            enqueue_query.return_value.to_dict.return_value = {}
+            response = self.make_request('post', '{}?priority=dashboard'.format(self.path))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('dashboard', enqueue_query.call_args[1]['priority'])
+
+        response = self.make_request('post', '{}?priority=urgent'.format(self.path))
+        self.assertEqual(400, response.status_code)
+
     def test_refresh_of_query_with_parameters(self):
         self.query.query_text = u"SELECT {{param}}"
         db.session.add(self.query)
@@ -1,5 +1,9 @@
 import json
-from tests import BaseTestCase
+
+import mock
+
+from tests import BaseTestCase, authenticate_request
+from redash.handlers.query_results import QueryResultBatchResource
 from redash.models import db
 
 
@@ -25,6 +29,125 @@ class TestQueryResultsCacheHeaders(BaseTestCase):
         self.assertEqual(404, rv.status_code)
 
 
+class TestQueryResultsETag(BaseTestCase):
+    def test_returns_not_modified_for_matching_etag(self):
+        query_result = self.factory.create_query_result()
+        path = '/{}/api/query_results/{}.json'.format(self.factory.org.slug, query_result.id)
+        authenticate_request(self.client, self.factory.user)
+
+        rv = self.client.get(path)
+        self.assertEquals(rv.status_code, 200)
+        self.assertIn('ETag', rv.headers)
+
+        rv = self.client.get(path, headers={'If-None-Match': rv.headers['ETag']})
+        self.assertEquals(rv.status_code, 304)
+        self.assertEquals(rv.data, '')
+
+    def test_returns_stored_data(self):
+        data = {'rows': [{'test': 1}], 'columns': [{'name': 'test'}]}
+        query_result = self.factory.create_query_result(data=json.dumps(data))
+
+        rv = self.make_request('get', '/api/query_results/{}'.format(query_result.id))
+        self.assertEquals(rv.status_code, 200)
+        self.assertEquals(rv.json['query_result']['id'], query_result.id)
+        self.assertEquals(rv.json['query_result']['data'], data)
+
+
+class TestQueryResultsPagination(BaseTestCase):
+    def setUp(self):
+        super(TestQueryResultsPagination, self).setUp()
+        self.data = {'rows': [{'a': i, 'b': i * 2} for i in range(10)], 'columns': [{'name': 'a'}, {'name': 'b'}]}
+
+    def test_returns_range_of_rows_and_columns(self):
+        query_result = self.factory.create_query_result(data=json.dumps(self.data))
+
+        rv = self.make_request('get', '/api/query_results/{}?offset=2&limit=3&columns=b'.format(query_result.id))
+        self.assertEquals(rv.status_code, 200)
+        self.assertEquals(rv.json['query_result']['row_count'], 10)
+        self.assertEquals(rv.json['query_result']['data'], {'columns': [{'name': 'b'}],
+                                                            'rows': [{'b': 4}, {'b': 6}, {'b': 8}]})
+
+    def test_returns_range_of_rows_from_json_data(self):
+        query_result = self.factory.create_query_result(data=json.dumps(self.data))
+        query_result._data, query_result.encoded_data = json.dumps(self.data), None
+        db.session.commit()
+
+        rv = self.make_request('get', '/api/query_results/{}?offset=8&columns=a'.format(query_result.id))
+        self.assertEquals(rv.status_code, 200)
+        self.assertEquals(rv.json['query_result']['row_count'], 10)
+        self.assertEquals(rv.json['query_result']['data'], {'columns': [{'name': 'a'}],
+                                                            'rows': [{'a': 8}, {'a': 9}]})
+
+    def test_rejects_invalid_offset(self):
+        query_result = self.factory.create_query_result(data=json.dumps(self.data))
+
+        rv = self.make_request('get', '/api/query_results/{}?offset=-1'.format(query_result.id))
+        self.assertEquals(rv.status_code, 400)
+
+
+class TestQueryResultBatchAPI(BaseTestCase):
+    def test_returns_results_of_dashboard_queries(self):
+        dashboard = self.factory.create_dashboard()
+        query_result = self.factory.create_query_result()
+        query = self.factory.create_query(latest_query_data=query_result)
+        visualization = self.factory.create_visualization(query_rel=query)
+        self.factory.create_widget(dashboard=dashboard, visualization=visualization)
+        self.factory.create_widget(dashboard=dashboard)
+
+        rv = self.make_request('get', '/api/query_results/batch?dashboard={}'.format(dashboard.slug))
+        self.assertEquals(rv.status_code, 200)
+        self.assertEquals(len(rv.json['query_results']), 1)
+        self.assertEquals(rv.json['query_results'][0]['query_id'], query.id)
+        self.assertEquals(rv.json['query_results'][0]['query_result']['id'], query_result.id)
+
+    def test_returns_results_of_queries(self):
+        query_result = self.factory.create_query_result()
+        query = self.factory.create_query(latest_query_data=query_result)
+        query_without_result = self.factory.create_query()
+
+        rv = self.make_request('get',
+                               '/api/query_results/batch?queries={},{}'.format(query.id, query_without_result.id))
+        self.assertEquals(rv.status_code, 200)
+        self.assertEquals(rv.json['query_results'][0]['query_result']['id'], query_result.id)
+        self.assertEquals(rv.json['query_results'][1], {'query_id': query_without_result.id,
+                                                        'error': 'No cached result found for this query.'})
+
+    def test_reports_results_without_access(self):
+        ds = self.factory.create_data_source(group=self.factory.create_group())
+        query_result1 = self.factory.create_query_result()
+        query_result2 = self.factory.create_query_result(data_source=ds)
+
+        rv = self.make_request('get', '/api/query_results/batch?query_results={},{}'.format(query_result1.id,
+                                                                                           query_result2.id))
+        self.assertEquals(rv.status_code, 200)
+        self.assertEquals(rv.json['query_results'][0]['query_result']['id'], query_result1.id)
+        self.assertEquals(rv.json['query_results'][1], {'error': 'You do not have access to this query result.'})
+
+    def test_requires_a_target(self):
+        rv = self.make_request('get', '/api/query_results/batch')
+        self.assertEquals(rv.status_code, 400)
+
+        rv = self.make_request('get', '/api/query_results/batch?queries=a')
+        self.assertEquals(rv.status_code, 400)
+
+    def test_rejects_query_api_keys(self):
+        query_result = self.factory.create_query_result()
+        query = self.factory.create_query(latest_query_data=query_result)
+
+        rv = self.make_request('get', '/api/query_results/batch?queries={}&api_key={}'.format(query.id, query.api_key),
+                               user=False)
+        self.assertNotEquals(rv.status_code, 200)
+
+    def test_loads_results_while_streaming(self):
+        query_result = mock.Mock()
+        query_result.iter_json.return_value = iter(['{"id": 1}'])
+
+        chunks = QueryResultBatchResource.iter_item_json({'query_id': 2}, query_result)
+        query_result.iter_json.assert_not_called()
+
+        self.assertEquals(json.loads(''.join(chunks)), {'query_id': 2, 'query_result': {'id': 1}})
+
+
 class TestQueryResultListAPI(BaseTestCase):
     def test_get_existing_result(self):
         query_result = self.factory.create_query_result()
@@ -49,6 +172,17 @@ class TestQueryResultListAPI(BaseTestCase):
         self.assertNotIn('query_result', rv.json)
         self.assertIn('job', rv.json)
 
+    def test_execute_query_with_unknown_priority(self):
+        query = self.factory.create_query()
+
+        rv = self.make_request('post', '/api/query_results',
+                               data={'data_source_id': self.factory.data_source.id,
+                                     'query': query.query_text,
+                                     'max_age': 0,
+                                     'priority': 'urgent'})
+
+        self.assertEquals(rv.status_code, 400)
+
     def test_execute_query_without_access(self):
         group = self.factory.create_group()
         db.session.commit()
@@ -167,3 +301,15 @@ class TestQueryResultExcelResponse(BaseTestCase):
         rv = self.make_request('get', '/api/queries/{}/results/{}.xlsx'.format(query.id, query_result.id), is_json=False)
         self.assertEquals(rv.status_code, 200)
 
+
+
+class TestQueryResultCSVResponse(BaseTestCase):
+    def test_renders_csv_file(self):
+        query = self.factory.create_query()
+        query_result = self.factory.create_query_result(data=json.dumps({
+            'rows': [{'test': 1}, {'test': 2, 'test2': u'\xe4'}],
+            'columns': [{'name': 'test'}, {'name': 'test2'}]}))
+
+        rv = self.make_request('get', '/api/queries/{}/results/{}.csv'.format(query.id, query_result.id), is_json=False)
+        self.assertEquals(rv.status_code, 200)
+        self.assertEquals(rv.data, 'test,test2\r\n1,\r\n2,\xc3\xa4\r\n')
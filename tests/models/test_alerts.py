@@ -1,5 +1,9 @@
+import mock
+
 from tests import BaseTestCase
-from redash.models import Alert, db
+from redash.models import Alert, QueryResult, db
+from redash.results import QueryResultWriter
+from redash.utils import utcnow
 
 
 class TestAlertAll(BaseTestCase):
@@ -36,3 +40,78 @@ class TestAlertAll(BaseTestCase):
         alerts = Alert.all(group_ids=[self.factory.default_group.id, group.id])
         self.assertEqual(1, len(list(alerts)))
         self.assertIn(alert, alerts)
+
+
+class TestAlertEvaluate(BaseTestCase):
+    def create_alert(self, data, **options):
+        query_result = self.factory.create_query_result(data=data)
+        query = self.factory.create_query(latest_query_data=query_result)
+        options.setdefault('op', 'greater than')
+        options.setdefault('value', 1)
+        return self.factory.create_alert(query_rel=query, options=options)
+
+    def test_evaluates_first_row_of_latest_result(self):
+        alert = self.create_alert('{"columns": [{"name": "foo"}], "rows": [{"foo": 2}, {"foo": 0}]}', column='foo')
+        self.assertEqual(alert.evaluate(), Alert.TRIGGERED_STATE)
+
+        alert.options['op'] = 'less than'
+        self.assertEqual(alert.evaluate(), Alert.OK_STATE)
+
+    def test_unknown_when_result_has_no_rows(self):
+        alert = self.create_alert('{"columns": [{"name": "foo"}], "rows": []}', column='foo')
+        self.assertEqual(alert.evaluate(), Alert.UNKNOWN_STATE)
+
+    def test_uses_alert_values_without_loading_result(self):
+        alert = self.create_alert('{"columns": [{"name": "foo"}], "rows": [{"foo": 0}]}', column='foo')
+
+        with mock.patch.object(QueryResult, 'first_row') as first_row:
+            self.assertEqual(alert.evaluate({'has_rows': True, 'values': {'foo': 2}}), Alert.TRIGGERED_STATE)
+            self.assertEqual(alert.evaluate({'has_rows': False, 'values': {}}), Alert.UNKNOWN_STATE)
+
+        self.assertFalse(first_row.called)
+
+    def test_reads_result_when_alert_values_miss_its_column(self):
+        alert = self.create_alert('{"columns": [{"name": "foo"}], "rows": [{"foo": 2}]}', column='foo')
+        self.assertEqual(alert.evaluate({'has_rows': True, 'values': {'bar': 0}}), Alert.TRIGGERED_STATE)
+
+
+class TestStoreResultAlertValues(BaseTestCase):
+    def store_result(self, query, data):
+        query_result, _ = QueryResult.store_result(query.org_id, query.data_source, query.query_hash, query.query_text,
+                                                   data, 1, utcnow())
+        return query_result
+
+    def test_extracts_watched_columns_of_first_row(self):
+        query = self.factory.create_query()
+        self.factory.create_alert(query_rel=query, options={'column': 'foo', 'op': 'equals', 'value': 1})
+        self.factory.create_alert(query_rel=query, options={'column': 'bar', 'op': 'equals', 'value': 1})
+
+        query_result = self.store_result(
+            query, '{"columns": [{"name": "foo"}, {"name": "bar"}, {"name": "baz"}], '
+                   '"rows": [{"foo": 1, "bar": "a", "baz": 3}, {"foo": 2, "bar": "b", "baz": 4}]}')
+
+        self.assertEqual(query_result.alert_values, {'has_rows': True, 'values': {'foo': 1, 'bar': 'a'}})
+
+    def test_extracts_from_result_writer(self):
+        query = self.factory.create_query()
+        self.factory.create_alert(query_rel=query, options={'column': 'foo', 'op': 'equals', 'value': 1})
+
+        writer = QueryResultWriter()
+        writer.consume(iter([[{'name': 'foo'}, {'name': 'bar'}], [(1, 2), (3, 4)]]))
+        query_result = self.store_result(query, writer)
+
+        self.assertEqual(query_result.alert_values, {'has_rows': True, 'values': {'foo': 1}})
+
+    def test_records_empty_results(self):
+        query = self.factory.create_query()
+        self.factory.create_alert(query_rel=query, options={'column': 'foo', 'op': 'equals', 'value': 1})
+
+        query_result = self.store_result(query, '{"columns": [{"name": "foo"}], "rows": []}')
+
+        self.assertEqual(query_result.alert_values, {'has_rows': False, 'values': {}})
+
+    def test_skips_queries_without_alerts(self):
+        query = self.factory.create_query()
+        query_result = self.store_result(query, '{"columns": [{"name": "foo"}], "rows": [{"foo": 1}]}')
+
+        self.assertIsNone(query_result.alert_values)
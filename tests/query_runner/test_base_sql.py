@@ -0,0 +1,36 @@
+from unittest import TestCase
+
+import mock
+
+from redash import settings
+from redash.query_runner import BaseSQLQueryRunner
+
+
+class TestGetTablesStats(TestCase):
+    def setUp(self):
+        self.runner = BaseSQLQueryRunner({})
+        self.tables = {'users': {'name': 'users', 'columns': []}, 'events': {'name': 'events', 'columns': []}}
+
+    def test_uses_catalog_estimates(self):
+        with mock.patch.object(self.runner, '_get_table_size_estimates', return_value={'users': 10}), \
+                mock.patch.object(self.runner, '_get_table_size') as get_table_size:
+            self.runner._get_tables_stats(self.tables)
+
+        self.assertEqual(self.tables['users']['size'], 10)
+        self.assertNotIn('size', self.tables['events'])
+        self.assertFalse(get_table_size.called)
+
+    def test_counts_rows_without_estimates(self):
+        with mock.patch.object(self.runner, '_get_table_size', side_effect=lambda t: len(t)):
+            self.runner._get_tables_stats(self.tables)
+
+        self.assertEqual(self.tables['users']['size'], 5)
+        self.assertEqual(self.tables['events']['size'], 6)
+
+    def test_counts_rows_when_exact_sizes_are_required(self):
+        with mock.patch.object(settings, 'SCHEMA_EXACT_TABLE_SIZES', True), \
+                mock.patch.object(self.runner, '_get_table_size_estimates', return_value={'users': 10}), \
+                mock.patch.object(self.runner, '_get_table_size', return_value=3):
+            self.runner._get_tables_stats(self.tables)
+
+        self.assertEqual(self.tables['users']['size'], 3)
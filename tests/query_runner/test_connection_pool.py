@@ -0,0 +1,166 @@
+import time
+from unittest import TestCase
+
+import mock
+
+from redash.query_runner import BaseQueryRunner, connection_pool
+from redash.query_runner.connection_pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(TestCase):
+    def create_pool(self, **kwargs):
+        kwargs.setdefault('max_size', 2)
+        kwargs.setdefault('idle_timeout', 60)
+        kwargs.setdefault('wait_timeout', 0.1)
+        kwargs.setdefault('check_interval', 0)
+        return ConnectionPool(FakeConnection, check=lambda c: not c.closed, **kwargs)
+
+    def test_reuses_connections(self):
+        pool = self.create_pool()
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertFalse(first.closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_discards_connections_when_block_raises(self):
+        pool = self.create_pool()
+
+        with self.assertRaises(ValueError):
+            with pool.connection() as connection:
+                raise ValueError()
+
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_waits_for_a_free_connection(self):
+        pool = self.create_pool(max_size=1)
+        connection = pool.checkout()
+
+        with self.assertRaises(PoolTimeout):
+            pool.checkout()
+
+        pool.checkin(connection)
+        self.assertIs(pool.checkout(), connection)
+
+    def test_replaces_unhealthy_connections(self):
+        pool = self.create_pool()
+        connection = pool.checkout()
+        pool.checkin(connection)
+        connection.closed = True
+
+        new_connection = pool.checkout()
+
+        self.assertIsNot(new_connection, connection)
+        self.assertEqual(pool.size, 1)
+
+    def test_checks_only_connections_idle_for_longer_than_the_check_interval(self):
+        check = mock.Mock(return_value=True)
+        pool = ConnectionPool(FakeConnection, check=check, max_size=1, check_interval=30)
+        pool.checkin(pool.checkout())
+
+        pool.checkin(pool.checkout())
+        self.assertFalse(check.called)
+
+        with mock.patch('time.time', return_value=time.time() + 31):
+            pool.checkout()
+        self.assertTrue(check.called)
+
+    def test_resets_connections_on_checkin(self):
+        reset = mock.Mock(return_value=True)
+        pool = self.create_pool(reset=reset)
+
+        with pool.connection() as connection:
+            pass
+
+        reset.assert_called_once_with(connection)
+        self.assertFalse(connection.closed)
+
+    def test_discards_connections_that_cant_be_reset(self):
+        pool = self.create_pool(reset=mock.Mock(side_effect=ValueError))
+
+        with pool.connection() as connection:
+            pass
+
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_discards_connections_that_arent_reusable(self):
+        pool = self.create_pool()
+
+        with pool.connection(reusable=False) as connection:
+            pass
+
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_closes_idle_connections(self):
+        pool = self.create_pool()
+        connection = pool.checkout()
+        pool.checkin(connection)
+
+        pool.close_idle(time.time() + 61)
+
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_connects_every_time_when_disabled(self):
+        pool = self.create_pool(max_size=0)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+
+    def test_reports_hits_and_misses(self):
+        pool = self.create_pool()
+
+        with mock.patch.object(connection_pool, 'statsd_client') as statsd_client:
+            with pool.connection():
+                pass
+            with pool.connection():
+                pass
+
+        statsd_client.incr.assert_has_calls([mock.call('connection_pool.miss'), mock.call('connection_pool.hit')])
+        self.assertEqual(statsd_client.timing.call_count, 2)
+
+
+class TestGetPool(TestCase):
+    def tearDown(self):
+        connection_pool.close_all()
+
+    def create_runner(self, configuration, data_source_id=1):
+        runner = BaseQueryRunner(configuration)
+        runner.data_source_id = data_source_id
+        return runner
+
+    def test_returns_same_pool_for_same_configuration(self):
+        pool = connection_pool.get_pool(self.create_runner({'host': 'a'}), FakeConnection)
+
+        self.assertIs(connection_pool.get_pool(self.create_runner({'host': 'a'}), FakeConnection), pool)
+        self.assertIsNot(connection_pool.get_pool(self.create_runner({'host': 'a'}, 2), FakeConnection), pool)
+
+    def test_closes_pool_when_configuration_changes(self):
+        pool = connection_pool.get_pool(self.create_runner({'host': 'a'}), FakeConnection)
+        with pool.connection() as connection:
+            pass
+
+        new_pool = connection_pool.get_pool(self.create_runner({'host': 'b'}), FakeConnection)
+
+        self.assertIsNot(new_pool, pool)
+        self.assertTrue(connection.closed)
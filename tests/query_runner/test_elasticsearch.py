@@ -0,0 +1,111 @@
+import json
+from unittest import TestCase
+
+import mock
+import requests
+
+from redash import settings
+from redash.query_runner import elasticsearch
+from redash.query_runner.elasticsearch import ElasticSearch, Kibana
+
+MAPPINGS = {'logs': {'mappings': {'event': {'properties': {'message': {'type': 'string'}, 'bytes': {'type': 'long'}}}}}}
+
+
+def response(data):
+    r = mock.Mock()
+    r.json.return_value = data
+    return r
+
+
+def hits_page(start, count, scroll_id='scroll-1'):
+    hits = [{'_source': {'message': 'm{}'.format(i), 'bytes': i}} for i in range(start, start + count)]
+    return {'_scroll_id': scroll_id, 'hits': {'total': 100, 'hits': hits}}
+
+
+class ElasticSearchTestCase(TestCase):
+    def setUp(self):
+        elasticsearch._mappings_cache.clear()
+        self.get = mock.patch.object(requests, 'get').start()
+        self.post = mock.patch.object(requests, 'post').start()
+        self.delete = mock.patch.object(requests, 'delete').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def mock_search(self, first_page, next_pages=()):
+        def get(url, **kwargs):
+            return response(MAPPINGS if url.endswith('/_mapping') else first_page)
+
+        self.get.side_effect = get
+        self.post.side_effect = [response(page) for page in next_pages]
+
+
+class TestMappingsCache(ElasticSearchTestCase):
+    def test_downloads_mappings_once(self):
+        self.mock_search({'hits': {'total': 0, 'hits': []}})
+        runner = ElasticSearch({'server': 'http://es'})
+
+        for i in range(2):
+            data, error = runner.run_query(json.dumps({'index': 'logs', 'query': {'match_all': {}}}), None)
+            self.assertIsNone(error)
+
+        mapping_calls = [c for c in self.get.call_args_list if c[0][0].endswith('/_mapping')]
+        self.assertEqual(len(mapping_calls), 1)
+
+    def test_expires_mappings(self):
+        self.mock_search({'hits': {'total': 0, 'hits': []}})
+        runner = ElasticSearch({'server': 'http://es'})
+        query = json.dumps({'index': 'logs', 'query': {'match_all': {}}})
+
+        with mock.patch.object(settings, 'ELASTICSEARCH_MAPPINGS_CACHE_TTL', 0):
+            runner.run_query(query, None)
+            runner.run_query(query, None)
+
+        mapping_calls = [c for c in self.get.call_args_list if c[0][0].endswith('/_mapping')]
+        self.assertEqual(len(mapping_calls), 2)
+
+
+class TestElasticSearchScroll(ElasticSearchTestCase):
+    def test_scrolls_through_large_searches(self):
+        self.mock_search(hits_page(0, 2), [hits_page(2, 2), hits_page(4, 2)])
+        runner = ElasticSearch({'server': 'http://es'})
+
+        with mock.patch.object(settings, 'QUERY_RESULTS_BATCH_SIZE', 2):
+            data, error = runner.run_query(json.dumps({'index': 'logs', 'size': 5, 'query': {'match_all': {}}}), None)
+
+        self.assertIsNone(error)
+        self.assertEqual([row['bytes'] for row in json.loads(data)['rows']], range(5))
+        search_params = [c[1]['params'] for c in self.get.call_args_list if c[0][0].endswith('/_search')][0]
+        self.assertEqual(json.loads(search_params['source'])['size'], 2)
+        self.assertEqual(self.post.call_count, 2)
+        self.assertEqual(self.delete.call_count, 1)
+
+    def test_doesnt_scroll_small_searches(self):
+        self.mock_search(hits_page(0, 3, scroll_id=None))
+        runner = ElasticSearch({'server': 'http://es'})
+
+        data, error = runner.run_query(json.dumps({'index': 'logs', 'size': 3, 'query': {'match_all': {}}}), None)
+
+        self.assertEqual(len(json.loads(data)['rows']), 3)
+        self.assertFalse(self.post.called)
+
+
+class TestKibanaScroll(ElasticSearchTestCase):
+    def test_scrolls_until_limit(self):
+        self.mock_search(hits_page(0, 2), [hits_page(2, 2), hits_page(4, 2)])
+        runner = Kibana({'server': 'http://es'})
+
+        query = {'index': 'logs', 'query': 'message:*', 'size': 2, 'limit': 3}
+        data, error = runner.run_query(json.dumps(query), None)
+
+        self.assertIsNone(error)
+        self.assertEqual([row['bytes'] for row in json.loads(data)['rows']], range(3))
+        self.assertEqual(self.post.call_count, 1)
+        self.assertEqual(self.delete.call_count, 1)
+
+    def test_stops_when_hits_run_out(self):
+        self.mock_search(hits_page(0, 2), [hits_page(2, 1), hits_page(3, 0)])
+        runner = Kibana({'server': 'http://es'})
+
+        data, error = runner.run_query(json.dumps({'index': 'logs', 'query': '*', 'size': 2, 'limit': 100}), None)
+
+        self.assertEqual(len(json.loads(data)['rows']), 3)
+        self.assertEqual(self.post.call_count, 2)
@@ -63,12 +63,13 @@ class TestParseWorksheet(TestCase):
         worksheet = [['Column', 'Another Column', 'Column'], ['A', 'TRUE', '1'], ['B', 'FALSE', '2'], ['C', 'TRUE', '3'], ['D', 'FALSE', '4']]
         parsed = parse_worksheet(worksheet)
 
-        columns = map(lambda c: c['name'], parsed['columns'])
+        columns = map(lambda c: c['name'], parsed.columns)
         self.assertEqual('Column', columns[0])
         self.assertEqual('Another Column', columns[1])
         self.assertEqual('Column1', columns[2])
 
-        self.assertEqual('A', parsed['rows'][0]['Column'])
-        self.assertEqual(True, parsed['rows'][0]['Another Column'])
-        self.assertEqual(1, parsed['rows'][0]['Column1'])
+        rows = parsed.to_dict()['rows']
+        self.assertEqual('A', rows[0]['Column'])
+        self.assertEqual(True, rows[0]['Another Column'])
+        self.assertEqual(1, rows[0]['Column1'])
 
@@ -2,7 +2,9 @@ import datetime
 import json
 from unittest import TestCase
 from pytz import utc
-from redash.query_runner.mongodb import parse_query_json, parse_results, _get_column_by_name
+from mock import MagicMock
+
+from redash.query_runner.mongodb import MongoDB, parse_query_json, parse_result_set
 
 from redash.utils import parse_human_time
 
@@ -111,14 +113,11 @@ class TestMongoResults(TestCase):
             {'column': 1, 'column2': 'test'},
             {'column': 2, 'column2': 'test', 'column3': 'hello'}
         ]
-        rows, columns = parse_results(raw_results)
-
-        for i, row in enumerate(rows):
-            self.assertDictEqual(row, raw_results[i])
+        results = parse_result_set(raw_results)
+        rows = [dict(zip(results.column_names, row)) for row in results.rows]
 
-        self.assertIsNotNone(_get_column_by_name(columns, 'column'))
-        self.assertIsNotNone(_get_column_by_name(columns, 'column2'))
-        self.assertIsNotNone(_get_column_by_name(columns, 'column3'))
+        self.assertDictEqual(rows[0], {'column': 1, 'column2': 'test', 'column3': None})
+        self.assertDictEqual(rows[1], raw_results[1])
     
     def test_parses_nested_results(self):
         raw_results = [
@@ -133,14 +132,57 @@ class TestMongoResults(TestCase):
             }}
         ]
 
-        rows, columns = parse_results(raw_results)
+        results = parse_result_set(raw_results)
+        rows = [dict(zip(results.column_names, row)) for row in results.rows]
+
+        self.assertDictEqual(rows[0], {'column': 1, 'column2': 'test', 'column3': None,
+                                       'nested.a': 1, 'nested.b': 'str', 'nested.c': None})
+        self.assertDictEqual(rows[1], {'column': 2, 'column2': 'test', 'column3': 'hello',
+                                       'nested.a': 2, 'nested.b': 'str2', 'nested.c': 'c'})
+
+    def test_flattens_documents_at_any_depth(self):
+        raw_results = [{'a': {'b': {'c': 1, 'd': [1, 2]}}, 'e': {}}]
+
+        results = parse_result_set(raw_results)
+
+        self.assertEqual(sorted(results.column_names), ['a.b.c', 'a.b.d'])
+        self.assertEqual(dict(zip(results.column_names, results.rows[0])), {'a.b.c': 1, 'a.b.d': [1, 2]})
+
+    def test_guesses_types_from_values_that_arent_null(self):
+        results = parse_result_set([{'a': None}, {'a': 1.5}])
+
+        self.assertEqual(results.columns[0]['type'], 'float')
+
+
+class TestMongoResultSet(TestCase):
+    def test_pads_rows_with_missing_columns(self):
+        raw_results = [
+            {'column': 1},
+            {'column': 2, 'nested': {'a': 'x'}},
+            {'nested': {'a': 'y'}, 'column3': True}
+        ]
+
+        results = parse_result_set(raw_results)
+
+        self.assertEqual(results.column_names, ['column', 'nested.a', 'column3'])
+        self.assertEqual(results.rows, [(1, None, None), (2, 'x', None), (None, 'y', True)])
+
+    def test_orders_columns_by_fields(self):
+        raw_results = [{'_id': 1, 'a': 'x', 'b': 2}, {'_id': 2, 'a': 'y', 'b': 3}]
+
+        results = parse_result_set(raw_results, {'b': 1, 'a': 2, 'missing': 3})
+
+        self.assertEqual(results.column_names, ['b', 'a'])
+        self.assertEqual(results.rows, [(2, 'x'), (3, 'y')])
+
+
+class TestMongoSchema(TestCase):
+    def test_samples_documents(self):
+        runner = MongoDB({'connectionString': 'mongodb://localhost', 'dbName': 'db', 'schemaSampleSize': 10})
+        collection = MagicMock()
+        collection.aggregate.return_value = iter([{'a': 1}, {'b': {'c': 2}}])
 
-        self.assertDictEqual(rows[0], { 'column': 1, 'column2': 'test', 'nested.a': 1, 'nested.b': 'str' })
-        self.assertDictEqual(rows[1], { 'column': 2, 'column2': 'test', 'column3': 'hello', 'nested.a': 2, 'nested.b': 'str2', 'nested.c': 'c' })
+        columns = runner._get_collection_fields({'events': collection}, 'events')
 
-        self.assertIsNotNone(_get_column_by_name(columns, 'column'))
-        self.assertIsNotNone(_get_column_by_name(columns, 'column2'))
-        self.assertIsNotNone(_get_column_by_name(columns, 'column3'))
-        self.assertIsNotNone(_get_column_by_name(columns, 'nested.a'))
-        self.assertIsNotNone(_get_column_by_name(columns, 'nested.b'))
-        self.assertIsNotNone(_get_column_by_name(columns, 'nested.c'))
\ No newline at end of file
+        self.assertEqual(columns, {'a', 'b.c'})
+        collection.aggregate.assert_called_once_with([{'$sample': {'size': 10}}])
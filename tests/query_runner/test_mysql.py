@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+import mock
+
+from redash.query_runner.mysql import Mysql, _fetch_last_result_set, _statements_count
+
+
+class FakeCursor(object):
+    def __init__(self, result_sets):
+        self.result_sets = list(result_sets)
+        self.description, self.rows = self.result_sets.pop(0)
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def nextset(self):
+        if not self.result_sets:
+            return None
+        self.description, self.rows = self.result_sets.pop(0)
+        return True
+
+
+class TestStatementsCount(TestCase):
+    def test_counts_statements(self):
+        self.assertEqual(_statements_count("SELECT 1"), 1)
+        self.assertEqual(_statements_count("SELECT ';'; -- trailing comment"), 1)
+        self.assertEqual(_statements_count("SET @a = 1; SELECT @a;"), 2)
+
+
+class TestFetchLastResultSet(TestCase):
+    def test_returns_last_result_set(self):
+        cursor = FakeCursor([((('a', 3),), [(1,)]), ((('b', 253),), [(u'x',), (u'y',)])])
+
+        self.assertEqual(_fetch_last_result_set(cursor), ((('b', 253),), [(u'x',), (u'y',)]))
+
+    def test_returns_statements_without_rows(self):
+        cursor = FakeCursor([((('a', 3),), [(1,)]), (None, [])])
+
+        self.assertEqual(_fetch_last_result_set(cursor), (None, []))
+
+
+class FakeConnection(mock.Mock):
+    ProgrammingError = type('ProgrammingError', (Exception,), {})
+
+
+class TestResetConnection(TestCase):
+    def setUp(self):
+        self.query_runner = Mysql({'user': 'redash', 'passwd': 'secret', 'db': 'redash'})
+
+    def test_resets_connection_without_logging_in_again(self):
+        connection = FakeConnection()
+
+        self.assertTrue(self.query_runner._reset_connection(connection))
+
+        connection.query.assert_called_once_with('RESET CONNECTION')
+        connection.change_user.assert_not_called()
+        connection.autocommit.assert_called_once_with(True)
+
+    def test_logs_in_again_on_servers_without_reset_connection(self):
+        connection = FakeConnection()
+        connection.query.side_effect = FakeConnection.ProgrammingError()
+
+        self.assertTrue(self.query_runner._reset_connection(connection))
+        self.assertTrue(self.query_runner._reset_connection(connection))
+
+        connection.query.assert_called_once_with('RESET CONNECTION')
+        connection.change_user.assert_called_with('redash', 'secret', 'redash')
+        self.assertEqual(connection.change_user.call_count, 2)
+        connection.autocommit.assert_called_with(True)
@@ -0,0 +1,30 @@
+from unittest import TestCase
+
+from redash.query_runner.pg import _single_select_statement
+
+
+class TestSingleSelectStatement(TestCase):
+    def test_strips_trailing_semicolon(self):
+        self.assertEqual(_single_select_statement("SELECT * FROM events;"), "SELECT * FROM events\n")
+
+    def test_keeps_comments(self):
+        query = "/* Username: a@b.c */ WITH e AS (SELECT 1) SELECT * FROM e; -- all of them"
+        self.assertEqual(_single_select_statement(query),
+                         "/* Username: a@b.c */ WITH e AS (SELECT 1) SELECT * FROM e -- all of them\n")
+
+    def test_ignores_other_statements(self):
+        self.assertIsNone(_single_select_statement("SELECT 1; SELECT 2;"))
+        self.assertIsNone(_single_select_statement("UPDATE events SET a = 1"))
+        self.assertIsNone(_single_select_statement("CREATE TABLE t AS SELECT 1"))
+        self.assertIsNone(_single_select_statement("SET search_path TO foo; SELECT * FROM t"))
+        self.assertIsNone(_single_select_statement("VACUUM; SELECT 1"))
+
+    def test_ignores_select_into(self):
+        self.assertIsNone(_single_select_statement("SELECT a INTO t2 FROM t"))
+
+    def test_ignores_data_modifying_with_queries(self):
+        self.assertIsNone(_single_select_statement("WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d"))
+        self.assertIsNone(_single_select_statement("WITH i AS (INSERT INTO t VALUES (1) RETURNING a) SELECT * FROM i"))
+
+    def test_ignores_comment_only_statements(self):
+        self.assertEqual(_single_select_statement("SELECT 1; -- done\n;"), "SELECT 1 -- done\n\n")
@@ -1,8 +1,18 @@
+import json
+import os
+import shutil
 import sqlite3
+import tempfile
+import threading
 from unittest import TestCase
 
-from redash.query_runner.query_results import (PermissionError, _load_query, create_table,
-                                               extract_query_ids)
+import mock
+from flask import has_app_context
+
+from redash.query_runner import TYPE_DATETIME, TYPE_FLOAT, TYPE_INTEGER, TYPE_STRING, QueryRunnerError
+from redash.query_runner.query_results import (DatabaseCache, PermissionError, Results, _guess_column_type, _load_query,
+                                               _output_column_types, create_table, create_tables_from_query_ids,
+                                               extract_cached_query_ids, extract_query_ids)
 from tests import BaseTestCase
 
 
@@ -23,6 +33,11 @@ class TestExtractQueryIds(TestCase):
         query = "SELECT * FROM    query_123 a JOIN\tquery_4566 b ON a.id=b.parent_id JOIN\r\nquery_78 c ON b.id=c.parent_id"
         self.assertEquals([123, 4566, 78], extract_query_ids(query))
 
+    def test_finds_cached_queries_to_load(self):
+        query = "SELECT * FROM cached_query_123 JOIN query_4566"
+        self.assertEquals([4566], extract_query_ids(query))
+        self.assertEquals([123], extract_cached_query_ids(query))
+
 
 class TestCreateTable(TestCase):
     def test_creates_table_with_colons_in_column_name(self):
@@ -76,6 +91,83 @@ class TestCreateTable(TestCase):
             len(list(connection.execute('SELECT * FROM query_123'))), 2)
 
 
+    def test_loads_values_sqlite_does_not_support(self):
+        connection = sqlite3.connect(':memory:')
+        results = {'columns': [{'name': 'test1'}, {'name': 'test2'}], 'rows': [{'test1': [1, 2], 'test2': {'a': 1}}]}
+        create_table(connection, 'query_123', results)
+        self.assertEquals(list(connection.execute('SELECT * FROM query_123')), [(u'[1, 2]', u'{"a": 1}')])
+
+
+class TestGuessColumnType(TestCase):
+    def test_ignores_empty_values(self):
+        self.assertEquals(TYPE_INTEGER, _guess_column_type([None, 1, '', 2]))
+
+    def test_falls_back_to_string(self):
+        self.assertEquals(TYPE_STRING, _guess_column_type([1, 'test']))
+        self.assertEquals(TYPE_STRING, _guess_column_type([None]))
+
+    def test_guesses_dates(self):
+        self.assertEquals(TYPE_DATETIME, _guess_column_type(['2017-01-01']))
+
+
+class TestResults(TestCase):
+    def test_uses_types_of_source_columns(self):
+        query = mock.Mock(id=1, query_text='SELECT 1')
+        query.data_source.query_runner.run_query_iter.return_value = iter([
+            [{'name': 'a', 'type': TYPE_STRING}, {'name': 'b', 'type': TYPE_INTEGER}],
+            [(u'1', 1), (u'2', 2)],
+            [{'a': u'3', 'b': 3}]
+        ])
+
+        with mock.patch('redash.query_runner.query_results._load_query', return_value=query):
+            data, error = Results({}).run_query('SELECT a, b, b * 1.5 AS c FROM query_1', None)
+
+        self.assertIsNone(error)
+        data = json.loads(data)
+        self.assertEquals([c['type'] for c in data['columns']], [TYPE_STRING, TYPE_INTEGER, TYPE_FLOAT])
+        self.assertEquals(data['rows'][2], {'a': '3', 'b': 3, 'c': 4.5})
+
+    def test_guesses_types_of_expressions_named_like_source_columns(self):
+        query = mock.Mock(id=1, query_text='SELECT 1')
+        query.data_source.query_runner.run_query_iter.return_value = iter([
+            [{'name': 'name', 'type': TYPE_STRING}],
+            [(u'abc',), (u'de',)]
+        ])
+
+        with mock.patch('redash.query_runner.query_results._load_query', return_value=query):
+            data, error = Results({}).run_query('SELECT length(name) AS name, name AS label FROM query_1', None)
+
+        self.assertIsNone(error)
+        data = json.loads(data)
+        self.assertEquals([c['type'] for c in data['columns']], [TYPE_INTEGER, TYPE_STRING])
+        self.assertEquals(data['rows'][0], {'name': 3, 'label': 'abc'})
+
+
+class TestOutputColumnTypes(TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        create_table(self.connection, 'query_1', {'columns': [{'name': 'a', 'type': TYPE_INTEGER},
+                                                              {'name': 'b', 'type': TYPE_STRING}],
+                                                  'rows': [{'a': 1, 'b': u'1'}]})
+
+    def test_returns_types_of_referenced_columns(self):
+        self.assertEquals(_output_column_types(self.connection, 'SELECT b AS a, a AS b, a + 1 FROM query_1;'),
+                          [TYPE_STRING, TYPE_INTEGER, None])
+
+    def test_stores_values_as_given(self):
+        self.assertEquals(list(self.connection.execute('SELECT a, b FROM query_1')), [(1, u'1')])
+
+    def test_returns_none_for_other_statements(self):
+        self.assertIsNone(_output_column_types(self.connection, 'PRAGMA table_info(query_1)'))
+
+    def test_keeps_connection_read_only(self):
+        self.connection.execute('PRAGMA query_only = ON')
+
+        self.assertEquals(_output_column_types(self.connection, 'SELECT a FROM query_1'), [TYPE_INTEGER])
+        self.assertIsNone(_output_column_types(self.connection, 'DELETE FROM query_1'))
+        self.assertRaises(sqlite3.OperationalError, lambda: self.connection.execute('DELETE FROM query_1'))
+
+
 class TestGetQuery(BaseTestCase):
     # test query from different account
     def test_raises_exception_for_query_from_different_account(self):
@@ -97,3 +189,117 @@ class TestGetQuery(BaseTestCase):
 
         loaded = _load_query(user, query.id)
         self.assertEquals(query, loaded)
+
+
+class TestCreateTablesFromQueryIds(BaseTestCase):
+    def setUp(self):
+        super(TestCreateTablesFromQueryIds, self).setUp()
+        data = {'columns': [{'name': 'a', 'type': TYPE_INTEGER}], 'rows': [{'a': 1}, {'a': 2}]}
+        self.query_result = self.factory.create_query_result(data=json.dumps(data))
+        self.query = self.factory.create_query(latest_query_data=self.query_result)
+        self.user = self.factory.create_admin()
+
+    def test_loads_cached_results(self):
+        connection = sqlite3.connect(':memory:')
+
+        with mock.patch('redash.query_runner.pg.PostgreSQL.run_query_iter') as run_query_iter:
+            create_tables_from_query_ids(self.user, connection, [], [self.query.id])
+
+        run_query_iter.assert_not_called()
+        self.assertEquals(list(connection.execute('SELECT a FROM cached_query_{}'.format(self.query.id))),
+                          [(1,), (2,)])
+
+    def test_reuses_recent_results(self):
+        connection = sqlite3.connect(':memory:')
+
+        with mock.patch('redash.query_runner.pg.PostgreSQL.run_query_iter') as run_query_iter:
+            create_tables_from_query_ids(self.user, connection, [self.query.id], max_age=3600)
+
+        run_query_iter.assert_not_called()
+        self.assertEquals(len(list(connection.execute('SELECT a FROM query_{}'.format(self.query.id)))), 2)
+
+    def test_executes_queries(self):
+        connection = sqlite3.connect(':memory:')
+        other_query = self.factory.create_query()
+
+        with mock.patch('redash.query_runner.pg.PostgreSQL.run_query_iter') as run_query_iter:
+            run_query_iter.side_effect = lambda query, user: iter([[{'name': 'b', 'type': TYPE_STRING}], [(u'x',)]])
+            create_tables_from_query_ids(self.user, connection, [self.query.id, other_query.id])
+
+        self.assertEquals(run_query_iter.call_count, 2)
+        self.assertEquals(list(connection.execute('SELECT b FROM query_{}'.format(other_query.id))), [(u'x',)])
+
+    def test_executes_queries_in_app_context(self):
+        other_query = self.factory.create_query()
+        in_app_context = []
+
+        def run_query_iter(query, user):
+            in_app_context.append(has_app_context())
+            return iter([[{'name': 'b', 'type': TYPE_STRING}], [(u'x',)]])
+
+        with mock.patch('redash.query_runner.pg.PostgreSQL.run_query_iter', side_effect=run_query_iter):
+            create_tables_from_query_ids(self.user, sqlite3.connect(':memory:'), [self.query.id, other_query.id])
+
+        self.assertEquals(in_app_context, [True, True])
+
+    def test_cancels_running_queries_when_one_fails(self):
+        other_query = self.factory.create_query()
+        failed = threading.Event()
+        closed = threading.Event()
+        calls = []
+
+        def slow_results():
+            try:
+                yield [{'name': 'b', 'type': TYPE_STRING}]
+                while True:
+                    failed.wait()
+                    yield [(u'x',)]
+            finally:
+                closed.set()
+
+        def run_query_iter(query, user):
+            calls.append(query)
+            if len(calls) == 1:
+                return slow_results()
+            raise QueryRunnerError("broken")
+
+        with mock.patch('redash.query_runner.pg.PostgreSQL.run_query_iter', side_effect=run_query_iter):
+            with self.assertRaises(QueryRunnerError):
+                create_tables_from_query_ids(self.user, sqlite3.connect(':memory:'), [self.query.id, other_query.id])
+            failed.set()
+
+        self.assertTrue(closed.wait(5))
+
+
+class TestDatabaseCache(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.loads = 0
+
+    def load(self, connection):
+        self.loads += 1
+        create_table(connection, 'query_1', {'columns': [{'name': 'a'}], 'rows': [{'a': 1}]})
+
+    def test_reuses_databases(self):
+        cache = DatabaseCache(self.path, 1024 * 1024)
+
+        for i in range(2):
+            connection = cache.connect('key', self.load)
+            self.assertEquals(list(connection.execute('SELECT a FROM query_1')), [(1,)])
+            connection.close()
+
+        self.assertEquals(self.loads, 1)
+
+    def test_databases_are_read_only(self):
+        connection = DatabaseCache(self.path, 1024 * 1024).connect('key', self.load)
+        self.assertRaises(sqlite3.OperationalError, lambda: connection.execute('DELETE FROM query_1'))
+
+    def test_evicts_least_recently_used_databases(self):
+        cache = DatabaseCache(self.path, 1)
+
+        cache.connect('key1', self.load).close()
+        cache.connect('key2', self.load).close()
+
+        self.assertEquals(os.listdir(self.path), [])
+        self.assertEquals(self.loads, 2)
@@ -0,0 +1,88 @@
+import datetime
+import json
+from unittest import TestCase
+
+from redash.results import ColumnarResult, EncodingError, decode, encode, encode_json, is_encoded
+
+
+class TestEncoding(TestCase):
+    def setUp(self):
+        self.columns = [{'name': 'id', 'friendly_name': 'id', 'type': 'integer'},
+                        {'name': 'name', 'friendly_name': 'name', 'type': 'string'}]
+        self.rows = [{'id': i, 'name': u'name \xe4 {}'.format(i)} for i in range(23)]
+
+    def test_round_trip(self):
+        payload = encode({'columns': self.columns, 'rows': self.rows}, row_group_size=5)
+
+        self.assertTrue(is_encoded(payload))
+        self.assertEqual(decode(payload), {'columns': self.columns, 'rows': self.rows})
+
+    def test_reads_row_groups(self):
+        result = ColumnarResult(encode({'columns': self.columns, 'rows': self.rows}, row_group_size=5))
+
+        self.assertEqual(23, result.row_count)
+        self.assertEqual(5, len(result.row_groups))
+        self.assertEqual((22, u'name \xe4 22'), list(result.iter_rows())[-1])
+
+    def test_serializes_json(self):
+        result = ColumnarResult(encode({'columns': self.columns, 'rows': self.rows}, row_group_size=5))
+        self.assertEqual(json.loads(''.join(result.iter_json())), {'columns': self.columns, 'rows': self.rows})
+
+        result = ColumnarResult(encode({'columns': self.columns, 'rows': []}))
+        self.assertEqual(json.loads(''.join(result.iter_json())), {'columns': self.columns, 'rows': []})
+
+    def test_reads_range_of_rows_and_columns(self):
+        result = ColumnarResult(encode({'columns': self.columns, 'rows': self.rows}, row_group_size=5))
+
+        self.assertEqual([(i, u'name \xe4 {}'.format(i)) for i in range(7, 13)], list(result.iter_rows(7, 6)))
+        self.assertEqual([(u'name \xe4 21',), (u'name \xe4 22',)], list(result.iter_rows(21, 10, ['name'])))
+        self.assertEqual([], list(result.iter_rows(30)))
+
+    def test_serializes_range_of_rows_and_columns_as_json(self):
+        result = ColumnarResult(encode({'columns': self.columns, 'rows': self.rows}, row_group_size=5))
+
+        self.assertEqual(json.loads(''.join(result.iter_json(4, 2, ['name', 'missing']))), {
+            'columns': [self.columns[1]],
+            'rows': [{'name': u'name \xe4 4'}, {'name': u'name \xe4 5'}]
+        })
+
+    def test_keeps_metadata(self):
+        metadata = {'data_scanned': 1024}
+        result = ColumnarResult(encode({'columns': self.columns, 'rows': self.rows[:2], 'metadata': metadata}))
+
+        self.assertEqual(result.metadata, metadata)
+        self.assertEqual(result.to_dict()['metadata'], metadata)
+        self.assertEqual(json.loads(''.join(result.iter_json()))['metadata'], metadata)
+        self.assertNotIn('metadata', decode(encode({'columns': self.columns, 'rows': []})))
+
+    def test_round_trip_without_rows(self):
+        payload = encode({'columns': self.columns, 'rows': []})
+        self.assertEqual(decode(payload), {'columns': self.columns, 'rows': []})
+
+    def test_encodes_missing_values_as_null(self):
+        payload = encode({'columns': self.columns, 'rows': [{'id': 1}]})
+        self.assertEqual(decode(payload)['rows'], [{'id': 1, 'name': None}])
+
+    def test_serializes_dates(self):
+        payload = encode({'columns': [{'name': 'd'}], 'rows': [{'d': datetime.date(2018, 1, 2)}]})
+        self.assertEqual(decode(payload)['rows'], [{'d': '2018-01-02'}])
+
+    def test_is_smaller_than_json(self):
+        data = {'columns': self.columns, 'rows': self.rows * 100}
+        self.assertLess(len(encode(data)) * 5, len(json.dumps(data)))
+
+    def test_rejects_invalid_payload(self):
+        self.assertRaises(EncodingError, lambda: ColumnarResult('{"columns": []}'))
+        self.assertRaises(EncodingError, lambda: ColumnarResult('RDR\x09' + '\x00' * 20))
+
+
+class TestEncodeJSON(TestCase):
+    def test_encodes_query_result(self):
+        data = {'columns': [{'name': 'a'}], 'rows': [{'a': 1}]}
+        self.assertEqual(decode(encode_json(json.dumps(data))), data)
+
+    def test_ignores_other_values(self):
+        self.assertIsNone(encode_json('data'))
+        self.assertIsNone(encode_json(None))
+        self.assertIsNone(encode_json('{"columns": {}, "rows": []}'))
+        self.assertIsNone(encode_json('[1, 2]'))
@@ -0,0 +1,215 @@
+import datetime
+import os
+import shutil
+import tempfile
+import time
+from cStringIO import StringIO
+
+import mock
+
+from tests import BaseTestCase
+from redash import models, redis_connection, settings
+from redash.models import db
+from redash.results import gc
+from redash.results import storage as result_storage
+from redash.utils import utcnow
+
+
+class TestQueryResultsCollector(BaseTestCase):
+    def setUp(self):
+        super(TestQueryResultsCollector, self).setUp()
+        self.two_weeks_ago = utcnow() - datetime.timedelta(days=14)
+
+    def add_old_candidates(self, *query_results):
+        redis_connection.zadd(models.QueryResult.UNUSED_CANDIDATES_KEY,
+                              **{str(qr.id): time.time() - 14 * 24 * 3600 for qr in query_results})
+
+    def result_exists(self, query_result):
+        return db.session.query(models.QueryResult.query.filter_by(id=query_result.id).exists()).scalar()
+
+    def test_deletes_old_unused_candidates(self):
+        unused_qr = self.factory.create_query_result(retrieved_at=self.two_weeks_ago)
+        used_qr = self.factory.create_query_result(retrieved_at=self.two_weeks_ago)
+        self.factory.create_query(latest_query_data=used_qr)
+        db.session.flush()
+        self.add_old_candidates(unused_qr, used_qr)
+
+        deleted = gc.QueryResultsCollector().run()
+
+        self.assertEqual(deleted, 1)
+        self.assertFalse(self.result_exists(unused_qr))
+        self.assertTrue(self.result_exists(used_qr))
+        self.assertEqual(redis_connection.zcard(models.QueryResult.UNUSED_CANDIDATES_KEY), 0)
+
+    def test_keeps_recent_candidates(self):
+        qr = self.factory.create_query_result(retrieved_at=self.two_weeks_ago)
+        db.session.flush()
+        models.QueryResult.add_unused_candidates([qr.id])
+
+        collector = gc.QueryResultsCollector()
+        with mock.patch.object(collector, '_sweep', return_value=False):
+            self.assertEqual(collector.run(), 0)
+
+        self.assertTrue(self.result_exists(qr))
+        self.assertEqual(redis_connection.zcard(models.QueryResult.UNUSED_CANDIDATES_KEY), 1)
+
+    def test_sweep_deletes_unused_results_in_batches(self):
+        unused = [self.factory.create_query_result(retrieved_at=self.two_weeks_ago - datetime.timedelta(minutes=i))
+                  for i in range(25)]
+        used_qr = self.factory.create_query_result(retrieved_at=self.two_weeks_ago)
+        self.factory.create_query(latest_query_data=used_qr)
+        new_qr = self.factory.create_query_result()
+        db.session.flush()
+
+        with mock.patch.object(settings, 'QUERY_RESULTS_CLEANUP_COUNT', 10), \
+                mock.patch.object(settings, 'QUERY_RESULTS_CLEANUP_MAX_BATCH_SIZE', 10):
+            deleted = gc.QueryResultsCollector().run()
+
+        self.assertEqual(deleted, 25)
+        self.assertFalse(any(self.result_exists(qr) for qr in unused))
+        self.assertTrue(self.result_exists(used_qr))
+        self.assertTrue(self.result_exists(new_qr))
+
+    def test_sweep_resumes_where_it_stopped(self):
+        qrs = [self.factory.create_query_result(retrieved_at=self.two_weeks_ago - datetime.timedelta(minutes=i))
+               for i in range(15)]
+        db.session.flush()
+
+        collector = gc.QueryResultsCollector()
+        collector.batch_size = 10
+        with mock.patch.object(collector, '_resize_batch'):
+            self.assertTrue(collector._sweep())
+
+        self.assertIsNotNone(redis_connection.get(gc.SWEEP_POSITION_KEY))
+        self.assertEqual(models.QueryResult.query.count(), 5)
+
+        oldest = sorted(qrs, key=lambda qr: qr.retrieved_at)[0]
+        self.assertFalse(self.result_exists(oldest))
+
+        with mock.patch.object(collector, '_resize_batch'):
+            self.assertFalse(collector._sweep())
+
+        self.assertEqual(models.QueryResult.query.count(), 0)
+
+    def test_sweep_only_goes_through_new_old_results_until_the_next_full_sweep(self):
+        swept = self.factory.create_query_result(retrieved_at=self.two_weeks_ago)
+        db.session.flush()
+
+        collector = gc.QueryResultsCollector()
+        with mock.patch.object(collector, '_delete') as delete:
+            self.assertFalse(collector._sweep())
+            delete.assert_called_once_with([swept.id])
+
+        older_qr = self.factory.create_query_result(retrieved_at=self.two_weeks_ago - datetime.timedelta(days=1))
+        newer_qr = self.factory.create_query_result(retrieved_at=self.two_weeks_ago + datetime.timedelta(days=1))
+        db.session.flush()
+
+        with mock.patch.object(collector, '_delete') as delete:
+            self.assertFalse(collector._sweep())
+            delete.assert_called_once_with([newer_qr.id])
+
+        with mock.patch.object(collector, '_delete') as delete, \
+                mock.patch('time.time', return_value=time.time() + 8 * 24 * 3600):
+            self.assertFalse(collector._sweep())
+            delete.assert_called_once_with([older_qr.id, swept.id, newer_qr.id])
+
+    def test_resizes_batches_towards_target_time(self):
+        collector = gc.QueryResultsCollector()
+        collector.batch_size = 100
+
+        with mock.patch.object(settings, 'QUERY_RESULTS_CLEANUP_BATCH_TIME', 1.0):
+            collector._resize_batch(0.1)
+            self.assertEqual(collector.batch_size, 200)
+
+            collector._resize_batch(1.25)
+            self.assertEqual(collector.batch_size, 160)
+
+            collector._resize_batch(10)
+            self.assertEqual(collector.batch_size, 80)
+
+        with mock.patch.object(settings, 'QUERY_RESULTS_CLEANUP_MAX_BATCH_SIZE', 100):
+            collector._resize_batch(0)
+            self.assertEqual(collector.batch_size, 100)
+
+    def test_reports_reclaimed_bytes(self):
+        qr = self.factory.create_query_result(retrieved_at=self.two_weeks_ago)
+        db.session.flush()
+
+        collector = gc.QueryResultsCollector()
+        with mock.patch.object(gc, 'statsd_client') as statsd_client:
+            collector.run()
+
+        self.assertGreater(collector.reclaimed_bytes, 0)
+        statsd_client.incr.assert_any_call('query_results_gc.reclaimed_bytes', collector.reclaimed_bytes)
+        statsd_client.gauge.assert_any_call('query_results_gc.backlog', 0)
+
+    def test_reports_reclaimed_bytes_of_externally_stored_results(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        with mock.patch.multiple(settings, QUERY_RESULTS_STORAGE='fs', QUERY_RESULTS_STORAGE_THRESHOLD=0), \
+                mock.patch.object(result_storage.get_storage('fs'), 'path', path):
+            qr = self.factory.create_query_result(retrieved_at=self.two_weeks_ago)
+            qr.data = '{"columns": [], "rows": []}'
+            db.session.flush()
+
+            self.assertIsNotNone(qr.data_location)
+            self.assertEqual(qr.data_size, len(result_storage.load(qr.data_location)[:]))
+
+            collector = gc.QueryResultsCollector()
+            collector._delete([qr.id])
+
+        self.assertGreaterEqual(collector.reclaimed_bytes, qr.data_size)
+
+    def test_deletes_orphaned_payloads_from_storage(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        with mock.patch.multiple(settings, QUERY_RESULTS_STORAGE='fs', QUERY_RESULTS_STORAGE_THRESHOLD=0), \
+                mock.patch.object(result_storage.get_storage('fs'), 'path', path):
+            used = self.factory.create_query_result(data_location=result_storage.store(StringIO('used'))[0])
+            orphan, _ = result_storage.store(StringIO('orphan'))
+            db.session.flush()
+
+            with mock.patch('time.time', return_value=time.time() + 14 * 24 * 3600):
+                gc.QueryResultsCollector(max_age=7).run()
+
+            self.assertEqual(result_storage.load(used.data_location)[:], 'used')
+            with self.assertRaises(IOError):
+                result_storage.load(orphan)
+
+    def test_deletes_temporary_files_of_dead_writers(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        os.mkdir(os.path.join(path, 'ab'))
+        with open(os.path.join(path, 'ab', 'tmpXYZ'), 'w'):
+            pass
+
+        with mock.patch.multiple(settings, QUERY_RESULTS_STORAGE='fs'), \
+                mock.patch.object(result_storage.get_storage('fs'), 'path', path):
+            with mock.patch('time.time', return_value=time.time() + 14 * 24 * 3600):
+                gc.QueryResultsCollector(max_age=7).run()
+
+        self.assertEqual(os.listdir(os.path.join(path, 'ab')), [])
+
+
+class TestStoreResultRecordsCandidates(BaseTestCase):
+    def candidates(self):
+        return [int(result_id) for result_id in
+                redis_connection.zrange(models.QueryResult.UNUSED_CANDIDATES_KEY, 0, -1)]
+
+    def test_records_replaced_results(self):
+        old_qr = self.factory.create_query_result()
+        query = self.factory.create_query(latest_query_data=old_qr)
+        db.session.flush()
+
+        new_qr, _ = models.QueryResult.store_result(query.org_id, query.data_source, query.query_hash,
+                                                     query.query_text, '{"columns": [], "rows": []}', 1, utcnow())
+
+        self.assertEqual(self.candidates(), [old_qr.id])
+
+    def test_records_results_no_query_uses(self):
+        qr, _ = models.QueryResult.store_result(self.factory.org.id, self.factory.data_source, 'hash', 'SELECT 1',
+                                                '{"columns": [], "rows": []}', 1, utcnow())
+
+        self.assertEqual(self.candidates(), [qr.id])
@@ -0,0 +1,59 @@
+import datetime
+import json
+from unittest import TestCase
+
+from redash.results import ResultSet
+
+
+class TestResultSet(TestCase):
+    def setUp(self):
+        self.columns = [{'name': 'a', 'friendly_name': 'a', 'type': 'integer'},
+                        {'name': 'b', 'friendly_name': 'b', 'type': 'string'}]
+
+    def test_serializes_to_row_oriented_json(self):
+        results = ResultSet(self.columns, [(1, 'x'), (2, u'\xe4'), (3, None)])
+
+        self.assertEqual(json.loads(results.to_json()), {
+            'columns': self.columns,
+            'rows': [{'a': 1, 'b': 'x'}, {'a': 2, 'b': u'\xe4'}, {'a': 3, 'b': None}]
+        })
+
+    def test_serializes_in_batches(self):
+        results = ResultSet(self.columns, [(i, 'x') for i in range(2500)])
+
+        rows = json.loads(results.to_json())['rows']
+        self.assertEqual([row['a'] for row in rows], range(2500))
+
+    def test_serializes_empty_result(self):
+        self.assertEqual(json.loads(ResultSet([]).to_json()), {'columns': [], 'rows': []})
+
+    def test_serializes_metadata(self):
+        results = ResultSet(self.columns, [(1, 'x')], metadata={'data_scanned': 10})
+
+        self.assertEqual(json.loads(results.to_json())['metadata'], {'data_scanned': 10})
+
+    def test_uses_given_encoder(self):
+        results = ResultSet([{'name': 'd'}], [(datetime.date(2018, 1, 2),)])
+
+        self.assertEqual(json.loads(results.to_json())['rows'], [{'d': '2018-01-02'}])
+
+    def test_from_dicts(self):
+        results = ResultSet.from_dicts(self.columns, [{'a': 1, 'b': 'x'}, {'b': 'y', 'c': 3}])
+
+        self.assertEqual(results.rows, [(1, 'x'), (None, 'y')])
+        self.assertIsNone(results.metadata)
+        self.assertEqual(ResultSet.from_dicts(self.columns, [], {'data_scanned': 10}).metadata, {'data_scanned': 10})
+
+    def test_from_json(self):
+        data = {'columns': self.columns, 'rows': [{'a': 1, 'b': 'x'}, {'a': 2}]}
+        results = ResultSet.from_json(json.dumps(data))
+
+        self.assertEqual(results.columns, self.columns)
+        self.assertEqual(results.rows, [(1, 'x'), (2, None)])
+        self.assertEqual(results.to_dict(), {'columns': self.columns,
+                                             'rows': [{'a': 1, 'b': 'x'}, {'a': 2, 'b': None}]})
+
+    def test_iter_batches(self):
+        results = ResultSet(self.columns, [(i, 'x') for i in range(5)])
+
+        self.assertEqual([len(batch) for batch in results.iter_batches(2)], [2, 2, 1])
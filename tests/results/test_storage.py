@@ -0,0 +1,80 @@
+import cStringIO
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+import mock
+
+from redash import settings
+from redash.results import storage
+
+
+class TestFileSystemResultStorage(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+        patcher = mock.patch.multiple(settings, QUERY_RESULTS_STORAGE='fs', QUERY_RESULTS_STORAGE_THRESHOLD=10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(storage.get_storage('fs'), 'path', self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_should_store_externally(self):
+        self.assertFalse(storage.should_store_externally(10))
+        self.assertTrue(storage.should_store_externally(11))
+
+        with mock.patch.object(settings, 'QUERY_RESULTS_STORAGE', ''):
+            self.assertFalse(storage.should_store_externally(11))
+
+    def test_store_and_load(self):
+        location, checksum = storage.store(cStringIO.StringIO('payload'))
+
+        self.assertTrue(location.startswith('fs:'))
+        self.assertEqual(storage.load(location)[:], 'payload')
+        self.assertEqual(checksum, hashlib.sha256('payload').hexdigest())
+
+    def test_verifies_checksum_on_first_load(self):
+        location, checksum = storage.store(cStringIO.StringIO('payload'))
+        self.assertEqual(storage.load(location, checksum)[:], 'payload')
+
+        with open(storage.get_storage('fs')._path(location.split(':')[1]), 'wb') as f:
+            f.write('paylo')
+        # Already verified by this process.
+        self.assertEqual(storage.load(location, checksum)[:], 'paylo')
+
+        storage._verified_locations.discard(location)
+        with self.assertRaises(storage.ChecksumMismatch):
+            storage.load(location, checksum)
+
+    def test_deletes_old_temporary_files(self):
+        location, _ = storage.store(cStringIO.StringIO('payload'))
+        directory = os.path.join(self.path, location.split(':')[1][:2])
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False):
+            pass
+
+        self.assertEqual(storage.delete_temporary_files(time.time() - 60), 0)
+        self.assertEqual(storage.delete_temporary_files(time.time() + 1), 1)
+        self.assertEqual(os.listdir(directory), [location.split(':')[1]])
+
+    def test_iter_locations(self):
+        locations = sorted(storage.store(cStringIO.StringIO('payload'))[0] for _ in range(3))
+
+        self.assertEqual(list(storage.iter_locations(time.time() + 1)), locations)
+        self.assertEqual(list(storage.iter_locations(time.time() + 1, after=locations[0])), locations[1:])
+        self.assertEqual(list(storage.iter_locations(time.time() - 60)), [])
+
+    def test_delete(self):
+        location, _ = storage.store(cStringIO.StringIO('payload'))
+        storage.delete([location, 'fs:missing'])
+
+        with self.assertRaises(IOError):
+            storage.load(location)
+
+    def test_delete_ignores_unknown_storage(self):
+        storage.delete(['unknown:key'])
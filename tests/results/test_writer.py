@@ -0,0 +1,105 @@
+import json
+from unittest import TestCase
+
+from redash.query_runner import BaseQueryRunner, QueryRunnerError
+from redash.results import QueryResultWriter, decode
+
+
+class FakeQueryRunner(BaseQueryRunner):
+    def __init__(self, data, error=None):
+        super(FakeQueryRunner, self).__init__({})
+        self.data = data
+        self.error = error
+
+    def run_query(self, query, user):
+        return self.data, self.error
+
+
+class TestQueryResultWriter(TestCase):
+    def setUp(self):
+        self.columns = [{'name': 'a', 'friendly_name': 'a', 'type': 'integer'},
+                        {'name': 'b', 'friendly_name': 'b', 'type': 'string'}]
+
+    def test_writes_batches_of_sequences(self):
+        writer = QueryResultWriter()
+        writer.consume(iter([self.columns, [(1, 'x'), (2, 'y')], [(3, u'\xe4')]]))
+
+        self.assertEqual(3, writer.row_count)
+        self.assertEqual(decode(writer.getvalue()), {
+            'columns': self.columns,
+            'rows': [{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'y'}, {'a': 3, 'b': u'\xe4'}]
+        })
+
+    def test_writes_batches_of_dicts(self):
+        writer = QueryResultWriter()
+        writer.consume(iter([self.columns, [{'a': 1, 'b': 'x'}], [], [{'a': 2}]]))
+
+        self.assertEqual(decode(writer.getvalue())['rows'], [{'a': 1, 'b': 'x'}, {'a': 2, 'b': None}])
+
+    def test_spills_to_disk(self):
+        writer = QueryResultWriter(spool_max_size=10, row_group_size=7)
+        writer.consume(iter([self.columns, [(i, 'x') for i in range(100)]]))
+
+        self.assertEqual(100, len(decode(writer.getvalue())['rows']))
+
+    def test_stops_at_max_rows(self):
+        def batches():
+            yield self.columns
+            for i in range(10):
+                yield [(i * 3 + j, 'x') for j in range(3)]
+
+        results = batches()
+        writer = QueryResultWriter()
+        writer.consume(results, max_rows=7)
+
+        self.assertTrue(writer.truncated)
+        self.assertEqual(7, writer.row_count)
+        self.assertEqual([r['a'] for r in decode(writer.getvalue())['rows']], range(7))
+        self.assertEqual(decode(writer.getvalue())['metadata'], {'truncated': True, 'row_limit': 7})
+        # Only the batches needed were consumed.
+        self.assertEqual(len(list(results)), 7)
+
+    def test_not_truncated_when_results_fit(self):
+        writer = QueryResultWriter()
+        writer.consume(iter([self.columns, [(1, 'x'), (2, 'y')], [(3, 'z')]]), max_rows=3)
+
+        self.assertFalse(writer.truncated)
+        self.assertEqual(3, writer.row_count)
+        self.assertNotIn('metadata', decode(writer.getvalue()))
+
+    def test_writes_metadata(self):
+        writer = QueryResultWriter()
+        writer.consume(iter([self.columns, {'data_scanned': 10}, [(1, 'x'), (2, 'y')]]), max_rows=1)
+
+        self.assertEqual(decode(writer.getvalue())['metadata'], {'data_scanned': 10, 'truncated': True, 'row_limit': 1})
+
+    def test_writes_empty_result(self):
+        writer = QueryResultWriter()
+        writer.consume(iter([]))
+
+        self.assertEqual(decode(writer.getvalue()), {'columns': [], 'rows': []})
+
+
+class TestRunQueryIter(TestCase):
+    def test_wraps_run_query(self):
+        data = {'columns': [{'name': 'a'}], 'rows': [{'a': i} for i in range(5)]}
+        runner = FakeQueryRunner(json.dumps(data))
+
+        results = list(runner.run_query_iter("SELECT 1", None))
+
+        self.assertEqual(results[0], data['columns'])
+        # Rows are returned as tuples in column order.
+        self.assertEqual(sum(results[1:], []), [(i,) for i in range(5)])
+
+    def test_yields_metadata(self):
+        data = {'columns': [{'name': 'a'}], 'rows': [{'a': 1}], 'metadata': {'data_scanned': 10}}
+        runner = FakeQueryRunner(json.dumps(data))
+
+        self.assertEqual(list(runner.run_query_iter("SELECT 1", None))[1], {'data_scanned': 10})
+        self.assertEqual(json.loads(runner._run_query_from_iter("SELECT 1", None)[0]), data)
+
+    def test_raises_errors(self):
+        runner = FakeQueryRunner(None, 'failed')
+
+        with self.assertRaises(QueryRunnerError):
+            list(runner.run_query_iter("SELECT 1", None))
@@ -1,5 +1,5 @@
 from tests import BaseTestCase
-from mock import MagicMock, ANY
+from mock import MagicMock, ANY, patch
 
 import redash.tasks.alerts
 from redash.tasks.alerts import check_alerts_for_query, notify_subscriptions, should_notify
@@ -25,6 +25,20 @@ class TestCheckAlertsForQuery(BaseTestCase):
 
         self.assertFalse(redash.tasks.alerts.notify_subscriptions.called)
 
+    def test_evaluates_alerts_against_stored_alert_values(self):
+        redash.tasks.alerts.notify_subscriptions = MagicMock()
+        alert_values = {'has_rows': True, 'values': {'foo': 1}}
+        query_result = self.factory.create_query_result(alert_values=alert_values)
+        query = self.factory.create_query(latest_query_data=query_result)
+        self.factory.create_alert(query_rel=query)
+        self.factory.create_alert(query_rel=query)
+
+        with patch.object(Alert, 'evaluate', return_value=Alert.OK_STATE) as evaluate:
+            check_alerts_for_query(query.id)
+
+        self.assertEqual(evaluate.call_count, 2)
+        evaluate.assert_called_with(alert_values)
+
 
 class TestNotifySubscriptions(BaseTestCase):
     def test_calls_notify_for_subscribers(self):
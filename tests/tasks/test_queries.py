@@ -1,13 +1,19 @@
 from unittest import TestCase
 from collections import namedtuple
+import datetime
+import json
+import threading
+import time
 import uuid
 
 import mock
+from celery.exceptions import Retry
 
 from tests import BaseTestCase
-from redash import redis_connection, models
+from redash import redis_connection, models, settings, utils
 from redash.query_runner.pg import PostgreSQL
-from redash.tasks.queries import QueryTaskTracker, enqueue_query, execute_query
+from redash.tasks.queries import (DataSourceSemaphore, QueryTask, QueryTaskTracker, cleanup_tasks, enqueue_query,
+                                  execute_query)
 
 
 class TestPrune(TestCase):
@@ -38,6 +44,168 @@ class TestPrune(TestCase):
             self.assertFalse(redis_connection.exists(k))
 
 
+class TestQueryTask(TestCase):
+    def test_reports_jobs_waiting_for_a_slot_as_pending(self):
+        async_result = mock.Mock(id='job')
+        async_result._get_task_meta.return_value = {'status': 'RETRY', 'result': Retry()}
+
+        job = QueryTask(async_result=async_result).to_dict()
+
+        self.assertEqual(job['status'], 1)
+        self.assertEqual(job['error'], '')
+        self.assertIsNone(job['query_result_id'])
+
+
+class TestQueryTaskTracker(BaseTestCase):
+    def setUp(self):
+        super(TestQueryTaskTracker, self).setUp()
+        redis_connection.delete(*QueryTaskTracker.ALL_LISTS)
+
+    def create_tracker(self, state='created'):
+        tracker = QueryTaskTracker.create(uuid.uuid4().hex, state, 'hash', 1, False, {'Username': 'Arik'})
+        tracker.save()
+        return tracker
+
+    def test_stores_tracker_as_hash(self):
+        tracker = self.create_tracker()
+        key_name = QueryTaskTracker._key_name(tracker.task_id)
+
+        self.assertEqual('hash', redis_connection.type(key_name))
+        loaded = QueryTaskTracker.get_by_task_id(tracker.task_id)
+        self.assertEqual(tracker.data, loaded.data)
+        self.assertIsNone(loaded.started_at)
+        self.assertFalse(loaded.scheduled)
+
+    def test_update_writes_changed_fields_and_moves_list(self):
+        tracker = self.create_tracker()
+        tracker.update(state='executing', started_at=10.5)
+
+        loaded = QueryTaskTracker.get_by_task_id(tracker.task_id)
+        self.assertEqual('executing', loaded.state)
+        self.assertEqual(10.5, loaded.started_at)
+        self.assertEqual('Arik', loaded.username)
+        self.assertEqual(0, redis_connection.zcard(QueryTaskTracker.WAITING_LIST))
+        self.assertEqual(1, redis_connection.zcard(QueryTaskTracker.IN_PROGRESS_LIST))
+
+    def test_reads_and_rewrites_legacy_trackers(self):
+        tracker = QueryTaskTracker.create(uuid.uuid4().hex, 'created', 'hash', 1, False, {})
+        key_name = QueryTaskTracker._key_name(tracker.task_id)
+        redis_connection.set(key_name, json.dumps(tracker.data))
+        redis_connection.zadd(QueryTaskTracker.WAITING_LIST, 1, key_name)
+
+        loaded, = QueryTaskTracker.all(QueryTaskTracker.WAITING_LIST)
+        self.assertEqual(tracker.task_id, loaded.task_id)
+
+        loaded.update(state='finished')
+        self.assertEqual('hash', redis_connection.type(key_name))
+        self.assertEqual('finished', QueryTaskTracker.get_by_task_id(tracker.task_id).state)
+
+    def test_all_skips_missing_trackers(self):
+        tracker = self.create_tracker()
+        redis_connection.zadd(QueryTaskTracker.WAITING_LIST, 1, QueryTaskTracker._key_name('missing'))
+
+        self.assertEqual([tracker.task_id], [t.task_id for t in QueryTaskTracker.all(QueryTaskTracker.WAITING_LIST)])
+
+    def test_cleanup_tasks_finishes_ready_tasks(self):
+        done = self.create_tracker('executing')
+        running = self.create_tracker('created')
+
+        ready = {done.task_id: True, running.task_id: False}
+        with mock.patch('redash.tasks.queries._tasks_ready', return_value=ready):
+            cleanup_tasks()
+
+        self.assertEqual('finished', QueryTaskTracker.get_by_task_id(done.task_id).state)
+        self.assertEqual('created', QueryTaskTracker.get_by_task_id(running.task_id).state)
+        self.assertEqual(1, redis_connection.zcard(QueryTaskTracker.DONE_LIST))
+
+
+class TestDataSourceSemaphore(TestCase):
+    def setUp(self):
+        self.data_source_id = uuid.uuid4().hex
+
+    def semaphore(self, job_id, limit=2, priority='interactive', fair_share=None):
+        return DataSourceSemaphore(self.data_source_id, limit, job_id, priority, fair_share)
+
+    def test_admits_up_to_limit(self):
+        self.assertEqual((True, 0), self.semaphore('a').try_acquire())
+        self.assertEqual((True, 0), self.semaphore('b').try_acquire())
+        self.assertEqual((False, 1), self.semaphore('c').try_acquire())
+
+        self.semaphore('a').release()
+        self.assertEqual((True, 0), self.semaphore('c').try_acquire())
+
+    def test_admits_waiting_jobs_in_order(self):
+        self.semaphore('a').try_acquire()
+        self.semaphore('b').try_acquire()
+        self.semaphore('c').try_acquire()
+        self.semaphore('d').try_acquire()
+
+        self.semaphore('a').release()
+        self.assertEqual((False, 2), self.semaphore('d').try_acquire())
+        self.assertEqual((True, 1), self.semaphore('c').try_acquire())
+
+    def test_gives_abandoned_slots_to_waiting_jobs(self):
+        with mock.patch('redash.settings.QUERY_CONCURRENCY_LEASE_TIME', -1):
+            self.semaphore('a', limit=1).try_acquire()
+
+        self.assertEqual((True, 0), self.semaphore('b', limit=1).try_acquire())
+
+    def test_no_limit(self):
+        for job_id in range(5):
+            self.assertEqual((True, 0), self.semaphore(job_id, limit=0).try_acquire())
+
+    def test_admits_higher_priority_jobs_first(self):
+        self.semaphore('a', limit=1).try_acquire(now=100)
+        self.semaphore('scheduled', limit=1, priority='scheduled').try_acquire(now=100)
+        self.semaphore('interactive', limit=1).try_acquire(now=110)
+
+        self.semaphore('a', limit=1).release()
+        self.assertEqual((False, 2), self.semaphore('scheduled', limit=1, priority='scheduled').try_acquire(now=120))
+        self.assertEqual((True, 1), self.semaphore('interactive', limit=1).try_acquire(now=120))
+
+    @mock.patch('redash.settings.QUERY_PRIORITY_DELAYS', {'interactive': 0, 'scheduled': 20})
+    def test_ages_lower_priority_jobs(self):
+        self.semaphore('a', limit=1).try_acquire(now=100)
+        self.semaphore('scheduled', limit=1, priority='scheduled').try_acquire(now=100)
+        self.semaphore('interactive', limit=1).try_acquire(now=125)
+
+        self.semaphore('a', limit=1).release()
+        self.assertEqual((True, 1), self.semaphore('scheduled', limit=1, priority='scheduled').try_acquire(now=125))
+
+    def test_shares_slots_between_users(self):
+        heavy = {'user:1': 60}
+        self.semaphore('a', limit=1, fair_share=heavy).try_acquire(now=100)
+        self.semaphore('b', limit=1, fair_share=heavy).try_acquire(now=100)
+        self.semaphore('c', limit=1, fair_share={'user:2': 60}).try_acquire(now=110)
+
+        self.semaphore('a', limit=1).release()
+        self.assertEqual((False, 2), self.semaphore('b', limit=1, fair_share=heavy).try_acquire(now=120))
+        self.assertEqual((True, 1), self.semaphore('c', limit=1).try_acquire(now=120))
+
+    def test_renews_lease_until_released(self):
+        semaphore = self.semaphore('a', limit=1)
+        with mock.patch('redash.settings.QUERY_CONCURRENCY_LEASE_TIME', 10):
+            semaphore.try_acquire(now=100)
+
+            self.assertTrue(semaphore.renew(now=200))
+            # The slot isn't abandoned at the end of the first lease:
+            self.assertEqual((False, 1), self.semaphore('b', limit=1).try_acquire(now=205))
+
+            semaphore.release()
+            self.assertFalse(semaphore.renew(now=210))
+
+    @mock.patch('redash.settings.QUERY_CONCURRENCY_LEASE_TIME', 1)
+    def test_acquire_renews_lease_in_background(self):
+        semaphore = self.semaphore('a', limit=1)
+        self.assertTrue(semaphore.acquire())
+
+        time.sleep(1.5)
+        self.assertEqual((False, 1), self.semaphore('b', limit=1).try_acquire())
+
+        semaphore.release()
+        self.assertEqual((True, 0), self.semaphore('b', limit=1).try_acquire())
+
+
 FakeResult = namedtuple('FakeResult', 'id')
 
 
@@ -73,6 +241,87 @@ class TestEnqueueTask(BaseTestCase):
         self.assertEqual(0, redis_connection.zcard(QueryTaskTracker.DONE_LIST))
 
 
+    def test_concurrent_enqueue_of_same_query(self):
+        query = self.factory.create_query()
+        data_source = query.data_source
+        execute_query.apply_async = mock.MagicMock(side_effect=gen_hash)
+        jobs = []
+
+        def enqueue():
+            jobs.append(enqueue_query(query.query_text, data_source, query.user_id, None, {'Query ID': query.id}))
+
+        metrics = []
+
+        with mock.patch('redash.tasks.queries.statsd_client.incr', side_effect=metrics.append):
+            threads = [threading.Thread(target=enqueue) for _ in range(200)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(1, execute_query.apply_async.call_count)
+        self.assertEqual(1, len(set(job.id for job in jobs)))
+        self.assertEqual(200, len(jobs))
+        self.assertEqual(1, metrics.count('enqueue_query.new_job'))
+        self.assertEqual(199, metrics.count('enqueue_query.existing_job'))
+
+    def test_replaces_job_which_is_done(self):
+        query = self.factory.create_query()
+        execute_query.apply_async = mock.MagicMock(side_effect=gen_hash)
+
+        job = enqueue_query(query.query_text, query.data_source, query.user_id, None, {'Query ID': query.id})
+        QueryTaskTracker.get_by_task_id(job.id).update(state='failed')
+        new_job = enqueue_query(query.query_text, query.data_source, query.user_id, None, {'Query ID': query.id})
+
+        self.assertNotEqual(job.id, new_job.id)
+        self.assertEqual(2, execute_query.apply_async.call_count)
+
+    def test_replaces_job_whose_tracker_has_no_state(self):
+        query = self.factory.create_query()
+        execute_query.apply_async = mock.MagicMock(side_effect=gen_hash)
+
+        job = enqueue_query(query.query_text, query.data_source, query.user_id, None, {'Query ID': query.id})
+        redis_connection.hdel(QueryTaskTracker._key_name(job.id), 'state')
+        new_job = enqueue_query(query.query_text, query.data_source, query.user_id, None, {'Query ID': query.id})
+
+        self.assertNotEqual(job.id, new_job.id)
+        self.assertEqual(2, execute_query.apply_async.call_count)
+
+    def test_records_priority_and_fair_share(self):
+        query = self.factory.create_query()
+        execute_query.apply_async = mock.MagicMock(side_effect=gen_hash)
+        self.factory.org.set_setting('query_fair_share_user_weights', {str(query.user_id): 2})
+
+        job = enqueue_query(query.query_text, query.data_source, query.user_id, query, {'Query ID': query.id})
+        tracker = QueryTaskTracker.get_by_task_id(job.id)
+
+        self.assertEqual('scheduled', tracker.priority)
+        self.assertEqual({'org:{}'.format(self.factory.org.id): 60, 'user:{}'.format(query.user_id): 30},
+                         tracker.fair_share)
+
+    def test_uses_queue_of_priority(self):
+        query = self.factory.create_query()
+        execute_query.apply_async = mock.MagicMock(side_effect=gen_hash)
+
+        with mock.patch.object(settings, 'QUERY_PRIORITY_QUEUES', {'dashboard': 'dashboard_queries'}):
+            enqueue_query(query.query_text, query.data_source, query.user_id, priority='dashboard')
+            enqueue_query('SELECT 2', query.data_source, query.user_id)
+
+        queues = [call[1]['queue'] for call in execute_query.apply_async.call_args_list]
+        self.assertEqual(['dashboard_queries', query.data_source.queue_name], queues)
+
+    def test_sends_priority_without_concurrency_limit(self):
+        query = self.factory.create_query()
+        execute_query.apply_async = mock.MagicMock(side_effect=gen_hash)
+
+        with mock.patch.object(settings, 'QUERY_CONCURRENCY_LIMIT', 0):
+            enqueue_query(query.query_text, query.data_source, query.user_id, priority='backfill')
+            enqueue_query('SELECT 2', query.data_source, query.user_id)
+
+        priorities = [call[1]['priority'] for call in execute_query.apply_async.call_args_list]
+        self.assertEqual([9, 0], priorities)
+
+
 class QueryExecutorTests(BaseTestCase):
 
     def test_success(self):
@@ -80,12 +329,46 @@ class QueryExecutorTests(BaseTestCase):
         ``execute_query`` invokes the query runner and stores a query result.
         """
         cm = mock.patch("celery.app.task.Context.delivery_info", {'routing_key': 'test'})
-        with cm, mock.patch.object(PostgreSQL, "run_query") as qr:
-            qr.return_value = ([1, 2], None)
+        columns = [{'name': 'a', 'friendly_name': 'a', 'type': None}]
+        with cm, mock.patch.object(PostgreSQL, "run_query_iter") as qr:
+            qr.return_value = iter([columns, [(1,), (2,)]])
             result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
             self.assertEqual(1, qr.call_count)
             result = models.QueryResult.query.get(result_id)
-            self.assertEqual(result.data, '{1,2}')
+            self.assertEqual(json.loads(result.data), {'columns': columns, 'rows': [{'a': 1}, {'a': 2}]})
+
+    def test_truncates_results_at_row_limit(self):
+        data_source = self.factory.create_data_source(row_limit=3)
+        cm = mock.patch("celery.app.task.Context.delivery_info", {'routing_key': 'test'})
+        columns = [{'name': 'a', 'friendly_name': 'a', 'type': None}]
+        with cm, mock.patch.object(PostgreSQL, "run_query_iter") as qr:
+            qr.return_value = iter([columns, [(1,), (2,)], [(3,), (4,)], [(5,)]])
+            result_id = execute_query("SELECT 1, 2", data_source.id, {})
+            result = models.QueryResult.query.get(result_id)
+            self.assertEqual(json.loads(result.data)['rows'], [{'a': 1}, {'a': 2}, {'a': 3}])
+            self.assertEqual(json.loads(result.data)['metadata'], {'truncated': True, 'row_limit': 3})
+
+    def test_releases_concurrency_slot(self):
+        data_source = self.factory.create_data_source(concurrency_limit=1)
+        cm = mock.patch("celery.app.task.Context.delivery_info", {'routing_key': 'test'})
+        with cm, mock.patch.object(PostgreSQL, "run_query_iter") as qr:
+            qr.side_effect = ValueError("broken")
+            result = execute_query("SELECT 1, 2", data_source.id, {})
+
+        self.assertIsInstance(result, Exception)
+        self.assertEqual((True, 0), DataSourceSemaphore(data_source.id, 1, 'other').try_acquire())
+
+    def test_requeues_when_no_slot_is_free(self):
+        data_source = self.factory.create_data_source(concurrency_limit=1)
+        DataSourceSemaphore(data_source.id, 1, 'other').try_acquire()
+        cm = mock.patch("celery.app.task.Context.delivery_info", {'routing_key': 'test'})
+        with cm, mock.patch.object(PostgreSQL, "run_query_iter") as qr, \
+                mock.patch.object(execute_query, 'retry', return_value=Retry()) as retry:
+            with self.assertRaises(Retry):
+                execute_query("SELECT 1, 2", data_source.id, {})
+
+        self.assertFalse(qr.called)
+        retry.assert_called_once_with(countdown=settings.QUERY_CONCURRENCY_POLL_INTERVAL, max_retries=None)
 
     def test_success_scheduled(self):
         """
@@ -94,8 +377,8 @@ class QueryExecutorTests(BaseTestCase):
         cm = mock.patch("celery.app.task.Context.delivery_info",
                         {'routing_key': 'test'})
         q = self.factory.create_query(query_text="SELECT 1, 2", schedule=300)
-        with cm, mock.patch.object(PostgreSQL, "run_query") as qr:
-            qr.return_value = ([1, 2], None)
+        with cm, mock.patch.object(PostgreSQL, "run_query_iter") as qr:
+            qr.return_value = iter([[{'name': 'a', 'friendly_name': 'a', 'type': None}], [(1,), (2,)]])
             result_id = execute_query(
                 "SELECT 1, 2",
                 self.factory.data_source.id, {},
@@ -112,8 +395,8 @@ class QueryExecutorTests(BaseTestCase):
         cm = mock.patch("celery.app.task.Context.delivery_info",
                         {'routing_key': 'test'})
         q = self.factory.create_query(query_text="SELECT 1, 2", schedule=300)
-        with cm, mock.patch.object(PostgreSQL, "run_query") as qr:
-            qr.exception = ValueError("broken")
+        with cm, mock.patch.object(PostgreSQL, "run_query_iter") as qr:
+            qr.side_effect = ValueError("broken")
             execute_query("SELECT 1, 2", self.factory.data_source.id, {}, scheduled_query_id=q.id)
             q = models.Query.get_by_id(q.id)
             self.assertEqual(q.schedule_failures, 1)
@@ -121,6 +404,19 @@ class QueryExecutorTests(BaseTestCase):
             q = models.Query.get_by_id(q.id)
             self.assertEqual(q.schedule_failures, 2)
 
+    def test_failure_scheduled_postpones_next_run(self):
+        cm = mock.patch("celery.app.task.Context.delivery_info",
+                        {'routing_key': 'test'})
+        retrieved_at = utils.utcnow() - datetime.timedelta(days=1)
+        q = self.factory.create_query(query_text="SELECT 1, 2", schedule="300",
+                                      latest_query_data=self.factory.create_query_result(retrieved_at=retrieved_at))
+        with cm, mock.patch.object(PostgreSQL, "run_query_iter") as qr:
+            qr.side_effect = ValueError("broken")
+            execute_query("SELECT 1, 2", self.factory.data_source.id, {}, scheduled_query_id=q.id)
+
+        q = models.Query.get_by_id(q.id)
+        self.assertGreater(q.next_run_at, utils.utcnow() + datetime.timedelta(minutes=5))
+
     def test_success_after_failure(self):
         """
         Query execution success resets the failure counter.
@@ -128,16 +424,16 @@ class QueryExecutorTests(BaseTestCase):
         cm = mock.patch("celery.app.task.Context.delivery_info",
                         {'routing_key': 'test'})
         q = self.factory.create_query(query_text="SELECT 1, 2", schedule=300)
-        with cm, mock.patch.object(PostgreSQL, "run_query") as qr:
-            qr.exception = ValueError("broken")
+        with cm, mock.patch.object(PostgreSQL, "run_query_iter") as qr:
+            qr.side_effect = ValueError("broken")
             execute_query("SELECT 1, 2",
                           self.factory.data_source.id, {},
                           scheduled_query_id=q.id)
             q = models.Query.get_by_id(q.id)
             self.assertEqual(q.schedule_failures, 1)
 
-        with cm, mock.patch.object(PostgreSQL, "run_query") as qr:
-            qr.return_value = ([1, 2], None)
+        with cm, mock.patch.object(PostgreSQL, "run_query_iter") as qr:
+            qr.return_value = iter([[{'name': 'a', 'friendly_name': 'a', 'type': None}], [(1,), (2,)]])
             execute_query("SELECT 1, 2",
                           self.factory.data_source.id, {},
                           scheduled_query_id=q.id)
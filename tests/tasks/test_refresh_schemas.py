@@ -1,9 +1,13 @@
 import datetime
+import json
 
 from mock import ANY, call, patch
 from tests import BaseTestCase
 
+from redash import redis_connection
+from redash.schema_cache import SchemaCache
 from redash.tasks import refresh_schemas
+from redash.tasks.queries import refresh_schema
 
 
 class TestRefreshSchemas(BaseTestCase):
@@ -25,3 +29,54 @@ class TestRefreshSchemas(BaseTestCase):
         with patch('redash.tasks.queries.refresh_schema.apply_async') as refresh_job:
             refresh_schemas()
             refresh_job.assert_called()
+
+    def test_skips_data_sources_being_refreshed(self):
+        self.factory.data_source # trigger creation
+
+        with patch('redash.tasks.queries.refresh_schema.apply_async') as refresh_job:
+            refresh_schemas()
+            refresh_schemas()
+            self.assertEqual(refresh_job.call_count, 1)
+
+        with patch('redash.models.DataSource.refresh_schema', return_value=None):
+            refresh_schema(self.factory.data_source.id)
+
+        with patch('redash.tasks.queries.refresh_schema.apply_async') as refresh_job:
+            refresh_schemas()
+            refresh_job.assert_called()
+
+
+class TestRefreshSchema(BaseTestCase):
+    def test_skips_unchanged_schema(self):
+        schema = [{'name': 'table', 'columns': []}]
+        data_source = self.factory.data_source
+
+        with patch('redash.query_runner.pg.PostgreSQL.get_schema', return_value=schema) as get_schema, \
+                patch('redash.query_runner.pg.PostgreSQL.get_schema_change_marker', return_value='1:2'):
+            refresh_schema(data_source.id)
+            refresh_schema(data_source.id)
+            self.assertEqual(get_schema.call_count, 1)
+
+        with patch('redash.query_runner.pg.PostgreSQL.get_schema', return_value=schema) as get_schema, \
+                patch('redash.query_runner.pg.PostgreSQL.get_schema_change_marker', return_value='1:3'):
+            refresh_schema(data_source.id)
+            self.assertEqual(get_schema.call_count, 1)
+
+        self.assertEqual(SchemaCache(data_source.id).marker, '1:3')
+
+    def test_always_reloads_without_marker(self):
+        with patch('redash.query_runner.pg.PostgreSQL.get_schema', return_value=[]) as get_schema, \
+                patch('redash.query_runner.pg.PostgreSQL.get_schema_change_marker', return_value=None):
+            refresh_schema(self.factory.data_source.id)
+            refresh_schema(self.factory.data_source.id)
+            self.assertEqual(get_schema.call_count, 2)
+
+    def test_reports_refresh_time_and_size(self):
+        schema = [{'name': 'table', 'columns': ['id']}]
+        with patch('redash.query_runner.pg.PostgreSQL.get_schema', return_value=schema), \
+                patch('redash.query_runner.pg.PostgreSQL.get_schema_change_marker', return_value=None), \
+                patch('redash.tasks.queries.statsd_client') as statsd_client:
+            refresh_schema(self.factory.data_source.id)
+
+        statsd_client.gauge.assert_called_with(ANY, len(json.dumps(schema[0], sort_keys=True)))
+        self.assertTrue(statsd_client.timing.called)
@@ -1,3 +1,4 @@
+import json
 import mock
 import textwrap
 from click.testing import CliRunner
@@ -407,3 +408,23 @@ class UserCommandTests(BaseTestCase):
         db.session.add(u)
         self.assertEqual(u.group_ids, [u.org.default_group.id,
                                        u.org.admin_group.id])
+
+
+class QueriesCommandTests(BaseTestCase):
+    def test_benchmark_scheduling(self):
+        jobs = [{'arrival': 0, 'run_time': 100, 'priority': 'scheduled'},
+                {'arrival': 0, 'run_time': 100, 'priority': 'scheduled'},
+                {'arrival': 10, 'run_time': 10, 'priority': 'interactive'}]
+        runner = CliRunner()
+        with runner.isolated_filesystem():
+            with open('jobs.json', 'w') as f:
+                f.write('\n'.join(json.dumps(job) for job in jobs))
+
+            result = runner.invoke(manager, ['queries', 'benchmark_scheduling', 'jobs.json',
+                                             '--concurrency-limit', '1'])
+
+        self.assertFalse(result.exception)
+        self.assertEqual(result.exit_code, 0)
+        lines = result.output.splitlines()
+        self.assertEqual(['interactive', '1', '90.0', '90.0', '90.0'], lines[1].split())
+        self.assertEqual(['scheduled', '2', '110.0', '110.0', '110.0'], lines[2].split())
@@ -1,14 +1,17 @@
 #encoding: utf8
 import datetime
 import json
+import shutil
+import tempfile
 from unittest import TestCase
 
 import mock
 from dateutil.parser import parse as date_parse
 from tests import BaseTestCase
 
-from redash import models
+from redash import models, settings
 from redash.models import db
+from redash.results import storage as result_storage
 from redash.utils import gen_query_hash, utcnow
 
 
@@ -193,6 +196,52 @@ class QueryOutdatedQueriesTest(BaseTestCase):
         self.assertEqual(list(models.Query.outdated_queries()), [query])
 
 
+    def test_keeps_next_run_time_up_to_date(self):
+        query = self.factory.create_query(schedule="3600")
+        db.session.flush()
+        self.assertIsNone(query.next_run_at)
+
+        retrieved_at = utcnow() - datetime.timedelta(minutes=10)
+        query.latest_query_data = self.factory.create_query_result(retrieved_at=retrieved_at)
+        db.session.flush()
+        self.assertEqual(query.next_run_at, retrieved_at + datetime.timedelta(hours=1))
+
+        failed_at = utcnow()
+        query.schedule_failures = 1
+        with mock.patch('redash.models.utils.utcnow', return_value=failed_at):
+            db.session.flush()
+        self.assertEqual(query.next_run_at, failed_at + datetime.timedelta(hours=1, minutes=2))
+
+        query.schedule = None
+        db.session.flush()
+        self.assertIsNone(query.next_run_at)
+
+    def test_postpones_failing_queries_from_their_last_attempt(self):
+        retrieved_at = utcnow() - datetime.timedelta(days=2)
+        query = self.factory.create_query(schedule="60",
+                                          latest_query_data=self.factory.create_query_result(retrieved_at=retrieved_at))
+        db.session.flush()
+        self.assertLess(query.next_run_at, utcnow())
+
+        query.schedule_failures = 3
+        db.session.flush()
+        self.assertGreater(query.next_run_at, utcnow() + datetime.timedelta(minutes=8))
+
+        with mock.patch.object(models.scheduled_queries_executions, 'refresh'):
+            self.assertEqual(list(models.Query.outdated_queries()), [])
+
+    def test_loads_only_due_queries(self):
+        retrieved_at = utcnow() - datetime.timedelta(minutes=10)
+        query_result = self.factory.create_query_result(retrieved_at=retrieved_at)
+        due = self.factory.create_query(schedule="60", latest_query_data=query_result)
+        self.factory.create_query(schedule="3600", latest_query_data=query_result)
+
+        with mock.patch.object(models.scheduled_queries_executions, 'refresh') as refresh:
+            self.assertEqual(list(models.Query.outdated_queries()), [due])
+
+        refresh.assert_called_once_with([due.id])
+
+
 class QueryArchiveTest(BaseTestCase):
     def setUp(self):
         super(QueryArchiveTest, self).setUp()
@@ -400,6 +449,66 @@ class TestQueryResultStoreResult(BaseTestCase):
         self.assertEqual(query_result.query_hash, self.query_hash)
         self.assertEqual(query_result.data_source, self.data_source)
 
+    def test_stores_query_results_encoded(self):
+        data = {'columns': [{'name': 'a', 'friendly_name': 'a', 'type': 'integer'}], 'rows': [{'a': 1}, {'a': 2}]}
+
+        query_result, _ = models.QueryResult.store_result(
+            self.data_source.org_id, self.data_source, self.query_hash,
+            self.query, json.dumps(data), self.runtime, self.utcnow)
+        db.session.commit()
+        query_result = models.QueryResult.query.get(query_result.id)
+
+        self.assertIsNone(query_result._data)
+        self.assertIsNotNone(query_result.encoded_data)
+        self.assertEqual(query_result.load_data(), data)
+        self.assertEqual(json.loads(query_result.data), data)
+
+    def test_stores_large_query_results_externally(self):
+        data = {'columns': [{'name': 'a', 'friendly_name': 'a', 'type': 'integer'}], 'rows': [{'a': 1}, {'a': 2}]}
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        with mock.patch.multiple(settings, QUERY_RESULTS_STORAGE='fs', QUERY_RESULTS_STORAGE_THRESHOLD=0), \
+                mock.patch.object(result_storage.get_storage('fs'), 'path', path):
+            query_result, _ = models.QueryResult.store_result(
+                self.data_source.org_id, self.data_source, self.query_hash,
+                self.query, json.dumps(data), self.runtime, self.utcnow)
+            db.session.commit()
+            query_result = models.QueryResult.query.get(query_result.id)
+
+            self.assertIsNone(query_result.encoded_data)
+            self.assertTrue(query_result.data_location.startswith('fs:'))
+            self.assertEqual(query_result.load_data(), data)
+
+    def test_deletes_externally_stored_results_on_rollback(self):
+        data = {'columns': [{'name': 'a', 'friendly_name': 'a', 'type': 'integer'}], 'rows': [{'a': 1}, {'a': 2}]}
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        with mock.patch.multiple(settings, QUERY_RESULTS_STORAGE='fs', QUERY_RESULTS_STORAGE_THRESHOLD=0), \
+                mock.patch.object(result_storage.get_storage('fs'), 'path', path):
+            query_result, _ = models.QueryResult.store_result(
+                self.data_source.org_id, self.data_source, self.query_hash,
+                self.query, json.dumps(data), self.runtime, self.utcnow)
+            location = query_result.data_location
+            db.session.rollback()
+
+            with self.assertRaises(IOError):
+                result_storage.load(location)
+
+    def test_streams_csv_content_in_chunks(self):
+        data = {'columns': [{'name': 'a', 'friendly_name': 'a', 'type': 'integer'}],
+                'rows': [{'a': i} for i in range(100)]}
+        query_result, _ = models.QueryResult.store_result(
+            self.data_source.org_id, self.data_source, self.query_hash,
+            self.query, json.dumps(data), self.runtime, self.utcnow)
+
+        with mock.patch.object(models, 'CSV_CHUNK_SIZE', 50):
+            chunks = list(query_result.iter_csv_content())
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), 'a\r\n' + ''.join('{}\r\n'.format(i) for i in range(100)))
+
     def test_updates_existing_queries(self):
         query1 = self.factory.create_query(query_text=self.query)
         query2 = self.factory.create_query(query_text=self.query)
@@ -439,6 +548,31 @@ class TestQueryResultStoreResult(BaseTestCase):
         self.assertEqual(query2.latest_query_data, query_result)
         self.assertNotEqual(query3.latest_query_data, query_result)
 
+    def test_returns_updated_query_ids(self):
+        query1 = self.factory.create_query(query_text=self.query)
+        query2 = self.factory.create_query(query_text=self.query)
+        self.factory.create_query(query_text=self.query + "123")
+
+        _, query_ids = models.QueryResult.store_result(
+            self.data_source.org_id, self.data_source, self.query_hash,
+            self.query, self.data, self.runtime, self.utcnow)
+
+        self.assertItemsEqual([query1.id, query2.id], query_ids)
+
+    def test_updates_next_run_time_of_scheduled_queries(self):
+        query = self.factory.create_query(query_text=self.query, schedule="3600", schedule_failures=1)
+        unscheduled_query = self.factory.create_query(query_text=self.query)
+        query.schedule_failures = 0
+
+        models.QueryResult.store_result(
+            self.data_source.org_id, self.data_source, self.query_hash,
+            self.query, self.data, self.runtime, self.utcnow)
+
+        self.assertEqual(query.next_run_at, self.utcnow + datetime.timedelta(hours=1))
+        self.assertIsNone(unscheduled_query.next_run_at)
+        db.session.commit()
+        self.assertEqual(models.Query.query.get(query.id).next_run_at, self.utcnow + datetime.timedelta(hours=1))
+
 
 class TestEvents(BaseTestCase):
     def raw_event(self):
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from tests import BaseTestCase
+
+from redash import redis_connection
+from redash.schema_cache import SchemaCache
+
+
+class TestSchemaCache(BaseTestCase):
+    def setUp(self):
+        super(TestSchemaCache, self).setUp()
+        self.cache = SchemaCache(self.factory.data_source.id)
+        self.schema = [
+            {'name': 'public.users', 'columns': ['id', 'name']},
+            {'name': 'public.events', 'columns': ['id', 'user_id', 'created_at']},
+            {'name': u'public.caf\xe9', 'columns': ['id']},
+        ]
+
+    def test_version_is_none_until_updated(self):
+        self.assertIsNone(self.cache.version)
+
+        self.cache.update([])
+
+        self.assertEqual(self.cache.version, 0)
+        self.assertEqual(self.cache.get_tables(), [])
+
+    def test_returns_tables_sorted_by_name(self):
+        self.cache.update(self.schema)
+
+        self.assertEqual(self.cache.get_tables(), sorted(self.schema, key=lambda t: t['name']))
+        self.assertEqual(self.cache.get_tables(['public.users', 'missing']), [self.schema[0]])
+
+    def test_only_writes_changed_tables(self):
+        self.assertTrue(self.cache.update(self.schema))
+        version = self.cache.version
+
+        self.assertFalse(self.cache.update(list(reversed(self.schema))))
+        self.assertEqual(self.cache.version, version)
+
+        schema = [{'name': 'public.users', 'columns': ['id', 'name', 'email']}, self.schema[2]]
+        self.assertTrue(self.cache.update(schema))
+        self.assertEqual(self.cache.version, version + 1)
+        self.assertEqual(self.cache.get_tables(), sorted(schema, key=lambda t: t['name']))
+        self.assertEqual(redis_connection.hlen(self.cache.checksums_key), 2)
+
+    def test_search(self):
+        self.cache.update(self.schema)
+
+        self.assertEqual(self.cache.search(), (3, [u'public.caf\xe9', 'public.events', 'public.users']))
+        self.assertEqual(self.cache.search('USER'), (1, ['public.users']))
+        self.assertEqual(self.cache.search(offset=1, limit=1), (3, ['public.events']))
+
+    def test_replaces_legacy_cache(self):
+        redis_connection.set(self.cache.legacy_key, '[]')
+
+        self.cache.update(self.schema)
+
+        self.assertFalse(redis_connection.exists(self.cache.legacy_key))
+
+    def test_delete(self):
+        self.cache.update(self.schema)
+        self.cache.delete()
+
+        self.assertIsNone(self.cache.version)
+        self.assertEqual(self.cache.get_tables(), [])